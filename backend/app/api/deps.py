@@ -1,14 +1,14 @@
-from fastapi import Depends, HTTPException, status, Header
+from fastapi import Depends, HTTPException, status, Header, Query
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_
-from typing import Optional
+from sqlalchemy import select
+from typing import List, Optional
 import uuid
 
 from app.db.postgres import get_db
 from app.core.security import decode_access_token
 from app.models.user import User
-from app.models.family import FamilyRelation
+from app.services.family_service import family_service
 
 security = HTTPBearer()
 
@@ -82,16 +82,7 @@ async def get_profile_user_id(
         return current_user.id
     
     # Check if current user has access to this profile
-    relation_query = select(FamilyRelation).where(
-        and_(
-            FamilyRelation.owner_id == current_user.id,
-            FamilyRelation.member_id == profile_id
-        )
-    )
-    result = await db.execute(relation_query)
-    relation = result.scalar_one_or_none()
-    
-    if not relation:
+    if not await family_service.check_profile_access(current_user.id, profile_id, db):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="You don't have access to this profile"
@@ -99,3 +90,27 @@ async def get_profile_user_id(
     
     return profile_id
 
+
+async def get_profile_user_ids(
+    profile_id: List[uuid.UUID] = Query(
+        ...,
+        description="Profile IDs (repeat the parameter for each profile)"
+    ),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+) -> List[uuid.UUID]:
+    """
+    Get several profile user IDs for a family-wide request.
+    Access to all of them is validated at once against the user's
+    family relations; duplicates are dropped, order is preserved.
+    """
+    profile_ids = list(dict.fromkeys(profile_id))
+    
+    denied = await family_service.get_inaccessible_profiles(current_user.id, profile_ids, db)
+    if denied:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=f"You don't have access to profiles: {', '.join(str(item) for item in denied)}"
+        )
+    
+    return profile_ids
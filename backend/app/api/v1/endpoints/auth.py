@@ -12,6 +12,7 @@ from app.schemas.user import UserCreate, UserLogin, User as UserSchema, Token, U
 from app.core.security import get_password_hash, verify_password, create_access_token
 from app.core.config import settings
 from app.api.deps import get_current_user
+from app.services.family_service import family_service
 
 router = APIRouter()
 
@@ -120,6 +121,9 @@ async def update_current_user(
         current_user.gender = GenderEnum(user_update.gender)
     
     await db.commit()
+    # Профиль показывается в списках семьи связанных пользователей
+    graph = await family_service.get_access_graph(current_user.id, db)
+    family_service.invalidate_access_graph(*graph.related_ids)
     await db.refresh(current_user)
     
     return current_user
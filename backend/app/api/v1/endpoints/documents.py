@@ -14,12 +14,14 @@ from app.models.user import User
 from app.schemas.document import (
     Document as DocumentSchema,
     DocumentWithMetadata,
-    DocumentUploadResponse
+    DocumentUploadResponse,
+    BatchUploadItem,
+    BatchUploadResponse
 )
 from app.services.document_service import DocumentService
 from app.services.unit_normalization_service import unit_normalization_service
 from app.services.analyte_normalization_service_db import analyte_normalization_service_db
-from app.api.deps import get_current_user, get_profile_user_id
+from app.api.deps import get_current_user, get_profile_user_id, get_profile_user_ids
 from app.db.mongodb import document_metadata_collection
 
 router = APIRouter()
@@ -60,6 +62,46 @@ async def upload_document(
             detail=f"Ошибка при загрузке документа: {str(e)}"
         )
 
+@router.post("/upload/batch", response_model=BatchUploadResponse)
+async def upload_documents_batch(
+    files: List[UploadFile] = File(...),
+    current_user: User = Depends(get_current_user),
+    profile_user_id: uuid.UUID = Depends(get_profile_user_id),
+    db: AsyncSession = Depends(get_db)
+):
+    """Upload several documents at once
+    
+    Returns a status per file: "pending" (stored, AI processing queued),
+    "duplicate" (already uploaded) or "error". Poll GET /documents/{id}
+    for processing_status of the accepted documents.
+    
+    Use X-Profile-Id header to upload to a family member's profile.
+    """
+    
+    try:
+        items = await DocumentService.upload_documents_batch(
+            files=files,
+            user_id=profile_user_id,
+            db=db
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Ошибка при загрузке документов: {str(e)}"
+        )
+    
+    return BatchUploadResponse(
+        accepted=sum(1 for item in items if item["status"] == "pending"),
+        duplicates=sum(1 for item in items if item["status"] == "duplicate"),
+        failed=sum(1 for item in items if item["status"] == "error"),
+        items=[BatchUploadItem(**item) for item in items]
+    )
+
 @router.get("/", response_model=List[DocumentWithMetadata])
 async def get_documents(
     skip: int = Query(0, ge=0),
@@ -283,13 +325,12 @@ async def download_document(
     
     # Get file from MinIO
     try:
-        print(f"📥 Downloading file: {document.file_url}")
-        print(f"   Document ID: {document.id}")
-        print(f"   Filename: {document.original_filename}")
-        
         file_content = DocumentService.get_file_from_minio(document.file_url)
         
-        print(f"   ✅ File downloaded: {len(file_content)} bytes")
+        logger.debug(
+            "Document file downloaded",
+            extra={"document_id": str(document.id), "size": len(file_content)}
+        )
         
         # Determine content type
         content_types = {
@@ -302,9 +343,6 @@ async def download_document(
         
         content_type = content_types.get(document.file_type, 'application/octet-stream')
         
-        print(f"   Content-Type: {content_type}")
-        print(f"   Creating StreamingResponse...")
-        
         # Encode filename for Content-Disposition header (RFC 5987)
         # This supports UTF-8 filenames including Cyrillic
         encoded_filename = quote(document.original_filename)
@@ -318,12 +356,10 @@ async def download_document(
         )
     
     except Exception as e:
-        print(f"❌ Error downloading file:")
-        print(f"   Document ID: {document_id}")
-        print(f"   File URL: {document.file_url if document else 'N/A'}")
-        print(f"   Error: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(
+            "Error downloading file",
+            extra={"document_id": str(document_id), "file_url": document.file_url if document else None}
+        )
         
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -354,6 +390,46 @@ async def delete_document(
     return None
 
 
+@router.post("/{document_id}/retry", response_model=DocumentUploadResponse)
+async def retry_document_processing(
+    document_id: uuid.UUID,
+    current_user: User = Depends(get_current_user),
+    profile_user_id: uuid.UUID = Depends(get_profile_user_id),
+    db: AsyncSession = Depends(get_db)
+):
+    """Queue AI processing again for a document
+    
+    Allowed for documents with processing_status 'failed' and for orphaned
+    ones ('pending'/'processing' without changes for longer than
+    DOCUMENT_PROCESSING_STALE_SECONDS, e.g. after a restart).
+    Poll GET /documents/{id} for processing_status.
+    """
+    
+    try:
+        document = await DocumentService.retry_processing(
+            document_id=document_id,
+            user_id=profile_user_id,
+            db=db
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=str(e)
+        )
+    
+    if not document:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Документ не найден"
+        )
+    
+    return DocumentUploadResponse(
+        document_id=document.id,
+        status=document.processing_status,
+        message="Документ поставлен в очередь на повторную обработку"
+    )
+
+
 @router.get("/{document_id}/labs")
 async def get_document_labs(
     document_id: uuid.UUID,
@@ -582,41 +658,37 @@ async def debug_analytes_mapping(
     }
 
 
-@router.get("/labs/timeseries")
-async def get_lab_timeseries(
-    analyte: str = Query(..., description="Каноническое название анализа, например: Гемоглобин"),
-    current_user: User = Depends(get_current_user),
-    profile_user_id: uuid.UUID = Depends(get_profile_user_id),
-    db: AsyncSession = Depends(get_db),
-):
-    """Return time series for a given analyte across user's documents.
-    
-    All values are converted to standard units automatically.
-    
-    Response:
-    {
-        "analyte": "Гемоглобин",
-        "standard_unit": "г/л",
-        "category": "Общий анализ крови",
-        "reference_min": 120.0,
-        "reference_max": 160.0,
-        "points": [
-            {
-                "date": "2024-01-15",
-                "value_num": 145.0,
-                "unit": "г/л",
-                "document_id": "...",
-                "reference_range": "120-160",
-                "flag": "N"
-            }
-        ]
-    }
+# Анализы с двумя версиями (% и абс): в MongoDB может быть "Нейтрофилы" с unit="%",
+# а не "Нейтрофилы %" как синоним, поэтому ищем и по синонимам парного анализа
+_DUAL_ANALYTES = {
+    "Лимфоциты (%)": "Лимфоциты (абс)",
+    "Лимфоциты (абс)": "Лимфоциты (%)",
+    "Нейтрофилы (%)": "Нейтрофилы (абс)",
+    "Нейтрофилы (абс)": "Нейтрофилы (%)",
+    "Моноциты (%)": "Моноциты (абс)",
+    "Моноциты (абс)": "Моноциты (%)",
+    "Эозинофилы (%)": "Эозинофилы (абс)",
+    "Эозинофилы (абс)": "Эозинофилы (%)",
+    "Базофилы (%)": "Базофилы (абс)",
+    "Базофилы (абс)": "Базофилы (%)",
+}
+
+
+async def _collect_lab_timeseries(
+    analyte: str,
+    profile_user_ids: List[uuid.UUID],
+    db: AsyncSession,
+) -> dict:
+    """Time series of an analyte for one or several profiles.
+    
+    MongoDB, document dates, profile genders and the reference standard are
+    each fetched with one query for all profiles. Returns analyte info and
+    {"profiles": {profile_id: {"reference_min", "reference_max", "points"}}}.
     """
-    # Получаем информацию о пользователе (для определения пола)
-    from sqlalchemy import select as sql_select
-    user_query = sql_select(User).where(User.id == profile_user_id)
-    user_result = await db.execute(user_query)
-    profile_user = user_result.scalar_one_or_none()
+    import re
+    from sqlalchemy import select
+    from app.models.analyte import AnalyteStandard
+    from app.models.document import Document as DocumentModel
     
     # Получаем данные анализа из справочника
     analyte_data = analyte_normalization_service_db.get_analyte(analyte)
@@ -632,25 +704,8 @@ async def get_lab_timeseries(
         standard_unit = analyte_data.standard_unit
         category = analyte_data.category_name
         
-        # Для анализов с двойными версиями (% и абс) добавляем синонимы парного анализа
-        # Это нужно потому что в MongoDB может быть "Нейтрофилы" с unit="%" 
-        # а не "Нейтрофилы %" как синоним
-        dual_pairs = {
-            "Лимфоциты (%)": "Лимфоциты (абс)",
-            "Лимфоциты (абс)": "Лимфоциты (%)",
-            "Нейтрофилы (%)": "Нейтрофилы (абс)",
-            "Нейтрофилы (абс)": "Нейтрофилы (%)",
-            "Моноциты (%)": "Моноциты (абс)",
-            "Моноциты (абс)": "Моноциты (%)",
-            "Эозинофилы (%)": "Эозинофилы (абс)",
-            "Эозинофилы (абс)": "Эозинофилы (%)",
-            "Базофилы (%)": "Базофилы (абс)",
-            "Базофилы (абс)": "Базофилы (%)",
-        }
-        
-        if analyte in dual_pairs:
-            paired_analyte = dual_pairs[analyte]
-            paired_data = analyte_normalization_service_db.get_analyte(paired_analyte)
+        if analyte in _DUAL_ANALYTES:
+            paired_data = analyte_normalization_service_db.get_analyte(_DUAL_ANALYTES[analyte])
             if paired_data and paired_data.synonyms:
                 # Добавляем синонимы парного анализа для расширенного поиска
                 synonyms.extend(paired_data.synonyms)
@@ -664,19 +719,23 @@ async def get_lab_timeseries(
     
     # Строим regex для поиска всех синонимов
     # Экранируем специальные символы в названиях
-    import re
     escaped_synonyms = [re.escape(s) for s in synonyms]
     regex_pattern = f"^({'|'.join(escaped_synonyms)})$"
     
+    if len(profile_user_ids) == 1:
+        user_match = str(profile_user_ids[0])
+    else:
+        user_match = {"$in": [str(profile_id) for profile_id in profile_user_ids]}
+    
     pipeline = [
-        {"$match": {"user_id": str(profile_user_id)}},
-        {"$project": {"document_id": 1, "extracted_data.lab_results": 1}},
+        {"$match": {"user_id": user_match}},
+        {"$project": {"user_id": 1, "document_id": 1, "extracted_data.lab_results": 1}},
         {"$unwind": "$extracted_data.lab_results"},
         {"$match": {"extracted_data.lab_results.test_name": {"$regex": regex_pattern, "$options": "i"}}},
     ]
 
     cursor = document_metadata_collection.aggregate(pipeline)
-    points = []
+    points_by_profile = {str(profile_id): [] for profile_id in profile_user_ids}
     doc_ids = set()
     
     async for doc in cursor:
@@ -719,7 +778,7 @@ async def get_lab_timeseries(
         if doc_id:
             doc_ids.add(doc_id)
             
-        points.append({
+        points_by_profile.setdefault(doc.get("user_id"), []).append({
             "document_id": doc_id,
             "value_num": converted_value,
             "unit": converted_unit or standard_unit,
@@ -731,59 +790,137 @@ async def get_lab_timeseries(
 
     # Fetch dates for documents from Postgres
     if doc_ids:
-        import uuid as _uuid
-        from sqlalchemy import select
-        from app.models.document import Document as DocumentModel
         q = select(DocumentModel.id, DocumentModel.document_date).where(
-            DocumentModel.id.in_([_uuid.UUID(x) for x in doc_ids])
+            DocumentModel.id.in_([uuid.UUID(x) for x in doc_ids])
         )
         result = await db.execute(q)
         id_to_date = {str(r[0]): r[1] for r in result.all()}
-        for p in points:
-            p["date"] = id_to_date.get(p["document_id"])
+        for points in points_by_profile.values():
+            for p in points:
+                p["date"] = id_to_date.get(p["document_id"])
 
     # Sort by date
-    points.sort(key=lambda x: (x.get("date") is None, x.get("date") or ""))
+    for points in points_by_profile.values():
+        points.sort(key=lambda x: (x.get("date") is None, x.get("date") or ""))
 
     # Получаем референсные значения из analyte_standards
-    reference_min = None
-    reference_max = None
-    
+    analyte_standard = None
+    genders = {}
     if analyte_data:
-        from sqlalchemy import select as sql_select
-        from app.models.analyte import AnalyteStandard
-        
-        # Получаем запись из analyte_standards
-        analyte_standard_query = sql_select(AnalyteStandard).where(
+        analyte_standard_query = select(AnalyteStandard).where(
             AnalyteStandard.canonical_name == analyte
         )
         analyte_standard_result = await db.execute(analyte_standard_query)
         analyte_standard = analyte_standard_result.scalar_one_or_none()
-        
+    
+    if analyte_standard:
+        # Пол профилей (для выбора референсных значений)
+        genders_query = select(User.id, User.gender).where(User.id.in_(profile_user_ids))
+        genders_result = await db.execute(genders_query)
+        genders = {str(r[0]): r[1] for r in genders_result.all()}
+    
+    def to_float(value):
+        return float(value) if value else None
+    
+    profiles = {}
+    for profile_id, points in points_by_profile.items():
+        reference_min = None
+        reference_max = None
         if analyte_standard:
             # Выбираем референсные значения в зависимости от пола
-            if profile_user and profile_user.gender:
-                if profile_user.gender.value == "male":
-                    reference_min = float(analyte_standard.reference_male_min) if analyte_standard.reference_male_min else None
-                    reference_max = float(analyte_standard.reference_male_max) if analyte_standard.reference_male_max else None
-                elif profile_user.gender.value == "female":
-                    reference_min = float(analyte_standard.reference_female_min) if analyte_standard.reference_female_min else None
-                    reference_max = float(analyte_standard.reference_female_max) if analyte_standard.reference_female_max else None
-            else:
-                # Если пол не указан, используем усредненные значения или мужские по умолчанию
-                reference_min = float(analyte_standard.reference_male_min) if analyte_standard.reference_male_min else None
-                reference_max = float(analyte_standard.reference_male_max) if analyte_standard.reference_male_max else None
+            gender = genders.get(profile_id)
+            if gender is not None and gender.value == "female":
+                reference_min = to_float(analyte_standard.reference_female_min)
+                reference_max = to_float(analyte_standard.reference_female_max)
+            elif gender is None or gender.value == "male":
+                # Если пол не указан, используем мужские значения по умолчанию
+                reference_min = to_float(analyte_standard.reference_male_min)
+                reference_max = to_float(analyte_standard.reference_male_max)
+        profiles[profile_id] = {
+            "reference_min": reference_min,
+            "reference_max": reference_max,
+            "points": points,
+        }
 
     return {
         "analyte": analyte,
         "standard_unit": standard_unit,
         "category": category,
-        "reference_min": reference_min,
-        "reference_max": reference_max,
-        "points": points
+        "profiles": profiles,
     }
 
 
+@router.get("/labs/timeseries")
+async def get_lab_timeseries(
+    analyte: str = Query(..., description="Каноническое название анализа, например: Гемоглобин"),
+    current_user: User = Depends(get_current_user),
+    profile_user_id: uuid.UUID = Depends(get_profile_user_id),
+    db: AsyncSession = Depends(get_db),
+):
+    """Return time series for a given analyte across user's documents.
+    
+    All values are converted to standard units automatically.
+    
+    Response:
+    {
+        "analyte": "Гемоглобин",
+        "standard_unit": "г/л",
+        "category": "Общий анализ крови",
+        "reference_min": 120.0,
+        "reference_max": 160.0,
+        "points": [
+            {
+                "date": "2024-01-15",
+                "value_num": 145.0,
+                "unit": "г/л",
+                "document_id": "...",
+                "reference_range": "120-160",
+                "flag": "N"
+            }
+        ]
+    }
+    """
+    timeseries = await _collect_lab_timeseries(analyte, [profile_user_id], db)
+    profile = timeseries.pop("profiles")[str(profile_user_id)]
+    return {**timeseries, **profile}
+
+
+@router.get("/labs/timeseries/family")
+async def get_family_lab_timeseries(
+    analyte: str = Query(..., description="Каноническое название анализа, например: Гемоглобин"),
+    current_user: User = Depends(get_current_user),
+    profile_user_ids: List[uuid.UUID] = Depends(get_profile_user_ids),
+    db: AsyncSession = Depends(get_db),
+):
+    """Return time series of an analyte for several profiles at once.
+    
+    Profiles are passed as repeated ?profile_id=... parameters; access to all
+    of them is checked together. Reference values depend on each profile's gender.
+    
+    Response:
+    {
+        "analyte": "Гемоглобин",
+        "standard_unit": "г/л",
+        "category": "Общий анализ крови",
+        "profiles": [
+            {
+                "profile_id": "...",
+                "reference_min": 120.0,
+                "reference_max": 160.0,
+                "points": [...]
+            }
+        ]
+    }
+    """
+    timeseries = await _collect_lab_timeseries(analyte, profile_user_ids, db)
+    profiles = timeseries.pop("profiles")
+    timeseries["profiles"] = [
+        {"profile_id": str(profile_id), **profiles[str(profile_id)]}
+        for profile_id in profile_user_ids
+    ]
+    return timeseries
+
+
 @router.get("/filters/values")
 async def get_filter_values(
     field: str = Query(..., description="Field name: document_type, patient_name, medical_facility, specialties, document_subtype, research_area"),
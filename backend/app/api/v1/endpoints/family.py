@@ -35,7 +35,7 @@ async def get_accessible_profiles(
     Получить все доступные профили для переключения.
     Включает свой профиль и профили членов семьи.
     """
-    return await family_service.get_accessible_profiles(current_user.id, db)
+    return await family_service.get_accessible_profiles(current_user, db)
 
 
 @router.get("/members", response_model=FamilyListResponse)
@@ -59,8 +59,9 @@ async def get_my_family_info(
     Получить полную информацию о семейных связях пользователя.
     Включает тех, кем пользователь управляет, и тех, кто управляет пользователем.
     """
-    managed_by = await family_service.get_family_owners(current_user.id, db)
-    managing = await family_service.get_family_members(current_user.id, db)
+    graph = await family_service.get_access_graph(current_user.id, db)
+    managed_by = graph.owners
+    managing = graph.members
     
     # Пользователь может отвязаться, если у него есть credentials и им кто-то управляет
     can_detach = current_user.has_credentials and len(managed_by) > 0
@@ -1,7 +1,9 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
 from uuid import UUID
+import json
 import uuid
 
 from app.api.deps import get_current_user, get_profile_user_id
@@ -32,8 +34,8 @@ async def create_interpretation(
     
     Use X-Profile-Id header to create interpretation for a family member's documents.
     
-    Возвращает созданную интерпретацию со статусом 'pending' или 'processing'.
-    Обработка происходит асинхронно, результат будет доступен позже.
+    Возвращает созданную интерпретацию со статусом 'pending' сразу, не дожидаясь AI.
+    Ход обработки: GET /interpretations/{id}/events (SSE) или GET /interpretations/{id}.
     """
     try:
         interpretation = await interpretation_service.create_interpretation(
@@ -179,6 +181,106 @@ async def get_interpretation(
     )
 
 
+@router.get("/{interpretation_id}/events")
+async def interpretation_events(
+    interpretation_id: UUID,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+    profile_user_id: uuid.UUID = Depends(get_profile_user_id)
+):
+    """
+    Поток событий статуса интерпретации (Server-Sent Events)
+    
+    Первое событие - текущий статус; далее приходят переходы
+    pending → processing (stage: collecting, generating) → completed/failed.
+    Поток закрывается после completed или failed.
+    """
+    interpretation = await interpretation_service.get_interpretation_by_id(
+        db=db,
+        interpretation_id=interpretation_id,
+        user_id=profile_user_id
+    )
+    
+    if not interpretation:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Интерпретация не найдена"
+        )
+    # Сессия запроса живёт до конца потока - возвращаем соединение в пул сразу
+    await db.close()
+    
+    async def event_stream():
+        async for event in interpretation_service.stream_events(interpretation_id):
+            if event is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield f"event: status\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            # nginx не должен буферизовать поток
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+
+@router.post("/{interpretation_id}/retry", response_model=InterpretationResponse)
+async def retry_interpretation(
+    interpretation_id: UUID,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+    profile_user_id: uuid.UUID = Depends(get_profile_user_id)
+):
+    """
+    Повторить генерацию интерпретации со статусом 'failed'
+    
+    Также перезапускается зависшая интерпретация ('pending'/'processing' без
+    изменений дольше INTERPRETATION_STALE_SECONDS, например после рестарта).
+    Интерпретация возвращается в статус 'pending' и снова ставится в очередь.
+    """
+    try:
+        interpretation = await interpretation_service.retry_interpretation(
+            db=db,
+            interpretation_id=interpretation_id,
+            user_id=profile_user_id
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=str(e)
+        )
+    
+    if not interpretation:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Интерпретация не найдена"
+        )
+    
+    return InterpretationResponse(
+        id=interpretation.id,
+        user_id=interpretation.user_id,
+        status=interpretation.status.value,
+        interpretation_text=interpretation.interpretation_text,
+        error_message=interpretation.error_message,
+        created_at=interpretation.created_at,
+        updated_at=interpretation.updated_at,
+        completed_at=interpretation.completed_at,
+        documents=[
+            InterpretationDocumentInfo(
+                id=doc.id,
+                original_filename=doc.original_filename,
+                document_date=doc.document_date,
+                document_type=doc.document_type,
+                document_subtype=None
+            )
+            for doc in interpretation.documents
+        ]
+    )
+
+
 @router.delete("/{interpretation_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_interpretation(
     interpretation_id: UUID,
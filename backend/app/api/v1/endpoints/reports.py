@@ -7,12 +7,12 @@ import uuid
 
 from app.db.postgres import get_db
 from app.models.user import User
-from app.models.report import Report
+from app.models.report import Report, ReportStatus
 from app.schemas.document import (
     ReportGenerateRequest,
     ReportGenerateResponse
 )
-from app.services.report_service import ReportService
+from app.services.report_service import ReportService, REPORT_TYPE, REPORT_TYPE_STRUCTURED
 from app.services.document_service import DocumentService
 from app.api.deps import get_current_user, get_profile_user_id
 
@@ -25,19 +25,38 @@ async def generate_report(
     profile_user_id: uuid.UUID = Depends(get_profile_user_id),
     db: AsyncSession = Depends(get_db)
 ):
-    """Generate a PDF report based on filters"""
+    """
+    Queue PDF report generation based on filters
+    
+    Returns immediately with status 'pending'; poll GET /reports/{report_id}
+    until status is 'completed' (or 'failed'). If a report with the same
+    filters already exists and the matching documents have not changed,
+    that report is returned instead of generating a new one.
+    
+    With include_narrative=false the report contains only the document
+    timeline and lab tables with trend charts built from stored data,
+    without an LLM request.
+    """
     
     try:
-        report = await ReportService.generate_report(
+        report, reused = await ReportService.request_report(
             user_id=profile_user_id,
             filters=request.filters,
-            db=db
+            db=db,
+            report_type=REPORT_TYPE if request.include_narrative else REPORT_TYPE_STRUCTURED
         )
         
+        if reused and report.status == ReportStatus.completed.value:
+            message = "Отчёт с такими фильтрами уже сгенерирован"
+        elif reused:
+            message = "Отчёт с такими фильтрами уже генерируется"
+        else:
+            message = "Отчёт поставлен в очередь на генерацию"
+        
         return ReportGenerateResponse(
             report_id=report.id,
-            status="completed",
-            message="Отчёт успешно сгенерирован"
+            status=report.status,
+            message=message
         )
     
     except ValueError as e:
@@ -114,6 +133,12 @@ async def download_report(
             detail="Отчёт не найден"
         )
     
+    if report.status != ReportStatus.completed.value:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Отчёт ещё не готов (статус: {report.status})"
+        )
+    
     # Get file from MinIO
     try:
         file_content = DocumentService.get_file_from_minio(report.file_url)
@@ -1,6 +1,6 @@
 from fastapi import APIRouter, Depends, Query
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import Optional
+from typing import List, Optional
 from datetime import date
 import uuid
 
@@ -9,41 +9,13 @@ from app.models.user import User
 from app.schemas.document import TimelineResponse, TimelineEvent
 from app.services.document_service import DocumentService
 from app.db.mongodb import document_metadata_collection
-from app.api.deps import get_current_user, get_profile_user_id
+from app.api.deps import get_current_user, get_profile_user_id, get_profile_user_ids
 
 router = APIRouter()
 
-@router.get("/", response_model=TimelineResponse)
-async def get_timeline(
-    document_type: Optional[str] = None,
-    specialty: Optional[str] = None,
-    patient_name: Optional[str] = None,
-    medical_facility: Optional[str] = None,
-    date_from: Optional[str] = None,
-    date_to: Optional[str] = None,
-    current_user: User = Depends(get_current_user),
-    profile_user_id: uuid.UUID = Depends(get_profile_user_id),
-    db: AsyncSession = Depends(get_db)
-):
-    """Get timeline events for user documents
-    
-    Specialty filtering is done via MongoDB integration in DocumentService.
-    """
-    
-    # Get documents with filters
-    # Convert string filters to lists for DocumentService compatibility
-    documents = await DocumentService.get_documents(
-        user_id=profile_user_id,
-        db=db,
-        document_type=[document_type] if document_type else None,
-        patient_name=[patient_name] if patient_name else None,
-        medical_facility=[medical_facility] if medical_facility else None,
-        specialties=[specialty] if specialty else None,
-        date_from=date_from,
-        date_to=date_to,
-        limit=1000  # Get more documents for timeline
-    )
-    
+
+async def _build_timeline(documents: list) -> TimelineResponse:
+    """Timeline events with summaries and classification from MongoDB"""
     # Convert to timeline events
     events = []
     date_range = None
@@ -111,6 +83,7 @@ async def get_timeline(
             
             event = TimelineEvent(
                 document_id=doc.id,
+                profile_id=doc.user_id,
                 date=doc.document_date,
                 document_type=doc.document_type,
                 document_subtype=document_subtype_str,  # From MongoDB, can be None
@@ -139,6 +112,72 @@ async def get_timeline(
         events=events
     )
 
+
+@router.get("/", response_model=TimelineResponse)
+async def get_timeline(
+    document_type: Optional[str] = None,
+    specialty: Optional[str] = None,
+    patient_name: Optional[str] = None,
+    medical_facility: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    current_user: User = Depends(get_current_user),
+    profile_user_id: uuid.UUID = Depends(get_profile_user_id),
+    db: AsyncSession = Depends(get_db)
+):
+    """Get timeline events for user documents
+    
+    Specialty filtering is done via MongoDB integration in DocumentService.
+    """
+    
+    # Get documents with filters
+    # Convert string filters to lists for DocumentService compatibility
+    documents = await DocumentService.get_documents(
+        user_id=profile_user_id,
+        db=db,
+        document_type=[document_type] if document_type else None,
+        patient_name=[patient_name] if patient_name else None,
+        medical_facility=[medical_facility] if medical_facility else None,
+        specialties=[specialty] if specialty else None,
+        date_from=date_from,
+        date_to=date_to,
+        limit=1000  # Get more documents for timeline
+    )
+    
+    return await _build_timeline(documents)
+
+
+@router.get("/family", response_model=TimelineResponse)
+async def get_family_timeline(
+    document_type: Optional[str] = None,
+    specialty: Optional[str] = None,
+    medical_facility: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    current_user: User = Depends(get_current_user),
+    profile_user_ids: List[uuid.UUID] = Depends(get_profile_user_ids),
+    db: AsyncSession = Depends(get_db)
+):
+    """Merged timeline of several profiles (?profile_id=...&profile_id=...)
+    
+    Documents of all profiles are fetched with one user_id IN (...) query;
+    each event carries profile_id of its owner.
+    """
+    
+    documents = await DocumentService.get_documents(
+        user_id=profile_user_ids,
+        db=db,
+        document_type=[document_type] if document_type else None,
+        medical_facility=[medical_facility] if medical_facility else None,
+        specialties=[specialty] if specialty else None,
+        date_from=date_from,
+        date_to=date_to,
+        limit=1000
+    )
+    
+    return await _build_timeline(documents)
+
+
 @router.get("/stats")
 async def get_timeline_stats(
     current_user: User = Depends(get_current_user),
@@ -215,4 +254,3 @@ async def get_suggestions(
         limit=limit,
     )
     return {"values": values}
-
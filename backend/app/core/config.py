@@ -6,6 +6,13 @@ class Settings(BaseSettings):
     APP_NAME: str = "MedHistory"
     ENVIRONMENT: str = "development"
     
+    # Logging
+    LOG_LEVEL: str = "INFO"
+    LOG_LEVELS: str = ""  # Per-module overrides: "app.services.ai_service=DEBUG,sqlalchemy.engine=INFO"
+    LOG_FORMAT: str = "json"  # json | text
+    LOG_DEBUG_SAMPLE_RATE: float = 0.1  # Share of DEBUG records that are written
+    SQL_ECHO: bool = False  # Log every SQL statement (SQLAlchemy echo)
+    
     # Database
     DATABASE_URL: str
     MONGODB_URL: str
@@ -21,11 +28,36 @@ class Settings(BaseSettings):
     OPENROUTER_API_KEY: str
     OPENROUTER_MODEL: str = "anthropic/claude-3.5-sonnet"  # Можно также использовать claude-sonnet-4 или claude-sonnet-4.5
     OPENROUTER_BASE_URL: str = "https://openrouter.ai/api/v1/chat/completions"
+    AI_BACKEND: str = "openrouter"  # openrouter | mock (in-process stand-in, no network)
+    AI_RECORD_RESPONSES: bool = False  # Save real responses for replay by the mock
+    AI_RECORDINGS_DIR: str = "ai_recordings"
+    AI_MOCK_LATENCY_MS: float = 0.0
+    AI_MOCK_LATENCY_JITTER_MS: float = 0.0
+    AI_MOCK_ERROR_RATE: float = 0.0  # Share of 500 responses
+    AI_MOCK_RATE_LIMIT_RATE: float = 0.0  # Share of 429 responses
+    AI_MOCK_FALLBACK: bool = True  # Synthesize answers for prompts without a recording
+    AI_MOCK_SEED: Optional[int] = None
+    AI_PROMPT_CACHING: bool = True  # Mark static instructions with cache_control
+    AI_STRUCTURED_OUTPUT: bool = True  # Request JSON-schema constrained responses
+    AI_PARSE_MAX_RETRIES: int = 1  # Re-requests on malformed JSON
+    OPENROUTER_MAX_RPS: float = 5.0  # Per worker process
+    OPENROUTER_TOKENS_PER_MINUTE: int = 200_000  # Per worker process
+    OPENROUTER_MAX_CONCURRENCY: int = 4
+    OPENROUTER_MAX_RETRIES: int = 4  # On 429/5xx and network errors
+    OPENROUTER_RETRY_BASE_DELAY: float = 1.0
+    OPENROUTER_RETRY_MAX_DELAY: float = 30.0
+    OPENROUTER_CIRCUIT_FAILURE_THRESHOLD: int = 5
+    OPENROUTER_CIRCUIT_RESET_SECONDS: float = 30.0
+    OPENROUTER_CIRCUIT_MAX_WAIT_SECONDS: float = 120.0  # Queue while circuit is open, then fail
+    REPROCESS_REQUESTS_PER_MINUTE: int = 20  # Pace of bulk lab re-extraction
     
     # Authentication
     JWT_SECRET: str
     JWT_ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24  # 24 hours
+    JWT_DECODE_CACHE_SIZE: int = 4096  # LRU of verified tokens, 0 disables caching
+    FAMILY_ACCESS_CACHE_SIZE: int = 4096  # Cached family access graphs per worker process, 0 disables caching
+    FAMILY_ACCESS_CACHE_SECONDS: float = 30.0  # Max staleness of family listings after changes in another worker (access checks are uncached)
     
     # Google OAuth
     GOOGLE_CLIENT_ID: str = ""
@@ -41,6 +73,31 @@ class Settings(BaseSettings):
     # File upload limits
     MAX_FILE_SIZE: int = 20 * 1024 * 1024  # 20 MB
     ALLOWED_EXTENSIONS: set = {".pdf", ".jpg", ".jpeg", ".png", ".docx"}
+    PROCESS_POOL_WORKERS: int = 2  # CPU-bound work (PDF parsing, images) per API worker
+    PDF_PARALLEL_MIN_PAGES: int = 8  # Split PDFs with at least this many pages
+    PDF_PAGES_PER_CHUNK: int = 4
+    VISION_PREPROCESS_ENABLED: bool = True  # Rotate/crop/downscale photos before vision calls
+    VISION_MAX_LONG_EDGE: int = 2000
+    VISION_GRAYSCALE: bool = True
+    VISION_JPEG_QUALITY: int = 80
+    SCANNED_PDF_MAX_PAGES: int = 20  # Scanned PDFs are rasterised and sent to the vision model
+    SCANNED_PDF_DPI: int = 150
+    VISION_PAGES_PER_REQUEST: int = 4
+    VISION_PAGES_CACHE_MAX_BYTES: int = 64 * 1024 * 1024  # Rendered scanned-PDF pages kept per worker process
+    MAX_BATCH_UPLOAD_FILES: int = 20
+    BATCH_UPLOAD_AI_CONCURRENCY: int = 3  # Parallel AI pipelines for background uploads
+    DOCUMENT_PROCESSING_STALE_SECONDS: int = 900  # Pending/processing documents older than this are orphaned (failed at startup, retryable)
+    INTERPRETATION_CONCURRENCY: int = 2  # Parallel interpretation jobs per worker process
+    INTERPRETATION_STALE_SECONDS: int = 900  # Pending/processing older than this is orphaned (failed at startup, retryable)
+    INTERPRETATION_INCREMENTAL: bool = True  # Extend a completed interpretation of a document subset
+    INTERPRETATION_PROMPT_TOKEN_BUDGET: int = 6000  # Document context of an interpretation prompt
+    REPORT_PROMPT_TOKEN_BUDGET: int = 8000  # Document context of a report prompt
+    PROMPT_CHARS_PER_TOKEN: float = 3.0  # Token estimate for prompt budgeting
+    INTERPRETATION_EVENTS_POLL_SECONDS: float = 2.0  # Status re-check for jobs running in another worker
+    REPORT_GENERATION_CONCURRENCY: int = 2  # Parallel report jobs per worker process
+    REPORT_STALE_SECONDS: int = 900  # Pending/processing older than this is orphaned (failed at startup, not reused)
+    REPORT_MAX_CHARTS: int = 30  # Trend charts per report; remaining analytes get tables only
+    BUSINESS_METRICS_REFRESH_SECONDS: int = 300  # Gauges are also refreshed after each relevant commit
     
     class Config:
         # Переменные окружения передаются через docker-compose из .env.local/.env.staging/.env.production
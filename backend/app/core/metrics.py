@@ -0,0 +1,62 @@
+"""
+Прикладные метрики Prometheus.
+
+Регистрируются в реестре по умолчанию и отдаются через /metrics
+(prometheus-fastapi-instrumentator в main.py). В production uvicorn
+запускается с несколькими воркерами и PROMETHEUS_MULTIPROC_DIR: значения
+каждого процесса пишутся в общий каталог и суммируются при выдаче.
+"""
+
+from prometheus_client import Counter, Gauge, Histogram
+
+ai_parse_failures_total = Counter(
+    'medhistory_ai_parse_failures_total',
+    'Ответы LLM, не прошедшие валидацию JSON-схемы',
+    ['kind']
+)
+ai_parse_retries_total = Counter(
+    'medhistory_ai_parse_retries_total',
+    'Повторные запросы к LLM из-за невалидного JSON',
+    ['kind']
+)
+
+# Длительности стадий обработки документа (см. app.core.tracing.stage)
+document_stage_seconds = Histogram(
+    'medhistory_document_stage_seconds',
+    'Длительность стадий загрузки и обработки документа',
+    ['stage', 'file_type', 'document_type'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 60, 120)
+)
+ai_tokens_total = Counter(
+    'medhistory_ai_tokens_total',
+    'Токены, израсходованные на вызовы LLM',
+    ['stage', 'token_type', 'file_type', 'document_type']
+)
+
+# Бизнес-метрики (app/services/business_metrics_service.py). Значения -
+# глобальные счётчики из БД, поэтому между воркерами берётся последнее
+# записанное значение, а не сумма.
+users_total = Gauge('medhistory_users_total', 'Общее количество пользователей', multiprocess_mode='mostrecent')
+users_active_30d = Gauge('medhistory_users_active_30d', 'Активные пользователи за 30 дней', multiprocess_mode='mostrecent')
+users_new_30d = Gauge('medhistory_users_new_30d', 'Новые пользователи за 30 дней', multiprocess_mode='mostrecent')
+documents_total = Gauge('medhistory_documents_total', 'Общее количество документов', multiprocess_mode='mostrecent')
+documents_new_30d = Gauge('medhistory_documents_new_30d', 'Новые документы за 30 дней', multiprocess_mode='mostrecent')
+documents_by_type = Gauge(
+    'medhistory_documents_by_type', 'Документы по типам', ['document_type'], multiprocess_mode='mostrecent'
+)
+interpretations_total = Gauge(
+    'medhistory_interpretations_total', 'Общее количество интерпретаций', multiprocess_mode='mostrecent'
+)
+interpretations_success = Gauge(
+    'medhistory_interpretations_success_total', 'Успешные интерпретации', multiprocess_mode='mostrecent'
+)
+interpretations_failed = Gauge(
+    'medhistory_interpretations_failed_total', 'Неудачные интерпретации', multiprocess_mode='mostrecent'
+)
+interpretations_new_30d = Gauge(
+    'medhistory_interpretations_new_30d', 'Новые интерпретации за 30 дней', multiprocess_mode='mostrecent'
+)
+reports_total = Gauge('medhistory_reports_total', 'Общее количество отчетов', multiprocess_mode='mostrecent')
+reports_new_30d = Gauge('medhistory_reports_new_30d', 'Новые отчеты за 30 дней', multiprocess_mode='mostrecent')
+storage_bytes = Gauge('medhistory_storage_bytes', 'Использование хранилища в байтах', multiprocess_mode='mostrecent')
+storage_objects = Gauge('medhistory_storage_objects', 'Количество объектов в хранилище', multiprocess_mode='mostrecent')
@@ -0,0 +1,65 @@
+"""
+Общий пул процессов для CPU-тяжёлых задач (разбор PDF, обработка изображений).
+
+Пул создаётся лениво в каждом воркере uvicorn и использует spawn, чтобы
+дочерние процессы не наследовали event loop и соединения родителя.
+Функции, отправляемые в пул, должны лежать в модулях app.workers.*,
+которые не импортируют настройки и клиенты БД.
+
+Если дочерний процесс падает (segfault PyMuPDF, OOM), пул становится
+непригодным - он пересоздаётся, а вызов повторяется один раз.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from typing import Any, Callable, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=settings.PROCESS_POOL_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _executor
+
+
+async def run_in_process(func: Callable, *args: Any, **kwargs: Any) -> Any:
+    """Run a picklable function in the shared process pool without blocking the event loop"""
+    loop = asyncio.get_running_loop()
+    call = partial(func, *args, **kwargs)
+    for attempt in range(2):
+        pool = get_process_pool()
+        try:
+            return await loop.run_in_executor(pool, call)
+        except BrokenProcessPool:
+            logger.warning("Пул процессов сломан, пересоздаём его (%s)", getattr(func, "__name__", func))
+            _reset_process_pool(pool)
+            if attempt:
+                raise
+
+
+def _reset_process_pool(broken: ProcessPoolExecutor) -> None:
+    """Drop a broken pool unless a concurrent caller has already replaced it"""
+    global _executor
+    if _executor is broken:
+        _executor = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_process_pool() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
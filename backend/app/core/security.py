@@ -1,11 +1,70 @@
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from typing import Optional
-from jose import JWTError, jwt
+import jwt
+from jwt import PyJWTError
 from passlib.context import CryptContext
 from app.core.config import settings
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+
+class _DecodedTokenCache:
+    """Bounded LRU cache token -> claims with expiry-aware eviction.
+
+    Only successfully verified tokens are stored, so a cache hit is
+    equivalent to a successful signature check. Entries are dropped as soon
+    as their "exp" claim passes.
+    """
+
+    def __init__(self, maxsize: int):
+        self._maxsize = maxsize
+        self._items: "OrderedDict[str, tuple[dict, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Optional[dict]:
+        with self._lock:
+            item = self._items.get(token)
+            if item is None:
+                return None
+            payload, expires_at = item
+            if expires_at <= time.time():
+                del self._items[token]
+                return None
+            self._items.move_to_end(token)
+            return dict(payload)
+
+    def put(self, token: str, payload: dict) -> None:
+        if self._maxsize <= 0:
+            return
+        exp = payload.get("exp")
+        # Токены без exp не кэшируем - их нечем ограничить по времени
+        if not isinstance(exp, (int, float)):
+            return
+        with self._lock:
+            self._items[token] = (dict(payload), float(exp))
+            self._items.move_to_end(token)
+            if len(self._items) > self._maxsize:
+                self._evict_expired()
+            while len(self._items) > self._maxsize:
+                self._items.popitem(last=False)
+
+    def _evict_expired(self) -> None:
+        now = time.time()
+        expired = [key for key, (_, expires_at) in self._items.items() if expires_at <= now]
+        for key in expired:
+            del self._items[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+
+_token_cache = _DecodedTokenCache(settings.JWT_DECODE_CACHE_SIZE)
+
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a password against a hash"""
     return pwd_context.verify(plain_password, hashed_password)
@@ -21,16 +80,29 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
-    
+
     to_encode.update({"exp": expire})
     encoded_jwt = jwt.encode(to_encode, settings.JWT_SECRET, algorithm=settings.JWT_ALGORITHM)
     return encoded_jwt
 
-def decode_access_token(token: str) -> Optional[dict]:
-    """Decode a JWT access token"""
+def _decode_access_token_uncached(token: str) -> Optional[dict]:
+    """Verify signature and claims without touching the cache"""
     try:
-        payload = jwt.decode(token, settings.JWT_SECRET, algorithms=[settings.JWT_ALGORITHM])
-        return payload
-    except JWTError:
+        return jwt.decode(token, settings.JWT_SECRET, algorithms=[settings.JWT_ALGORITHM])
+    except PyJWTError:
         return None
 
+def decode_access_token(token: str) -> Optional[dict]:
+    """Decode a JWT access token
+
+    Verified claims are cached per token until they expire, so repeated
+    requests with the same token (e.g. the Telegram bot) skip the HMAC check.
+    """
+    payload = _token_cache.get(token)
+    if payload is not None:
+        return payload
+
+    payload = _decode_access_token_uncached(token)
+    if payload is not None:
+        _token_cache.put(token, payload)
+    return payload
@@ -0,0 +1,130 @@
+"""
+Замер стадий обработки документа.
+
+`stage()` работает как span OpenTelemetry: длительность попадает в
+гистограмму medhistory_document_stage_seconds, а запись span (trace_id,
+span_id, parent_id, атрибуты) - в лог app.tracing на уровне DEBUG.
+
+Метки file_type и document_type задаются один раз через `trace_document()`
+и наследуются всеми вложенными стадиями через contextvars, включая вызовы
+LLM внутри AIService. document_type становится известен после
+классификации и обновляется через `set_document_type()`. Тип приходит от
+LLM, поэтому в метку попадают только известные типы, остальное - "other".
+"""
+
+import logging
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+from app.core.metrics import document_stage_seconds
+
+logger = logging.getLogger("app.tracing")
+
+UNKNOWN = "unknown"
+OTHER = "other"
+
+# Типы документов из промпта классификации: ограничивают кардинальность меток
+DOCUMENT_TYPES = frozenset({
+    "Прием врача",
+    "Результаты анализа",
+    "Инструментальное исследование",
+    "Функциональная диагностика",
+    "Другое",
+})
+
+_trace: ContextVar[Optional[dict]] = ContextVar("document_trace", default=None)
+_span: ContextVar[Optional["Span"]] = ContextVar("document_span", default=None)
+
+
+class Span:
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str]):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes: dict = {}
+        self.status = "ok"
+
+    def set_attribute(self, key: str, value) -> None:
+        self.attributes[key] = value
+
+
+def metric_document_type(document_type: Optional[str]) -> str:
+    """Document type as a bounded metric label value"""
+    if not document_type or document_type == UNKNOWN:
+        return UNKNOWN
+    return document_type if document_type in DOCUMENT_TYPES else OTHER
+
+
+def trace_labels() -> dict:
+    """file_type/document_type of the current trace, for metric labels"""
+    trace = _trace.get() or {}
+    return {
+        "file_type": trace.get("file_type") or UNKNOWN,
+        "document_type": trace.get("document_type") or UNKNOWN,
+    }
+
+
+@contextmanager
+def trace_document(file_type: Optional[str] = None, document_type: Optional[str] = None) -> Iterator[dict]:
+    """Start a trace for one document (or one batch) and set its labels"""
+    token = _trace.set({
+        "trace_id": uuid.uuid4().hex,
+        "file_type": file_type,
+        "document_type": metric_document_type(document_type) if document_type else None,
+    })
+    try:
+        yield _trace.get()
+    finally:
+        _trace.reset(token)
+
+
+def set_document_type(document_type: Optional[str]) -> None:
+    trace = _trace.get()
+    if trace is not None:
+        trace["document_type"] = metric_document_type(document_type)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[Span]:
+    """Time a pipeline stage; nested stages become child spans"""
+    trace = _trace.get()
+    parent = _span.get()
+    span = Span(
+        name,
+        trace_id=trace["trace_id"] if trace else uuid.uuid4().hex,
+        parent_id=parent.span_id if parent else None,
+    )
+    token = _span.set(span)
+    started = time.perf_counter()
+    try:
+        yield span
+    except BaseException:
+        span.status = "error"
+        raise
+    finally:
+        duration = time.perf_counter() - started
+        _span.reset(token)
+        labels = trace_labels()
+        document_stage_seconds.labels(stage=name, **labels).observe(duration)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "span %s %.1fms",
+                name,
+                duration * 1000,
+                extra={
+                    "span": {
+                        "name": name,
+                        "trace_id": span.trace_id,
+                        "span_id": span.span_id,
+                        "parent_id": span.parent_id,
+                        "duration_ms": round(duration * 1000, 2),
+                        "status": span.status,
+                        **labels,
+                        **span.attributes,
+                    }
+                },
+            )
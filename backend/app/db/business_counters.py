@@ -0,0 +1,230 @@
+"""
+Триггеры PostgreSQL, поддерживающие таблицы бизнес-счётчиков.
+
+Счётчики (app.models.business_counter) меняются в той же транзакции, что и
+INSERT/DELETE/UPDATE в users, documents, interpretations и reports, в том
+числе при каскадном удалении пользователя. Объём хранилища считается по
+Document.file_size и Report.file_size, без обхода бакета MinIO.
+
+`install_business_counters` вызывается при старте приложения: функции и
+триггеры пересоздаются идемпотентно, а при первом запуске счётчики
+заполняются по текущим данным. `rebuild_business_counters` пересчитывает
+их заново (scripts/rebuild_business_counters.py).
+"""
+
+import logging
+
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+logger = logging.getLogger(__name__)
+
+# Ключ pg_advisory_xact_lock: воркеры uvicorn стартуют одновременно
+_INSTALL_LOCK_KEY = 724_310_038
+
+INITIALIZED_MARKER = "_initialized"
+
+_FUNCTIONS = [
+    """
+    CREATE OR REPLACE FUNCTION bc_bump(counter_name text, delta bigint) RETURNS void AS $$
+    BEGIN
+        IF delta = 0 THEN
+            RETURN;
+        END IF;
+        INSERT INTO business_counters (name, value, updated_at)
+        VALUES (counter_name, delta, now())
+        ON CONFLICT (name) DO UPDATE
+            SET value = business_counters.value + EXCLUDED.value, updated_at = now();
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION bc_bump_daily(counter_name text, counter_day date, delta bigint) RETURNS void AS $$
+    BEGIN
+        INSERT INTO business_daily_counters (name, day, value)
+        VALUES (counter_name, counter_day, delta)
+        ON CONFLICT (name, day) DO UPDATE
+            SET value = business_daily_counters.value + EXCLUDED.value;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION bc_users_trigger() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            PERFORM bc_bump('users_total', 1);
+            PERFORM bc_bump_daily('users_new', COALESCE(NEW.created_at, now())::date, 1);
+        ELSE
+            PERFORM bc_bump('users_total', -1);
+            PERFORM bc_bump_daily('users_new', COALESCE(OLD.created_at, now())::date, -1);
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION bc_documents_trigger() RETURNS trigger AS $$
+    DECLARE
+        old_key text;
+        new_key text;
+    BEGIN
+        -- Строки счётчиков блокируются в порядке ключей, чтобы встречные
+        -- транзакции (переклассификации X -> Y и Y -> X) не взаимоблокировались
+        IF TG_OP = 'UPDATE' THEN
+            old_key := 'documents_by_type.' || COALESCE(OLD.document_type, 'unknown');
+            new_key := 'documents_by_type.' || COALESCE(NEW.document_type, 'unknown');
+            IF old_key < new_key THEN
+                PERFORM bc_bump(old_key, -1);
+                PERFORM bc_bump(new_key, 1);
+            ELSIF old_key > new_key THEN
+                PERFORM bc_bump(new_key, 1);
+                PERFORM bc_bump(old_key, -1);
+            END IF;
+            IF OLD.file_size IS DISTINCT FROM NEW.file_size THEN
+                PERFORM bc_bump('storage_bytes', COALESCE(NEW.file_size, 0) - COALESCE(OLD.file_size, 0));
+            END IF;
+        ELSIF TG_OP = 'INSERT' THEN
+            PERFORM bc_bump('documents_by_type.' || COALESCE(NEW.document_type, 'unknown'), 1);
+            PERFORM bc_bump('documents_total', 1);
+            PERFORM bc_bump('storage_bytes', COALESCE(NEW.file_size, 0));
+            PERFORM bc_bump('storage_objects', 1);
+            PERFORM bc_bump_daily('documents_new', COALESCE(NEW.created_at, now())::date, 1);
+            INSERT INTO user_activity (user_id, last_document_at)
+            VALUES (NEW.user_id, COALESCE(NEW.created_at, now()))
+            ON CONFLICT (user_id) DO UPDATE
+                SET last_document_at = GREATEST(user_activity.last_document_at, EXCLUDED.last_document_at);
+        ELSE
+            PERFORM bc_bump('documents_by_type.' || COALESCE(OLD.document_type, 'unknown'), -1);
+            PERFORM bc_bump('documents_total', -1);
+            PERFORM bc_bump('storage_bytes', -COALESCE(OLD.file_size, 0));
+            PERFORM bc_bump('storage_objects', -1);
+            PERFORM bc_bump_daily('documents_new', COALESCE(OLD.created_at, now())::date, -1);
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION bc_interpretations_trigger() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.status = 'completed' THEN
+            PERFORM bc_bump('interpretations_completed', -1);
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.status = 'completed' THEN
+            PERFORM bc_bump('interpretations_completed', 1);
+        END IF;
+
+        IF TG_OP = 'INSERT' THEN
+            PERFORM bc_bump('interpretations_total', 1);
+            PERFORM bc_bump_daily('interpretations_new', COALESCE(NEW.created_at, now())::date, 1);
+        ELSIF TG_OP = 'DELETE' THEN
+            PERFORM bc_bump('interpretations_total', -1);
+            PERFORM bc_bump_daily('interpretations_new', COALESCE(OLD.created_at, now())::date, -1);
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION bc_reports_trigger() RETURNS trigger AS $$
+    BEGIN
+        -- Файл появляется, когда фоновая генерация завершена (file_url заполнен)
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            PERFORM bc_bump('storage_bytes', -COALESCE(OLD.file_size, 0));
+            IF OLD.file_url IS NOT NULL THEN
+                PERFORM bc_bump('storage_objects', -1);
+            END IF;
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            PERFORM bc_bump('storage_bytes', COALESCE(NEW.file_size, 0));
+            IF NEW.file_url IS NOT NULL THEN
+                PERFORM bc_bump('storage_objects', 1);
+            END IF;
+        END IF;
+
+        IF TG_OP = 'INSERT' THEN
+            PERFORM bc_bump('reports_total', 1);
+            PERFORM bc_bump_daily('reports_new', COALESCE(NEW.created_at, now())::date, 1);
+        ELSIF TG_OP = 'DELETE' THEN
+            PERFORM bc_bump('reports_total', -1);
+            PERFORM bc_bump_daily('reports_new', COALESCE(OLD.created_at, now())::date, -1);
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+]
+
+# (таблица, функция, колонки, изменение которых влияет на счётчики)
+_TRIGGERS = [
+    ("users", "bc_users_trigger", []),
+    ("documents", "bc_documents_trigger", ["document_type", "file_size"]),
+    ("interpretations", "bc_interpretations_trigger", ["status"]),
+    ("reports", "bc_reports_trigger", ["file_size", "file_url"]),
+]
+
+_REBUILD = [
+    "LOCK TABLE users, documents, interpretations, reports IN SHARE MODE",
+    "TRUNCATE business_counters, business_daily_counters, user_activity",
+    """
+    INSERT INTO business_counters (name, value)
+    SELECT 'users_total', count(*) FROM users
+    UNION ALL SELECT 'documents_total', count(*) FROM documents
+    UNION ALL SELECT 'interpretations_total', count(*) FROM interpretations
+    UNION ALL SELECT 'interpretations_completed', count(*) FROM interpretations WHERE status = 'completed'
+    UNION ALL SELECT 'reports_total', count(*) FROM reports
+    UNION ALL SELECT 'storage_bytes',
+        (SELECT COALESCE(sum(file_size), 0) FROM documents) + (SELECT COALESCE(sum(file_size), 0) FROM reports)
+    UNION ALL SELECT 'storage_objects',
+        (SELECT count(*) FROM documents) + (SELECT count(*) FROM reports WHERE file_url IS NOT NULL)
+    UNION ALL SELECT 'documents_by_type.' || COALESCE(document_type, 'unknown'), count(*)
+        FROM documents GROUP BY 1
+    """,
+    """
+    INSERT INTO business_daily_counters (name, day, value)
+    SELECT 'users_new', created_at::date, count(*) FROM users WHERE created_at IS NOT NULL GROUP BY 2
+    UNION ALL SELECT 'documents_new', created_at::date, count(*) FROM documents WHERE created_at IS NOT NULL GROUP BY 2
+    UNION ALL SELECT 'interpretations_new', created_at::date, count(*) FROM interpretations GROUP BY 2
+    UNION ALL SELECT 'reports_new', created_at::date, count(*) FROM reports WHERE created_at IS NOT NULL GROUP BY 2
+    """,
+    """
+    INSERT INTO user_activity (user_id, last_document_at)
+    SELECT user_id, max(created_at) FROM documents WHERE created_at IS NOT NULL GROUP BY user_id
+    """,
+    f"INSERT INTO business_counters (name, value) VALUES ('{INITIALIZED_MARKER}', 1)",
+]
+
+
+async def rebuild_business_counters(conn: AsyncConnection) -> None:
+    """Recompute all counters from the source tables (blocks writes while running)"""
+    for statement in _REBUILD:
+        await conn.exec_driver_sql(statement)
+
+
+async def install_business_counters(conn: AsyncConnection) -> None:
+    """Create trigger functions and triggers; fill counters on first install"""
+    await conn.exec_driver_sql(f"SELECT pg_advisory_xact_lock({_INSTALL_LOCK_KEY})")
+
+    for statement in _FUNCTIONS:
+        await conn.exec_driver_sql(statement)
+
+    for table, function, columns in _TRIGGERS:
+        await conn.exec_driver_sql(f"DROP TRIGGER IF EXISTS {table}_business_counters ON {table}")
+        await conn.exec_driver_sql(
+            f"CREATE TRIGGER {table}_business_counters AFTER INSERT OR DELETE ON {table} "
+            f"FOR EACH ROW EXECUTE FUNCTION {function}()"
+        )
+        await conn.exec_driver_sql(f"DROP TRIGGER IF EXISTS {table}_business_counters_update ON {table}")
+        if columns:
+            changed = " OR ".join(f"OLD.{column} IS DISTINCT FROM NEW.{column}" for column in columns)
+            await conn.exec_driver_sql(
+                f"CREATE TRIGGER {table}_business_counters_update "
+                f"AFTER UPDATE OF {', '.join(columns)} ON {table} "
+                f"FOR EACH ROW WHEN ({changed}) EXECUTE FUNCTION {function}()"
+            )
+
+    initialized = await conn.exec_driver_sql(
+        f"SELECT 1 FROM business_counters WHERE name = '{INITIALIZED_MARKER}'"
+    )
+    if initialized.first() is None:
+        logger.info("Заполняем счётчики бизнес-метрик по текущим данным")
+        await rebuild_business_counters(conn)
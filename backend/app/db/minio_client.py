@@ -1,7 +1,10 @@
+import logging
 from minio import Minio
 from minio.error import S3Error
 from app.core.config import settings
 
+logger = logging.getLogger(__name__)
+
 # Create MinIO client
 minio_client = Minio(
     settings.MINIO_ENDPOINT,
@@ -15,10 +18,10 @@ def ensure_bucket_exists():
     try:
         if not minio_client.bucket_exists(settings.MINIO_BUCKET):
             minio_client.make_bucket(settings.MINIO_BUCKET)
-            print(f"✅ Created MinIO bucket: {settings.MINIO_BUCKET}")
+            logger.info("Created MinIO bucket %s", settings.MINIO_BUCKET)
         else:
-            print(f"✅ MinIO bucket exists: {settings.MINIO_BUCKET}")
+            logger.info("MinIO bucket exists: %s", settings.MINIO_BUCKET)
     except S3Error as e:
-        print(f"❌ Error creating MinIO bucket: {e}")
+        logger.error("Error creating MinIO bucket: %s", e)
         raise
 
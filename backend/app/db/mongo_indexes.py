@@ -0,0 +1,261 @@
+"""
+Индексы MongoDB и проверка планов запросов.
+
+`ensure_indexes()` запускается при старте приложения фоновой задачей.
+createIndexes идемпотентен: если индекс с той же спецификацией уже есть,
+MongoDB ничего не делает, а одновременные вызовы из нескольких воркеров
+дожидаются одной и той же сборки. Ошибки (например, дубликаты document_id,
+мешающие уникальному индексу) логируются и не останавливают приложение.
+
+`QUERY_SHAPES` описывает формы запросов из сервисов и эндпоинтов;
+`explain_query_shapes()` прогоняет по ним explain и отмечает COLLSCAN
+(scripts/mongo_query_diagnostics.py).
+"""
+
+import logging
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+from app.db.mongodb import mongodb
+
+logger = logging.getLogger(__name__)
+
+INDEXES: dict[str, list[IndexModel]] = {
+    "document_metadata": [
+        IndexModel([("document_id", ASCENDING)], name="document_id_unique", unique=True),
+        IndexModel(
+            [("user_id", ASCENDING), ("classification.document_subtype", ASCENDING)],
+            name="user_id_document_subtype",
+        ),
+        # Массив - индекс получается multikey
+        IndexModel([("classification.specialties", ASCENDING)], name="specialties"),
+        IndexModel(
+            [("user_id", ASCENDING), ("extracted_data.lab_results.test_name", ASCENDING)],
+            name="user_id_lab_test_name",
+        ),
+    ],
+    "analyte_category_cache": [
+        IndexModel([("test_name_lower", ASCENDING)], name="test_name_lower_unique", unique=True),
+    ],
+    "document_text": [
+        IndexModel([("file_hash", ASCENDING)], name="file_hash_unique", unique=True),
+    ],
+    "reprocessing_jobs": [
+        IndexModel([("job_id", ASCENDING)], name="job_id_unique", unique=True),
+    ],
+}
+
+
+async def ensure_indexes() -> None:
+    """Create missing indexes; safe to run concurrently from several workers"""
+    for collection_name, indexes in INDEXES.items():
+        collection = mongodb[collection_name]
+        for index in indexes:
+            name = index.document["name"]
+            try:
+                await collection.create_indexes([index])
+            except OperationFailure as e:
+                logger.error(
+                    "Не удалось создать индекс %s.%s: %s", collection_name, name, e.details or e,
+                    extra={"collection": collection_name, "index": name, "code": e.code},
+                )
+            except Exception as e:
+                logger.error("Не удалось создать индекс %s.%s: %s", collection_name, name, e)
+    logger.info("Индексы MongoDB проверены")
+
+
+@dataclass
+class QueryShape:
+    name: str
+    collection: str
+    # find: (filter, projection); aggregate: pipeline
+    build: Callable[[dict], object]
+    aggregate: bool = False
+
+
+# Формы запросов; sample - реальные значения из базы (user_id, document_id, ...)
+QUERY_SHAPES: list[QueryShape] = [
+    QueryShape(
+        "document by document_id (documents.get_document, labs, delete)",
+        "document_metadata",
+        lambda s: ({"document_id": s["document_id"]}, None),
+    ),
+    QueryShape(
+        "documents by document_id $in (documents list, timeline)",
+        "document_metadata",
+        lambda s: ({"document_id": {"$in": [s["document_id"]]}}, {"document_id": 1, "classification": 1}),
+    ),
+    QueryShape(
+        "filter by classification fields (DocumentService.filter_documents_by_mongodb_fields)",
+        "document_metadata",
+        lambda s: (
+            {"user_id": s["user_id"], "classification.document_subtype": {"$in": [s["document_subtype"]]}},
+            {"document_id": 1},
+        ),
+    ),
+    QueryShape(
+        "filter by specialties",
+        "document_metadata",
+        lambda s: (
+            {"user_id": s["user_id"], "classification.specialties": {"$in": [s["specialty"]]}},
+            {"document_id": 1},
+        ),
+    ),
+    QueryShape(
+        "specialty stats (timeline.stats)",
+        "document_metadata",
+        lambda s: (
+            {"user_id": s["user_id"], "classification.specialties": {"$exists": True, "$ne": None}},
+            {"classification.specialties": 1},
+        ),
+    ),
+    QueryShape(
+        "filter values (DocumentService.get_filter_values)",
+        "document_metadata",
+        lambda s: [
+            {"$match": {"user_id": s["user_id"]}},
+            {"$unwind": "$classification.specialties"},
+            {"$group": {"_id": "$classification.specialties"}},
+        ],
+        aggregate=True,
+    ),
+    QueryShape(
+        "available analytes (documents.labs.analytes)",
+        "document_metadata",
+        lambda s: [
+            {"$match": {"user_id": s["user_id"]}},
+            {"$project": {"extracted_data.lab_results": 1}},
+            {"$unwind": "$extracted_data.lab_results"},
+            {"$group": {"_id": "$extracted_data.lab_results.test_name", "count": {"$sum": 1}}},
+        ],
+        aggregate=True,
+    ),
+    QueryShape(
+        "lab timeseries (documents.labs.timeseries)",
+        "document_metadata",
+        lambda s: [
+            {"$match": {"user_id": s["user_id"]}},
+            {"$project": {"user_id": 1, "document_id": 1, "extracted_data.lab_results": 1}},
+            {"$unwind": "$extracted_data.lab_results"},
+            {"$match": {"extracted_data.lab_results.test_name": {"$regex": "^(гемоглобин)$", "$options": "i"}}},
+        ],
+        aggregate=True,
+    ),
+    QueryShape(
+        "family lab timeseries (documents.labs.timeseries.family)",
+        "document_metadata",
+        lambda s: [
+            {"$match": {"user_id": {"$in": [s["user_id"]]}}},
+            {"$project": {"user_id": 1, "document_id": 1, "extracted_data.lab_results": 1}},
+            {"$unwind": "$extracted_data.lab_results"},
+            {"$match": {"extracted_data.lab_results.test_name": {"$regex": "^(гемоглобин)$", "$options": "i"}}},
+        ],
+        aggregate=True,
+    ),
+    QueryShape(
+        "reprocessing batch (ReprocessingService.run_job)",
+        "document_metadata",
+        lambda s: ({"document_id": {"$in": [s["document_id"]]}}, {"document_id": 1, "ai_response_labs": 1}),
+    ),
+    QueryShape(
+        "analyte category cache",
+        "analyte_category_cache",
+        lambda s: ({"test_name_lower": "гемоглобин"}, None),
+    ),
+    QueryShape(
+        "PDF text cache by file_hash",
+        "document_text",
+        lambda s: ({"file_hash": "0" * 64}, {"pages": 1}),
+    ),
+    QueryShape(
+        "reprocessing job by job_id",
+        "reprocessing_jobs",
+        lambda s: ({"job_id": "00000000-0000-0000-0000-000000000000"}, {"_id": 0}),
+    ),
+]
+
+
+def _plan_stages(plan) -> list[str]:
+    """All stage names in an explain plan tree"""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(_plan_stages(value))
+    elif isinstance(plan, list):
+        for item in plan:
+            stages.extend(_plan_stages(item))
+    return stages
+
+
+def _winning_plan(explain: dict) -> Optional[dict]:
+    if "queryPlanner" in explain:
+        return explain["queryPlanner"].get("winningPlan")
+    # aggregate: план первой стадии $cursor (или queryPlanner при SBE)
+    for stage in explain.get("stages", []):
+        if "$cursor" in stage:
+            return stage["$cursor"].get("queryPlanner", {}).get("winningPlan")
+    return None
+
+
+async def sample_values() -> dict:
+    """Real identifiers to plug into the query shapes"""
+    sample = {
+        "user_id": "00000000-0000-0000-0000-000000000000",
+        "document_id": "00000000-0000-0000-0000-000000000000",
+        "document_subtype": "Общий анализ крови",
+        "specialty": "Терапия",
+    }
+    doc = await mongodb.document_metadata.find_one(
+        {"classification.specialties.0": {"$exists": True}},
+        {"user_id": 1, "document_id": 1, "classification": 1},
+    ) or await mongodb.document_metadata.find_one({}, {"user_id": 1, "document_id": 1})
+    if doc:
+        sample["user_id"] = doc.get("user_id", sample["user_id"])
+        sample["document_id"] = doc.get("document_id", sample["document_id"])
+        classification = doc.get("classification") or {}
+        sample["document_subtype"] = classification.get("document_subtype") or sample["document_subtype"]
+        if classification.get("specialties"):
+            sample["specialty"] = classification["specialties"][0]
+    return sample
+
+
+async def explain_query_shapes() -> list[dict]:
+    """Run explain for every query shape and report the plan stages"""
+    sample = await sample_values()
+    report = []
+    for shape in QUERY_SHAPES:
+        collection = mongodb[shape.collection]
+        entry = {"name": shape.name, "collection": shape.collection}
+        try:
+            if shape.aggregate:
+                explain = await mongodb.command(
+                    "aggregate", shape.collection, pipeline=shape.build(sample), explain=True
+                )
+            else:
+                query, projection = shape.build(sample)
+                explain = await collection.find(query, projection).explain()
+            stages = _plan_stages(_winning_plan(explain))
+            entry["stages"] = stages
+            entry["collscan"] = "COLLSCAN" in stages
+            entry["indexes"] = sorted({
+                s["indexName"] for s in _iter_dicts(_winning_plan(explain)) if "indexName" in s
+            })
+        except OperationFailure as e:
+            entry["error"] = str(e)
+        report.append(entry)
+    return report
+
+
+def _iter_dicts(plan):
+    if isinstance(plan, dict):
+        yield plan
+        for value in plan.values():
+            yield from _iter_dicts(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            yield from _iter_dicts(item)
@@ -5,7 +5,7 @@ from app.core.config import settings
 # Create async engine
 engine = create_async_engine(
     settings.DATABASE_URL,
-    echo=True if settings.ENVIRONMENT == "development" else False,
+    echo=settings.SQL_ECHO,
     future=True
 )
 
@@ -0,0 +1,82 @@
+"""
+Изменения схемы PostgreSQL для уже существующих баз.
+
+`Base.metadata.create_all` создаёт только отсутствующие таблицы, поэтому
+новые колонки и индексы существующих таблиц добавляются здесь.
+`apply_schema_updates` вызывается при старте приложения сразу после
+create_all; каждый шаг идемпотентен.
+"""
+
+import logging
+
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+logger = logging.getLogger(__name__)
+
+# Ключ pg_advisory_xact_lock: воркеры uvicorn стартуют одновременно
+_SCHEMA_LOCK_KEY = 724_310_042
+
+_INTERPRETATION_DOC_SET_HASH = [
+    "ALTER TABLE interpretations ADD COLUMN IF NOT EXISTS doc_set_hash varchar(64)",
+    # Тот же хэш, что compute_doc_set_hash; при дубликатах наборов хэш получает
+    # одна запись (предпочтительно завершённая), остальные остаются с NULL
+    """
+    WITH sets AS (
+        SELECT i.id, i.user_id,
+               encode(sha256(convert_to(
+                   string_agg(d.document_id::text, ',' ORDER BY d.document_id), 'UTF8'
+               )), 'hex') AS doc_set_hash,
+               i.status, i.created_at
+        FROM interpretations i
+        JOIN interpretation_documents d ON d.interpretation_id = i.id
+        WHERE i.doc_set_hash IS NULL
+        GROUP BY i.id
+    ),
+    ranked AS (
+        SELECT sets.id, sets.doc_set_hash,
+               row_number() OVER (
+                   PARTITION BY sets.user_id, sets.doc_set_hash
+                   ORDER BY (sets.status = 'completed') DESC, sets.created_at DESC
+               ) AS rn
+        FROM sets
+        WHERE NOT EXISTS (
+            SELECT 1 FROM interpretations other
+            WHERE other.user_id = sets.user_id AND other.doc_set_hash = sets.doc_set_hash
+        )
+    )
+    UPDATE interpretations
+    SET doc_set_hash = ranked.doc_set_hash
+    FROM ranked
+    WHERE interpretations.id = ranked.id AND ranked.rn = 1
+    """,
+    """
+    CREATE UNIQUE INDEX IF NOT EXISTS ix_interpretations_user_doc_set
+    ON interpretations (user_id, doc_set_hash)
+    """,
+]
+
+_REPORT_JOBS = [
+    "ALTER TABLE reports ADD COLUMN IF NOT EXISTS status varchar(20) NOT NULL DEFAULT 'completed'",
+    "ALTER TABLE reports ADD COLUMN IF NOT EXISTS error_message text",
+    "ALTER TABLE reports ADD COLUMN IF NOT EXISTS filters_hash varchar(64)",
+    "ALTER TABLE reports ADD COLUMN IF NOT EXISTS documents_count integer",
+    "ALTER TABLE reports ADD COLUMN IF NOT EXISTS documents_updated_at timestamptz",
+    "ALTER TABLE reports ADD COLUMN IF NOT EXISTS completed_at timestamptz",
+    "ALTER TABLE reports ADD COLUMN IF NOT EXISTS updated_at timestamptz DEFAULT now()",
+    # Файла нет, пока отчёт в очереди
+    "ALTER TABLE reports ALTER COLUMN file_url DROP NOT NULL",
+    "CREATE INDEX IF NOT EXISTS ix_reports_user_filters_hash ON reports (user_id, filters_hash)",
+]
+
+
+async def apply_schema_updates(conn: AsyncConnection) -> None:
+    """Add columns and indexes introduced after the tables were created"""
+    await conn.exec_driver_sql(f"SELECT pg_advisory_xact_lock({_SCHEMA_LOCK_KEY})")
+
+    for statement in _INTERPRETATION_DOC_SET_HASH:
+        result = await conn.exec_driver_sql(statement)
+        if statement.lstrip().startswith("WITH") and result.rowcount:
+            logger.info("doc_set_hash заполнен для %d интерпретаций", result.rowcount)
+
+    for statement in _REPORT_JOBS:
+        await conn.exec_driver_sql(statement)
@@ -0,0 +1,185 @@
+"""
+Локальная заглушка OpenRouter для нагрузочного и регрессионного тестирования.
+
+Отвечает на POST /api/v1/chat/completions в формате OpenRouter:
+- ответы берутся из записей (каталог recordings, файл <prompt_hash>.json),
+  сделанных при AI_RECORD_RESPONSES=true на реальном API;
+- для промптов без записи возвращается синтетический ответ, проходящий
+  валидацию схем AIService (или 404 при fallback=False);
+- задержка, ошибки 5xx и 429 с Retry-After внедряются с заданной вероятностью.
+
+Модуль не импортирует настройки приложения, чтобы заглушку можно было
+запускать отдельно: python scripts/mock_openrouter.py --latency-ms 800
+"""
+
+import asyncio
+import hashlib
+import json
+import random
+import time
+import uuid
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+
+def prompt_hash(payload: dict) -> str:
+    """Stable key of a chat completion request (model is deliberately excluded)"""
+    key = {
+        "messages": payload.get("messages"),
+        "response_format": payload.get("response_format"),
+        "max_tokens": payload.get("max_tokens"),
+    }
+    raw = json.dumps(key, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def save_recording(recordings_dir: str, payload: dict, response: dict) -> Path:
+    path = Path(recordings_dir)
+    path.mkdir(parents=True, exist_ok=True)
+    file_path = path / f"{prompt_hash(payload)}.json"
+    file_path.write_text(
+        json.dumps({"model": payload.get("model"), "response": response}, ensure_ascii=False),
+        encoding="utf-8",
+    )
+    return file_path
+
+
+def load_recording(recordings_dir: str, key: str) -> Optional[dict]:
+    file_path = Path(recordings_dir) / f"{key}.json"
+    if not file_path.exists():
+        return None
+    return json.loads(file_path.read_text(encoding="utf-8"))["response"]
+
+
+@dataclass
+class MockConfig:
+    recordings_dir: str = "ai_recordings"
+    latency_ms: float = 0.0
+    latency_jitter_ms: float = 0.0
+    error_rate: float = 0.0  # Доля ответов 500
+    rate_limit_rate: float = 0.0  # Доля ответов 429
+    retry_after: float = 1.0
+    fallback: bool = True
+    seed: Optional[int] = None
+
+
+# Синтетические ответы по имени JSON-схемы (см. AIService._call_structured)
+_FALLBACK_CONTENT = {
+    "classification": {
+        "document_type": "Результаты анализа",
+        "document_subtype": "Общий анализ крови",
+        "research_area": "Гематология",
+        "specialties": ["Терапия"],
+        "document_date": "2024-01-15",
+        "patient_name": "Тестовый Пациент",
+        "medical_facility": "Тестовая клиника",
+        "document_language": "ru",
+        "confidence": 0.9,
+        "summary": "Синтетический ответ заглушки OpenRouter",
+    },
+    "labs": {
+        "lab_results": [
+            {"test_name": "Гемоглобин", "value": "135", "unit": "г/л", "reference_range": "120-160", "flag": "N"},
+            {"test_name": "Лейкоциты", "value": "11.2", "unit": "10^9/л", "reference_range": "4.0-9.0", "flag": "H"},
+        ]
+    },
+}
+
+
+def _fallback_content(payload: dict) -> str:
+    response_format = payload.get("response_format") or {}
+    schema_name = (response_format.get("json_schema") or {}).get("name")
+    if schema_name in _FALLBACK_CONTENT:
+        return json.dumps(_FALLBACK_CONTENT[schema_name], ensure_ascii=False)
+    if payload.get("max_tokens", 2000) <= 50:
+        # Короткие ответы-метки (категория аналита)
+        return "Общий анализ крови"
+    return "Синтетический ответ заглушки OpenRouter."
+
+
+def _completion(payload: dict, content: str) -> dict:
+    prompt_chars = len(json.dumps(payload.get("messages"), ensure_ascii=False))
+    prompt_tokens = prompt_chars // 4
+    completion_tokens = len(content) // 4
+    return {
+        "id": f"mock-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": payload.get("model", "mock"),
+        "choices": [{
+            "index": 0,
+            "finish_reason": "stop",
+            "message": {"role": "assistant", "content": content},
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+def create_mock_app(config: Optional[MockConfig] = None) -> FastAPI:
+    app = FastAPI(title="OpenRouter mock")
+    app.state.config = config or MockConfig()
+    app.state.random = random.Random(app.state.config.seed)
+    app.state.stats = {"requests": 0, "replayed": 0, "synthesized": 0, "errors": 0, "rate_limited": 0, "missing": 0}
+
+    @app.post("/api/v1/chat/completions")
+    async def chat_completions(request: Request):
+        cfg: MockConfig = app.state.config
+        rnd: random.Random = app.state.random
+        stats = app.state.stats
+        payload = await request.json()
+        stats["requests"] += 1
+
+        latency = cfg.latency_ms + rnd.uniform(-cfg.latency_jitter_ms, cfg.latency_jitter_ms)
+        if latency > 0:
+            await asyncio.sleep(latency / 1000)
+
+        roll = rnd.random()
+        if roll < cfg.rate_limit_rate:
+            stats["rate_limited"] += 1
+            return JSONResponse(
+                {"error": {"code": 429, "message": "Rate limit exceeded (mock)"}},
+                status_code=429,
+                headers={"Retry-After": str(cfg.retry_after)},
+            )
+        if roll < cfg.rate_limit_rate + cfg.error_rate:
+            stats["errors"] += 1
+            return JSONResponse({"error": {"code": 500, "message": "Upstream error (mock)"}}, status_code=500)
+
+        key = prompt_hash(payload)
+        recorded = load_recording(cfg.recordings_dir, key)
+        if recorded is not None:
+            stats["replayed"] += 1
+            return recorded
+        if not cfg.fallback:
+            stats["missing"] += 1
+            return JSONResponse(
+                {"error": {"code": 404, "message": f"No recording for prompt {key}"}},
+                status_code=404,
+            )
+        stats["synthesized"] += 1
+        return _completion(payload, _fallback_content(payload))
+
+    @app.get("/mock/config")
+    async def get_config():
+        return {"config": asdict(app.state.config), "stats": app.state.stats}
+
+    @app.put("/mock/config")
+    async def update_config(update: dict):
+        """Change injected latency/failure rates while a load test is running"""
+        cfg: MockConfig = app.state.config
+        for field, value in update.items():
+            if hasattr(cfg, field):
+                setattr(cfg, field, value)
+        if "seed" in update:
+            app.state.random = random.Random(cfg.seed)
+        return {"config": asdict(cfg)}
+
+    return app
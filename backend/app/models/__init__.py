@@ -1,7 +1,7 @@
 from app.models.user import User
 from app.models.document import Document, Tag, DocumentTag, Specialty, DocumentType
-from app.models.report import Report
-from app.models.interpretation import Interpretation, InterpretationStatus, interpretation_documents
+from app.models.report import Report, ReportStatus
+from app.models.interpretation import Interpretation, InterpretationStatus, interpretation_documents, compute_doc_set_hash
 from app.models.family import FamilyRelation, RelationType, INVERSE_RELATIONS
 from app.models.analyte import (
     AnalyteCategory,
@@ -11,6 +11,7 @@ from app.models.analyte import (
     UserAnalyteMapping,
 )
 from app.models.bot_state import TelegramBotState
+from app.models.business_counter import BusinessCounter, BusinessDailyCounter, UserActivity
 
 __all__ = [
     "User",
@@ -20,9 +21,11 @@ __all__ = [
     "Specialty",
     "DocumentType",
     "Report",
+    "ReportStatus",
     "Interpretation",
     "InterpretationStatus",
     "interpretation_documents",
+    "compute_doc_set_hash",
     "FamilyRelation",
     "RelationType",
     "INVERSE_RELATIONS",
@@ -34,5 +37,9 @@ __all__ = [
     "UserAnalyteMapping",
     # Telegram bot
     "TelegramBotState",
+    # Business metrics counters
+    "BusinessCounter",
+    "BusinessDailyCounter",
+    "UserActivity",
 ]
 
@@ -0,0 +1,44 @@
+"""
+Счётчики бизнес-метрик для /metrics/business.
+
+Значения поддерживаются триггерами PostgreSQL (app/db/business_counters.py)
+в той же транзакции, что и запись в users, documents, interpretations и
+reports, включая каскадные удаления. Чтение метрик - выборка нескольких
+строк вместо COUNT(*) по всем таблицам.
+"""
+
+from sqlalchemy import Column, String, BigInteger, Date, DateTime, ForeignKey, Index
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.sql import func
+
+from app.db.postgres import Base
+
+
+class BusinessCounter(Base):
+    """Накопительный счётчик: users_total, documents_total, storage_bytes, ..."""
+    __tablename__ = "business_counters"
+
+    name = Column(String(150), primary_key=True)
+    value = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class BusinessDailyCounter(Base):
+    """Количество созданных за день сущностей (для окон new_30d)"""
+    __tablename__ = "business_daily_counters"
+
+    name = Column(String(150), primary_key=True)
+    day = Column(Date, primary_key=True)
+    value = Column(BigInteger, nullable=False, default=0)
+
+
+class UserActivity(Base):
+    """Время последней загрузки документа пользователем (для active_30d)"""
+    __tablename__ = "user_activity"
+
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    last_document_at = Column(DateTime(timezone=True), nullable=False)
+
+    __table_args__ = (
+        Index('ix_user_activity_last_document_at', 'last_document_at'),
+    )
@@ -1,13 +1,25 @@
-from sqlalchemy import Column, String, Text, DateTime, Enum as SQLEnum, ForeignKey, Table
+from sqlalchemy import Column, String, Text, DateTime, Enum as SQLEnum, ForeignKey, Table, Index
 from sqlalchemy.dialects.postgresql import UUID, ARRAY
 from sqlalchemy.orm import relationship
 from datetime import datetime
+import hashlib
 import uuid
 import enum
 
 from app.db.postgres import Base
 
 
+def compute_doc_set_hash(document_ids) -> str:
+    """SHA-256 of the sorted document ids joined with commas
+
+    Совпадает с выражением, которым заполняются существующие записи
+    (app.db.schema_updates): uuid сортируются по значению, что для
+    строкового вида в нижнем регистре равносильно лексикографическому порядку.
+    """
+    joined = ",".join(sorted(str(document_id) for document_id in document_ids))
+    return hashlib.sha256(joined.encode("utf-8")).hexdigest()
+
+
 class InterpretationStatus(str, enum.Enum):
     """Статус обработки интерпретации"""
     pending = "pending"
@@ -28,10 +40,17 @@ interpretation_documents = Table(
 class Interpretation(Base):
     """Модель для хранения AI-интерпретаций результатов анализов"""
     __tablename__ = "interpretations"
+    __table_args__ = (
+        # Одна интерпретация на набор документов пользователя
+        Index("ix_interpretations_user_doc_set", "user_id", "doc_set_hash", unique=True),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     
+    # Хэш отсортированного набора document_id (compute_doc_set_hash)
+    doc_set_hash = Column(String(64), nullable=True)
+    
     # Статус обработки
     status = Column(
         SQLEnum(InterpretationStatus), 
@@ -1,18 +1,41 @@
-from sqlalchemy import Column, String, Integer, DateTime, ForeignKey, Text
+from sqlalchemy import Column, String, Integer, DateTime, ForeignKey, Text, Index
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.sql import func
 import uuid
+import enum
 
 from app.db.postgres import Base
 
+
+class ReportStatus(str, enum.Enum):
+    """Статус генерации отчёта"""
+    pending = "pending"
+    processing = "processing"
+    completed = "completed"
+    failed = "failed"
+
+
 class Report(Base):
     __tablename__ = "reports"
+    __table_args__ = (
+        # Поиск готового отчёта с теми же фильтрами
+        Index("ix_reports_user_filters_hash", "user_id", "filters_hash"),
+    )
     
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
     report_type = Column(String(100))
-    filters_applied = Column(Text)  # JSON string
-    file_url = Column(Text, nullable=False)
+    status = Column(String(20), nullable=False, default=ReportStatus.completed.value, server_default=ReportStatus.completed.value)
+    error_message = Column(Text)
+    filters_applied = Column(Text)  # Canonical JSON (sorted keys)
+    filters_hash = Column(String(64))  # SHA-256 of report_type and filters_applied
+    # Состояние выбранных документов на момент запроса: совпадение значит, что отчёт актуален
+    documents_count = Column(Integer)
+    documents_updated_at = Column(DateTime(timezone=True))
+    file_url = Column(Text)  # Empty until the report is generated
     file_size = Column(Integer)
     created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+    # Последняя смена статуса: по ней находятся отчёты, брошенные остановленным воркером
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    completed_at = Column(DateTime(timezone=True))
 
@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import Optional, Dict, Any
+from pydantic import BaseModel, field_validator
+from typing import Optional, Dict, Any, Union
 from datetime import datetime, date
 import uuid
 
@@ -29,6 +29,39 @@ class DocumentMetadata(BaseModel):
     # MongoDB extracted_data fields
     summary: Optional[str] = None
 
+class DocumentClassificationResult(BaseModel):
+    """Structured output of the document classification prompt"""
+    document_type: str = "Другое"
+    document_subtype: Optional[str] = None
+    research_area: Optional[str] = None
+    specialties: Optional[list[str]] = None
+    document_date: Optional[date] = None
+    patient_name: Optional[str] = None
+    medical_facility: Optional[str] = None
+    document_language: Optional[str] = "ru"
+    confidence: Optional[float] = 0.5
+    summary: Optional[str] = None
+
+class LabResultItem(BaseModel):
+    """Single lab row returned by the labs extraction prompt"""
+    test_name: Optional[str] = None
+    value: Optional[str] = None
+    unit: Optional[str] = None
+    reference_range: Optional[str] = None
+    flag: Optional[str] = None  # L | N | H | A
+
+    @field_validator("value", "unit", "reference_range", mode="before")
+    @classmethod
+    def _numbers_to_str(cls, v: Union[str, int, float, None]):
+        # Модель иногда возвращает числа вместо строк
+        if isinstance(v, (int, float)) and not isinstance(v, bool):
+            return str(v)
+        return v
+
+class LabExtractionResult(BaseModel):
+    """Structured output of the labs extraction prompt"""
+    lab_results: list[LabResultItem] = []
+
 class Document(DocumentBase):
     id: uuid.UUID
     user_id: uuid.UUID
@@ -57,8 +90,21 @@ class DocumentUploadResponse(BaseModel):
     status: str
     message: str
 
+class BatchUploadItem(BaseModel):
+    filename: str
+    document_id: Optional[uuid.UUID] = None
+    status: str  # pending | duplicate | error
+    message: Optional[str] = None
+
+class BatchUploadResponse(BaseModel):
+    accepted: int
+    duplicates: int
+    failed: int
+    items: list[BatchUploadItem]
+
 class TimelineEvent(BaseModel):
     document_id: uuid.UUID
+    profile_id: Optional[uuid.UUID] = None  # Владелец документа - для общей ленты семьи
     date: Optional[date]
     document_type: Optional[str]
     document_subtype: Optional[str] = None
@@ -85,6 +131,8 @@ class ReportFilters(BaseModel):
 
 class ReportGenerateRequest(BaseModel):
     filters: ReportFilters
+    # False - только таблицы и графики из сохранённых данных, без запроса к LLM
+    include_narrative: bool = True
     
 class ReportGenerateResponse(BaseModel):
     report_id: uuid.UUID
@@ -0,0 +1,73 @@
+"""
+Транспорт для запросов AIService к LLM.
+
+AI_BACKEND выбирает, куда уходят запросы _call_openrouter:
+- "openrouter" - реальный API по OPENROUTER_BASE_URL (значение по умолчанию);
+- "mock" - встроенная заглушка app.mocks.openrouter, вызывается в том же
+  процессе через ASGI без сети, с задержками и ошибками из AI_MOCK_*.
+
+Для отдельного процесса заглушки (scripts/mock_openrouter.py) достаточно
+оставить "openrouter" и указать её адрес в OPENROUTER_BASE_URL.
+
+При AI_RECORD_RESPONSES=true успешные ответы сохраняются в
+AI_RECORDINGS_DIR по хэшу промпта и затем воспроизводятся заглушкой.
+"""
+
+import logging
+from typing import Optional
+
+import httpx
+
+from app.core.config import settings
+from app.mocks.openrouter import MockConfig, create_mock_app, save_recording
+
+logger = logging.getLogger(__name__)
+
+MOCK_BASE_URL = "http://openrouter-mock/api/v1/chat/completions"
+
+
+class AIBackend:
+    """POSTs chat completion payloads to the configured endpoint"""
+
+    def __init__(
+        self,
+        base_url: str,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        recordings_dir: Optional[str] = None,
+    ):
+        self.base_url = base_url
+        self.transport = transport
+        self.recordings_dir = recordings_dir
+
+    async def post(self, payload: dict, headers: dict, timeout: float = 60.0) -> httpx.Response:
+        async with httpx.AsyncClient(timeout=timeout, transport=self.transport) as client:
+            response = await client.post(self.base_url, headers=headers, json=payload)
+
+        if self.recordings_dir and response.status_code == 200:
+            try:
+                save_recording(self.recordings_dir, payload, response.json())
+            except (OSError, ValueError) as e:
+                logger.warning("Не удалось сохранить запись ответа LLM: %s", e)
+        return response
+
+
+def create_ai_backend() -> AIBackend:
+    recordings_dir = settings.AI_RECORDINGS_DIR if settings.AI_RECORD_RESPONSES else None
+
+    if settings.AI_BACKEND == "openrouter":
+        return AIBackend(settings.OPENROUTER_BASE_URL, recordings_dir=recordings_dir)
+
+    if settings.AI_BACKEND == "mock":
+        mock_app = create_mock_app(MockConfig(
+            recordings_dir=settings.AI_RECORDINGS_DIR,
+            latency_ms=settings.AI_MOCK_LATENCY_MS,
+            latency_jitter_ms=settings.AI_MOCK_LATENCY_JITTER_MS,
+            error_rate=settings.AI_MOCK_ERROR_RATE,
+            rate_limit_rate=settings.AI_MOCK_RATE_LIMIT_RATE,
+            fallback=settings.AI_MOCK_FALLBACK,
+            seed=settings.AI_MOCK_SEED,
+        ))
+        # Записывать ответы самой заглушки бессмысленно
+        return AIBackend(MOCK_BASE_URL, transport=httpx.ASGITransport(app=mock_app))
+
+    raise ValueError(f"Неизвестный AI_BACKEND: {settings.AI_BACKEND}")
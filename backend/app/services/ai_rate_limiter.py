@@ -0,0 +1,200 @@
+"""
+Ограничение нагрузки на OpenRouter.
+
+Все вызовы LLM проходят через общий `openrouter_limiter`:
+- token bucket по запросам в секунду (OPENROUTER_MAX_RPS)
+- token bucket по токенам в минуту (OPENROUTER_TOKENS_PER_MINUTE)
+- семафор на число одновременных запросов (OPENROUTER_MAX_CONCURRENCY)
+- circuit breaker, который после серии ошибок приостанавливает вызовы
+
+Вызовы не падают при исчерпании лимита, а ждут своей очереди.
+Лимиты действуют в пределах одного процесса: при нескольких воркерах
+uvicorn их нужно делить на число воркеров.
+"""
+
+import asyncio
+import math
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+from app.core.config import settings
+
+
+class CircuitOpenError(Exception):
+    """Upstream is considered unavailable and waiting would take too long"""
+
+
+class TokenBucket:
+    """Async token bucket: `capacity` tokens, refilled at `rate` tokens per second"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, amount: float = 1.0) -> None:
+        if self.rate <= 0:
+            return
+        # Запрос больше ёмкости всё равно должен пройти, когда ведро полное
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                await asyncio.sleep((amount - self._tokens) / self.rate)
+
+    def adjust(self, delta: float) -> None:
+        """Return (positive) or charge (negative) tokens after the real cost is known"""
+        if self.rate <= 0:
+            return
+        self._refill()
+        self._tokens = min(self.capacity, self._tokens + delta)
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures for `reset_timeout` seconds.
+
+    While open, callers wait for the window to pass; then a single probe call
+    is let through (half-open) and its result closes or re-opens the circuit.
+    A probe that ends without a result (non-retryable error, cancellation)
+    must be returned with `release_probe`, otherwise no further probe is let through.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    async def wait_until_allowed(self, max_wait: float) -> bool:
+        """Wait until a call is allowed; True if the caller holds the half-open probe"""
+        deadline = time.monotonic() + max_wait
+        while True:
+            state = self.state
+            if state == "closed":
+                return False
+            if state == "half_open" and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            if state == "open":
+                delay = self._opened_at + self.reset_timeout - time.monotonic()
+            else:
+                delay = 0.5
+            if time.monotonic() + delay > deadline:
+                raise CircuitOpenError("OpenRouter временно недоступен, повторите позже")
+            await asyncio.sleep(max(delay, 0.05))
+
+    def record_success(self) -> None:
+        self._failures = 0
+        self._opened_at = None
+        self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        if self._probe_in_flight or self._failures >= self.failure_threshold:
+            self._opened_at = time.monotonic()
+        self._probe_in_flight = False
+
+    def release_probe(self) -> None:
+        """Let the next caller probe; no-op if the probe already recorded its result"""
+        self._probe_in_flight = False
+
+
+class OpenRouterLimiter:
+    """Shared admission control for every OpenRouter call"""
+
+    RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+    def __init__(self):
+        rps = settings.OPENROUTER_MAX_RPS
+        tpm = settings.OPENROUTER_TOKENS_PER_MINUTE
+        self.requests = TokenBucket(rate=rps, capacity=max(1.0, rps))
+        self.tokens = TokenBucket(rate=tpm / 60.0, capacity=tpm)
+        self.breaker = CircuitBreaker(
+            failure_threshold=settings.OPENROUTER_CIRCUIT_FAILURE_THRESHOLD,
+            reset_timeout=settings.OPENROUTER_CIRCUIT_RESET_SECONDS,
+        )
+        self.max_retries = settings.OPENROUTER_MAX_RETRIES
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(settings.OPENROUTER_MAX_CONCURRENCY)
+        return self._semaphore
+
+    @asynccontextmanager
+    async def admit(self, estimated_tokens: int) -> AsyncIterator[None]:
+        """Admission of one attempt: circuit, request and token budgets (semaphore is taken separately)
+
+        Если попытка была пробной (half-open), проба освобождается при любом
+        выходе из блока, в том числе при отмене и неповторяемых ошибках.
+        """
+        probe = await self.breaker.wait_until_allowed(settings.OPENROUTER_CIRCUIT_MAX_WAIT_SECONDS)
+        try:
+            await self.requests.acquire(1)
+            await self.tokens.acquire(estimated_tokens)
+            yield
+        finally:
+            if probe:
+                self.breaker.release_probe()
+
+    def settle_tokens(self, estimated_tokens: int, actual_tokens: Optional[int]) -> None:
+        if actual_tokens is not None:
+            self.tokens.adjust(estimated_tokens - actual_tokens)
+
+    def backoff_delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """Exponential backoff with full jitter, honouring Retry-After when given
+
+        Retry-After ограничен OPENROUTER_RETRY_MAX_DELAY: фоновые задачи
+        ждут, удерживая слот семафора.
+        """
+        if retry_after:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                delay = None
+            if delay is not None and math.isfinite(delay):
+                return min(max(delay, 0.0), settings.OPENROUTER_RETRY_MAX_DELAY)
+        base = settings.OPENROUTER_RETRY_BASE_DELAY * (2 ** attempt)
+        return random.uniform(0, min(base, settings.OPENROUTER_RETRY_MAX_DELAY))
+
+
+def estimate_message_tokens(messages: list, max_tokens: int) -> int:
+    """Rough token estimate for budgeting: ~4 characters per token plus the completion"""
+    chars = 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            chars += len(content)
+        elif isinstance(content, list):
+            for part in content:
+                if part.get("type") == "text":
+                    chars += len(part.get("text", ""))
+                else:
+                    # Изображения тарифицируются провайдером примерно фиксированно
+                    chars += 4 * 1500
+    return chars // 4 + max_tokens
+
+
+openrouter_limiter = OpenRouterLimiter()
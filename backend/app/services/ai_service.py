@@ -1,21 +1,41 @@
-import base64
+import asyncio
+import hashlib
+import logging
+import time
 import httpx
-import json
 from typing import Optional
 from datetime import datetime
-from io import BytesIO
-import PyPDF2
+from pydantic import BaseModel, ValidationError
 
 from app.core.config import settings
-from app.schemas.document import DocumentMetadata
+from app.schemas.document import DocumentMetadata, DocumentClassificationResult, LabExtractionResult
+from app.core.metrics import ai_parse_failures_total, ai_parse_retries_total, ai_tokens_total
+from app.core.tracing import stage, trace_labels
+from app.services.ai_backend import create_ai_backend
+from app.services.ai_rate_limiter import openrouter_limiter, estimate_message_tokens
+from app.services.pdf_text_service import pdf_text_service
+from app.services.image_preprocessing_service import image_preprocessing_service
+from app.services.prompt_builder import build_compact_context, load_prompt_documents
+
+logger = logging.getLogger(__name__)
+
+# Меньше символов - считаем PDF сканом без текстового слоя
+MIN_PDF_TEXT_LENGTH = 50
 
 class AIService:
     def __init__(self):
         self.api_key = settings.OPENROUTER_API_KEY
         self.model = settings.OPENROUTER_MODEL
-        self.base_url = settings.OPENROUTER_BASE_URL
+        self.backend = create_ai_backend()
+        self.base_url = self.backend.base_url
     
-    async def analyze_document(self, file_bytes: bytes, file_type: str, filename: str) -> DocumentMetadata:
+    async def analyze_document(
+        self,
+        file_bytes: bytes,
+        file_type: str,
+        filename: str,
+        file_hash: Optional[str] = None
+    ) -> DocumentMetadata:
         """Analyze document and extract metadata using AI"""
         
         try:
@@ -25,67 +45,39 @@ class AIService:
             # Handle different file types
             if file_type == 'pdf':
                 # Extract text from PDF
-                print("📄 Извлекаем текст из PDF...")
-                text_content = self._extract_text_from_pdf(file_bytes)
-                
-                if not text_content or len(text_content.strip()) < 50:
-                    raise ValueError("PDF содержит слишком мало текста или это отсканированное изображение. Требуется OCR.")
+                text_content = await self._extract_text_from_pdf(file_bytes, file_hash)
                 
-                print(f"  ✅ Извлечено {len(text_content)} символов текста")
-                print(f"  📝 Первые 200 символов: {text_content[:200]}...")
-                
-                # Prepare text-only message
-                messages = [
-                    {
-                        "role": "user",
-                        "content": f"{prompt}\n\nТекст медицинского документа:\n\n{text_content}"
-                    }
-                ]
+                if self._is_scanned_pdf_text(text_content):
+                    # No text layer - send rendered pages to the vision model
+                    logger.info("PDF без текстового слоя, отправляем страницы как изображения")
+                    page_urls = await image_preprocessing_service.pdf_pages_to_data_urls(file_bytes, file_hash)
+                    if not page_urls:
+                        raise ValueError("Не удалось получить страницы из PDF")
+                    # Для классификации достаточно первых страниц
+                    messages = self._build_vision_messages(prompt, page_urls[:settings.VISION_PAGES_PER_REQUEST])
+                else:
+                    logger.debug("Извлечено %d символов текста из PDF", len(text_content))
+                    
+                    # Prepare text-only message
+                    messages = self._build_text_messages(prompt, text_content)
                 
             elif file_type in ['jpg', 'jpeg', 'png']:
                 # Use vision API for images
-                print(f"🖼️ Обрабатываем изображение ({file_type})...")
-                
-                # Encode file to base64
-                file_base64 = base64.b64encode(file_bytes).decode('utf-8')
-                
-                # Determine content type
-                if file_type in ['jpg', 'jpeg']:
-                    mime_type = 'image/jpeg'
-                else:
-                    mime_type = 'image/png'
+                # Pre-process (rotate, crop, downscale) and encode once per file
+                image_url = await image_preprocessing_service.to_data_url(file_bytes, file_type, file_hash)
                 
                 # Prepare vision message
-                messages = [
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": prompt
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:{mime_type};base64,{file_base64}"
-                                }
-                            }
-                        ]
-                    }
-                ]
+                messages = self._build_vision_messages(prompt, [image_url])
             else:
                 raise ValueError(f"Unsupported file type: {file_type}")
             
-            # Call OpenRouter API
-            response_data = await self._call_openrouter(messages)
-            
-            # Parse response
-            metadata = self._parse_ai_response(response_data)
+            # Call OpenRouter API and validate the structured response
+            result = await self._call_structured(messages, DocumentClassificationResult, "classification")
             
-            return metadata
+            return self._to_document_metadata(result)
             
         except Exception as e:
-            print(f"❌ AI analysis failed: {str(e)}")
+            logger.exception("AI analysis failed for %s", filename)
             # Return default metadata on error
             return DocumentMetadata(
                 document_type="неизвестно",
@@ -93,24 +85,40 @@ class AIService:
                 summary=f"Не удалось автоматически проанализировать документ: {str(e)}"
             )
     
-    def _extract_text_from_pdf(self, file_bytes: bytes) -> str:
-        """Extract text content from PDF file"""
+    @staticmethod
+    def _is_scanned_pdf_text(text_content: str) -> bool:
+        """PDF without a usable text layer (scan or photo) needs the vision route"""
+        return not text_content or len(text_content.strip()) < MIN_PDF_TEXT_LENGTH
+    
+    @staticmethod
+    def _build_instructions_message(prompt: str) -> dict:
+        """Static instructions as a system message, marked for provider-side prompt caching"""
+        part = {"type": "text", "text": prompt}
+        if settings.AI_PROMPT_CACHING:
+            part["cache_control"] = {"type": "ephemeral"}
+        return {"role": "system", "content": [part]}
+    
+    def _build_text_messages(self, prompt: str, text_content: str) -> list:
+        """Cached instructions followed by the document text"""
+        return [
+            self._build_instructions_message(prompt),
+            {"role": "user", "content": f"Текст медицинского документа:\n\n{text_content}"}
+        ]
+    
+    def _build_vision_messages(self, prompt: str, image_urls: list[str]) -> list:
+        """Cached instructions followed by one or more document images"""
+        content = [{"type": "text", "text": "Изображение медицинского документа:"}]
+        for image_url in image_urls:
+            content.append({"type": "image_url", "image_url": {"url": image_url}})
+        return [self._build_instructions_message(prompt), {"role": "user", "content": content}]
+    
+    async def _extract_text_from_pdf(self, file_bytes: bytes, file_hash: Optional[str] = None) -> str:
+        """Extract text content from PDF file (process pool, cached per file_hash)"""
         try:
-            pdf_file = BytesIO(file_bytes)
-            pdf_reader = PyPDF2.PdfReader(pdf_file)
-            
-            text_parts = []
-            for page_num in range(len(pdf_reader.pages)):
-                page = pdf_reader.pages[page_num]
-                text = page.extract_text()
-                if text:
-                    text_parts.append(text)
-            
-            full_text = "\n\n".join(text_parts)
-            return full_text.strip()
-            
+            with stage("text_extraction"):
+                return await pdf_text_service.extract_text(file_bytes, file_hash)
         except Exception as e:
-            print(f"❌ Ошибка извлечения текста из PDF: {e}")
+            logger.warning("Ошибка извлечения текста из PDF: %s", e)
             raise ValueError(f"Не удалось извлечь текст из PDF: {str(e)}")
     
     def _build_extraction_prompt(self) -> str:
@@ -194,15 +202,32 @@ class AIService:
 - Без дополнительного текста
 - Проверь, что структура соответствует типу документа"""
     
-    async def _call_openrouter(self, messages: list) -> dict:
-        """Make API call to OpenRouter"""
+    async def _call_openrouter(
+        self,
+        messages: list,
+        max_tokens: int = 2000,
+        temperature: float = 0.1,
+        response_format: Optional[dict] = None,
+        stage_name: str = "llm"
+    ) -> dict:
+        """Make API call to OpenRouter
+        
+        Calls go through the shared rate limiter (RPS, tokens per minute,
+        concurrency) and circuit breaker; 429/5xx responses and network
+        errors are retried with jittered exponential backoff. Every attempt
+        is timed as `stage_name` from the moment the limiter admits it (the
+        wait is recorded as the span's queue_seconds), and its token usage
+        is counted.
+        """
         
         payload = {
             "model": self.model,
             "messages": messages,
-            "max_tokens": 2000,
-            "temperature": 0.1  # Low temperature for consistent extraction
+            "max_tokens": max_tokens,
+            "temperature": temperature  # Low temperature for consistent extraction
         }
+        if response_format:
+            payload["response_format"] = response_format
         
         headers = {
             "Authorization": f"Bearer {self.api_key}",
@@ -211,83 +236,147 @@ class AIService:
             "X-Title": "MedHistory"
         }
         
-        # Debug logging
-        print(f"🔍 OpenRouter Request:")
-        print(f"  URL: {self.base_url}")
-        print(f"  Model: {self.model}")
-        print(f"  API Key: {self.api_key[:10]}...{self.api_key[-10:]}")
-        print(f"  Message content types: {[type(m['content']) for m in messages]}")
+        limiter = openrouter_limiter
+        estimated_tokens = estimate_message_tokens(messages, max_tokens)
+        attempt = 0
         
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            try:
-                response = await client.post(
-                    self.base_url,
-                    headers=headers,
-                    json=payload
-                )
-                
-                # Log response details
-                print(f"📥 OpenRouter Response:")
-                print(f"  Status: {response.status_code}")
-                print(f"  Response: {response.text[:500]}")
-                
-                response.raise_for_status()
-                return response.json()
-            except httpx.HTTPStatusError as e:
-                print(f"❌ HTTP Error: {e.response.status_code}")
-                print(f"   Response body: {e.response.text}")
-                raise
-            except Exception as e:
-                print(f"❌ Request Error: {str(e)}")
-                raise
+        while True:
+            retry_after = None
+            # Исход попытки фиксируется внутри admit: пробная попытка
+            # half-open освобождается при любом выходе из блока
+            queued_at = time.perf_counter()
+            async with limiter.admit(estimated_tokens):
+                try:
+                    async with limiter.semaphore:
+                        # Ожидание лимитов в span не входит: он измеряет только вызов OpenRouter
+                        with stage(stage_name) as span:
+                            span.set_attribute("attempt", attempt)
+                            span.set_attribute("queue_seconds", round(time.perf_counter() - queued_at, 3))
+                            response = await self.backend.post(payload, headers)
+                            
+                            span.set_attribute("status_code", response.status_code)
+                            response.raise_for_status()
+                            data = response.json()
+                            limiter.breaker.record_success()
+                            usage = data.get("usage") or {}
+                            limiter.settle_tokens(estimated_tokens, usage.get("total_tokens"))
+                            self._record_token_usage(stage_name, usage, span)
+                            logger.debug(
+                                "OpenRouter response",
+                                extra={"stage": stage_name, "model": self.model, "attempt": attempt, "usage": usage}
+                            )
+                            return data
+                except httpx.HTTPStatusError as e:
+                    logger.warning(
+                        "OpenRouter HTTP %s: %s", e.response.status_code, e.response.text[:500],
+                        extra={"stage": stage_name, "attempt": attempt}
+                    )
+                    if e.response.status_code not in limiter.RETRYABLE_STATUS_CODES:
+                        raise
+                    limiter.breaker.record_failure()
+                    retry_after = e.response.headers.get("Retry-After")
+                    if attempt >= limiter.max_retries:
+                        raise
+                except httpx.TransportError as e:
+                    logger.warning("OpenRouter request error: %s", e, extra={"stage": stage_name, "attempt": attempt})
+                    limiter.breaker.record_failure()
+                    if attempt >= limiter.max_retries:
+                        raise
+                except Exception:
+                    logger.exception("OpenRouter request failed", extra={"stage": stage_name})
+                    raise
+            
+            delay = limiter.backoff_delay(attempt, retry_after)
+            attempt += 1
+            logger.info("OpenRouter retry %d/%d in %.1fs", attempt, limiter.max_retries, delay)
+            await asyncio.sleep(delay)
+    
+    @staticmethod
+    def _record_token_usage(stage_name: str, usage: dict, span) -> None:
+        labels = trace_labels()
+        for token_type in ("prompt_tokens", "completion_tokens"):
+            count = usage.get(token_type)
+            if count:
+                ai_tokens_total.labels(stage=stage_name, token_type=token_type, **labels).inc(count)
+                span.set_attribute(token_type, count)
+    
+    @staticmethod
+    def _json_schema_format(result_model: type[BaseModel], name: str) -> dict:
+        """response_format requesting JSON constrained by the Pydantic model schema"""
+        return {
+            "type": "json_schema",
+            "json_schema": {
+                "name": name,
+                "strict": False,
+                "schema": result_model.model_json_schema(),
+            },
+        }
+    
+    @staticmethod
+    def _extract_json_content(response_data: dict) -> str:
+        """Return the JSON text of a completion, tolerating markdown fences"""
+        content = response_data["choices"][0]["message"]["content"] or ""
+        # Провайдеры без поддержки response_format иногда оборачивают JSON в markdown
+        if "```json" in content:
+            content = content.split("```json")[1].split("```")[0]
+        elif "```" in content:
+            content = content.split("```")[1].split("```")[0]
+        return content.strip()
     
-    def _parse_ai_response(self, response_data: dict) -> DocumentMetadata:
-        """Parse AI response and create DocumentMetadata"""
+    async def _call_structured(self, messages: list, result_model: type[BaseModel], kind: str) -> BaseModel:
+        """Call the LLM in JSON-schema mode and validate the result
         
-        try:
-            # Extract content from response
-            content = response_data["choices"][0]["message"]["content"]
-            
-            # Parse JSON from content
-            # Sometimes the model wraps JSON in markdown code blocks
-            if "```json" in content:
-                content = content.split("```json")[1].split("```")[0].strip()
-            elif "```" in content:
-                content = content.split("```")[1].split("```")[0].strip()
-            
-            data = json.loads(content)
-            
-            # Create DocumentMetadata object with new structure
-            metadata = DocumentMetadata(
-                # PostgreSQL fields
-                document_type=data.get("document_type", "Другое"),
-                document_date=data.get("document_date"),
-                patient_name=data.get("patient_name"),
-                medical_facility=data.get("medical_facility"),
-                
-                # MongoDB classification fields
-                document_subtype=data.get("document_subtype"),
-                research_area=data.get("research_area"),
-                specialties=data.get("specialties"),
-                document_language=data.get("document_language", "ru"),
-                confidence=data.get("confidence", 0.5),
-                
-                # MongoDB extracted_data fields
-                summary=data.get("summary")
+        Malformed or schema-violating responses are re-requested up to
+        AI_PARSE_MAX_RETRIES times; failures and retries are counted.
+        """
+        response_format = (
+            self._json_schema_format(result_model, kind) if settings.AI_STRUCTURED_OUTPUT else None
+        )
+        attempt = 0
+        while True:
+            response_data = await self._call_openrouter(
+                messages, response_format=response_format, stage_name=f"llm_{kind}"
             )
+            try:
+                with stage("json_parse"):
+                    return result_model.model_validate_json(self._extract_json_content(response_data))
+            except (ValidationError, KeyError, IndexError, TypeError) as e:
+                ai_parse_failures_total.labels(kind=kind).inc()
+                logger.warning(
+                    "Error parsing %s response: %s", kind, e,
+                    extra={"response_preview": str(response_data)[:500]}
+                )
+                if attempt >= settings.AI_PARSE_MAX_RETRIES:
+                    raise
+                attempt += 1
+                ai_parse_retries_total.labels(kind=kind).inc()
+    
+    @staticmethod
+    def _to_document_metadata(result: DocumentClassificationResult) -> DocumentMetadata:
+        """Create DocumentMetadata from the validated classification"""
+        return DocumentMetadata(
+            # PostgreSQL fields
+            document_type=result.document_type,
+            document_date=result.document_date,
+            patient_name=result.patient_name,
+            medical_facility=result.medical_facility,
             
-            return metadata
+            # MongoDB classification fields
+            document_subtype=result.document_subtype,
+            research_area=result.research_area,
+            specialties=result.specialties,
+            document_language=result.document_language,
+            confidence=result.confidence,
             
-        except Exception as e:
-            print(f"❌ Error parsing AI response: {str(e)}")
-            print(f"Response content: {response_data}")
-            raise
+            # MongoDB extracted_data fields
+            summary=result.summary
+        )
     
     async def generate_report_content(self, documents: list, filters: dict) -> str:
         """Generate report content using AI"""
         
         # Prepare context from documents
-        context = self._prepare_report_context(documents)
+        context = await self._prepare_report_context(documents)
         
         prompt = f"""Создай подробный медицинский отчёт для пациента на основе следующих документов:
 
@@ -311,29 +400,28 @@ class AIService:
             }
         ]
         
-        response_data = await self._call_openrouter(messages)
+        response_data = await self._call_openrouter(messages, stage_name="llm_report")
         content = response_data["choices"][0]["message"]["content"]
         
         return content
     
-    def _prepare_report_context(self, documents: list) -> str:
-        """Prepare context from documents for report generation"""
-        
-        context_parts = []
+    async def _prepare_report_context(self, documents: list) -> str:
+        """Prepare a token-budgeted context: document list, analyte trends and summaries"""
         
-        for doc in documents:
-            doc_info = f"""
-Дата: {doc.document_date or 'не указана'}
-Тип: {doc.document_type or 'не указан'}
-Пациент: {doc.patient_name or 'не указан'}
-Учреждение: {doc.medical_facility or 'не указано'}
-Файл: {doc.original_filename}
-"""
-            context_parts.append(doc_info)
+        patient_names = sorted({doc.patient_name for doc in documents if doc.patient_name})
+        prompt_documents = await load_prompt_documents(documents)
+        context = build_compact_context(prompt_documents, settings.REPORT_PROMPT_TOKEN_BUDGET)
         
-        return "\n---\n".join(context_parts)
-
-    async def extract_lab_results(self, file_bytes: bytes, file_type: str, filename: str) -> dict:
+        header = f"Пациент: {', '.join(patient_names) or 'не указан'}\nВсего документов: {len(documents)}\n"
+        return f"{header}\n{context.text}"
+
+    async def extract_lab_results(
+        self,
+        file_bytes: bytes,
+        file_type: str,
+        filename: str,
+        file_hash: Optional[str] = None
+    ) -> dict:
         """Extract laboratory results using a specialized prompt.
 
         Returns a dict with key "lab_results": list of standardized entries.
@@ -343,30 +431,58 @@ class AIService:
 
         # Prepare messages similarly to analyze_document
         if file_type == 'pdf':
-            text_content = self._extract_text_from_pdf(file_bytes)
-            messages = [
-                {
-                    "role": "user",
-                    "content": f"{prompt}\n\nТекст медицинского документа:\n\n{text_content}"
-                }
-            ]
+            text_content = await self._extract_text_from_pdf(file_bytes, file_hash)
+            if self._is_scanned_pdf_text(text_content):
+                return await self._extract_lab_results_from_scanned_pdf(prompt, file_bytes, file_hash)
+            messages = self._build_text_messages(prompt, text_content)
         elif file_type in ['jpg', 'jpeg', 'png']:
-            file_base64 = base64.b64encode(file_bytes).decode('utf-8')
-            mime_type = 'image/jpeg' if file_type in ['jpg', 'jpeg'] else 'image/png'
-            messages = [
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{file_base64}"}},
-                    ],
-                }
-            ]
+            image_url = await image_preprocessing_service.to_data_url(file_bytes, file_type, file_hash)
+            messages = self._build_vision_messages(prompt, [image_url])
         else:
             raise ValueError(f"Unsupported file type: {file_type}")
 
-        response_data = await self._call_openrouter(messages)
-        return self._parse_labs_response(response_data)
+        return await self._extract_labs_structured(messages)
+
+    @property
+    def labs_prompt_version(self) -> str:
+        """Short fingerprint of the labs extraction prompt, stored with every extraction"""
+        return hashlib.sha256(self._build_labs_extraction_prompt().encode("utf-8")).hexdigest()[:12]
+
+    async def _extract_lab_results_from_scanned_pdf(
+        self,
+        prompt: str,
+        file_bytes: bytes,
+        file_hash: Optional[str]
+    ) -> dict:
+        """Send rendered pages in batches of VISION_PAGES_PER_REQUEST and merge the results"""
+        page_urls = await image_preprocessing_service.pdf_pages_to_data_urls(file_bytes, file_hash)
+        if file_hash:
+            # Экстракция анализов - последний vision-запрос по файлу
+            image_preprocessing_service.forget_pages(file_hash)
+        batch_size = settings.VISION_PAGES_PER_REQUEST
+        batches = [page_urls[i:i + batch_size] for i in range(0, len(page_urls), batch_size)]
+
+        # Concurrency is bounded by the OpenRouter limiter. Результат без части
+        # страниц был бы неполным, поэтому ошибка одного пакета (в том числе
+        # неразобранный ответ) отменяет остальные
+        try:
+            async with asyncio.TaskGroup() as group:
+                tasks = [
+                    group.create_task(self._call_structured(
+                        self._build_vision_messages(prompt, batch), LabExtractionResult, "labs"
+                    ))
+                    for batch in batches
+                ]
+        except ExceptionGroup as errors:
+            if len(errors.exceptions) > 1:
+                logger.warning("Labs extraction failed in %d page batches", len(errors.exceptions))
+            # Наружу - исходное исключение, как при одном пакете
+            raise errors.exceptions[0] from None
+
+        lab_results = []
+        for task in tasks:
+            lab_results.extend(item.model_dump() for item in task.result().lab_results)
+        return {"lab_results": lab_results}
 
     def _build_labs_extraction_prompt(self) -> str:
         return """Определи, есть ли в документе результаты лабораторных анализов. Если да, извлеки их в JSON по стандартизованной схеме.
@@ -405,31 +521,13 @@ class AIService:
 - "Гемоглобин 14.5 г/дл" → {"test_name": "Гемоглобин", "value": "14.5", "unit": "г/дл", ...}
 """
 
-    def _parse_labs_response(self, response_data: dict) -> dict:
+    async def _extract_labs_structured(self, messages: list) -> dict:
+        """Run the labs prompt; an unparseable answer yields no lab results"""
         try:
-            content = response_data["choices"][0]["message"]["content"]
-            if "```json" in content:
-                content = content.split("```json")[1].split("```")[0].strip()
-            elif "```" in content:
-                content = content.split("```")[1].split("```")[0].strip()
-            data = json.loads(content)
-
-            # Basic normalization
-            lab_results = data.get("lab_results") or []
-            normalized = []
-            for item in lab_results:
-                normalized.append({
-                    "test_name": item.get("test_name"),
-                    "value": item.get("value"),
-                    "unit": item.get("unit"),
-                    "reference_range": item.get("reference_range"),
-                    "flag": item.get("flag"),
-                })
-            return {"lab_results": normalized}
-        except Exception as e:
-            print(f"❌ Error parsing labs response: {e}")
-            print(f"Response content: {response_data}")
+            result = await self._call_structured(messages, LabExtractionResult, "labs")
+        except (ValidationError, KeyError, IndexError, TypeError):
             return {"lab_results": []}
+        return {"lab_results": [item.model_dump() for item in result.lab_results]}
 
 # Create global instance
 ai_service = AIService()
@@ -5,6 +5,7 @@
 использует AI для определения категории и кэширует результат в MongoDB.
 """
 
+import logging
 import json
 from typing import Optional, Dict, Any, List
 from datetime import datetime
@@ -15,11 +16,9 @@ from app.services.analyte_normalization_service import (
     _SYNONYM_INDEX,
     _register_analyte
 )
-from app.core.config import settings
+from app.db.mongodb import analyte_category_cache_collection
 
-
-# Коллекция для кэширования AI-определенных категорий
-_CATEGORY_CACHE_COLLECTION = "analyte_category_cache"
+logger = logging.getLogger(__name__)
 
 
 class AnalyteCategoryService:
@@ -103,13 +102,7 @@ class AnalyteCategoryService:
     async def _get_cached_category(cls, test_name: str) -> Optional[str]:
         """Получает категорию из кэша MongoDB"""
         try:
-            from app.db.mongodb import get_metadata_collection
-            
-            # Используем ту же коллекцию, но с другим типом документа
-            db = get_metadata_collection().database
-            cache_collection = db[_CATEGORY_CACHE_COLLECTION]
-            
-            doc = await cache_collection.find_one({
+            doc = await analyte_category_cache_collection.find_one({
                 "test_name_lower": test_name.lower().strip()
             })
             
@@ -118,7 +111,7 @@ class AnalyteCategoryService:
             
             return None
         except Exception as e:
-            print(f"⚠️ Ошибка при чтении кэша категорий: {e}")
+            logger.warning("Ошибка при чтении кэша категорий: %s", e)
             return None
     
     @classmethod
@@ -130,12 +123,7 @@ class AnalyteCategoryService:
     ) -> None:
         """Кэширует категорию в MongoDB"""
         try:
-            from app.db.mongodb import get_metadata_collection
-            
-            db = get_metadata_collection().database
-            cache_collection = db[_CATEGORY_CACHE_COLLECTION]
-            
-            await cache_collection.update_one(
+            await analyte_category_cache_collection.update_one(
                 {"test_name_lower": test_name.lower().strip()},
                 {
                     "$set": {
@@ -152,7 +140,7 @@ class AnalyteCategoryService:
                 upsert=True
             )
         except Exception as e:
-            print(f"⚠️ Ошибка при кэшировании категории: {e}")
+            logger.warning("Ошибка при кэшировании категории: %s", e)
     
     @classmethod
     async def _determine_category_with_ai(
@@ -171,7 +159,7 @@ class AnalyteCategoryService:
             Название категории
         """
         try:
-            import httpx
+            from app.services.ai_service import ai_service
             
             prompt = f"""Определи категорию медицинского анализа.
 
@@ -183,44 +171,28 @@ class AnalyteCategoryService:
 
 Ответь ТОЛЬКО названием категории, без объяснений."""
 
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(
-                    "https://openrouter.ai/api/v1/chat/completions",
-                    headers={
-                        "Authorization": f"Bearer {settings.OPENROUTER_API_KEY}",
-                        "Content-Type": "application/json"
-                    },
-                    json={
-                        "model": settings.OPENROUTER_MODEL,
-                        "messages": [
-                            {"role": "user", "content": prompt}
-                        ],
-                        "max_tokens": 50,
-                        "temperature": 0
-                    }
-                )
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    category = data["choices"][0]["message"]["content"].strip()
-                    
-                    # Проверяем, что категория из списка
-                    if category in cls.KNOWN_CATEGORIES:
-                        return category
-                    
-                    # Пробуем найти похожую категорию
-                    category_lower = category.lower()
-                    for known_cat in cls.KNOWN_CATEGORIES:
-                        if known_cat.lower() in category_lower or category_lower in known_cat.lower():
-                            return known_cat
-                    
-                    return "Другое"
-                else:
-                    print(f"⚠️ AI API error: {response.status_code}")
-                    return "Другое"
+            # Через общий клиент OpenRouter - с ограничением частоты и повторами
+            data = await ai_service._call_openrouter(
+                [{"role": "user", "content": prompt}],
+                max_tokens=50,
+                temperature=0
+            )
+            category = data["choices"][0]["message"]["content"].strip()
+            
+            # Проверяем, что категория из списка
+            if category in cls.KNOWN_CATEGORIES:
+                return category
+            
+            # Пробуем найти похожую категорию
+            category_lower = category.lower()
+            for known_cat in cls.KNOWN_CATEGORIES:
+                if known_cat.lower() in category_lower or category_lower in known_cat.lower():
+                    return known_cat
+            
+            return "Другое"
                     
         except Exception as e:
-            print(f"⚠️ Ошибка при определении категории через AI: {e}")
+            logger.warning("Ошибка при определении категории через AI: %s", e)
             return "Другое"
     
     @classmethod
@@ -0,0 +1,202 @@
+"""
+Бизнес-метрики: чтение счётчиков и обновление gauges Prometheus.
+
+Счётчики в PostgreSQL поддерживаются триггерами (app/db/business_counters.py).
+Gauges из app.core.metrics обновляются:
+- после коммита сессии, в которой менялись пользователи, документы,
+  интерпретации или отчёты (событие SQLAlchemy after_commit);
+- периодически (BUSINESS_METRICS_REFRESH_SECONDS), чтобы окна "за 30 дней"
+  сдвигались и без записей, а изменения в обход ORM тоже попадали в метрики.
+
+Обновление выполняется фоновой задачей; одновременно в процессе идёт не
+больше одного обновления, повторные запросы за это время схлопываются.
+"""
+
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from sqlalchemy import event, select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.core import metrics
+from app.core.config import settings
+from app.core.tracing import metric_document_type
+from app.db.postgres import AsyncSessionLocal
+from app.models.business_counter import BusinessCounter, BusinessDailyCounter, UserActivity
+from app.models.document import Document
+from app.models.interpretation import Interpretation
+from app.models.report import Report
+from app.models.user import User
+
+logger = logging.getLogger(__name__)
+
+DOCUMENTS_BY_TYPE_PREFIX = "documents_by_type."
+
+# Сущности, изменение которых меняет бизнес-метрики
+_TRACKED_MODELS = (User, Document, Interpretation, Report)
+_SESSION_FLAG = "business_metrics_dirty"
+
+
+class BusinessMetricsService:
+
+    _refresh_task: Optional[asyncio.Task] = None
+    _refresh_pending = False
+    _document_types: set[str] = set()
+
+    @staticmethod
+    async def get_business_metrics(db: AsyncSession) -> Dict[str, Any]:
+        """Read business metrics from the trigger-maintained counters"""
+        # Дата 30 дней назад для расчета активности
+        thirty_days_ago = datetime.utcnow() - timedelta(days=30)
+
+        counters: Dict[str, int] = {}
+        new_30d: Dict[str, int] = {}
+        users_active_30d = 0
+        try:
+            result = await db.execute(select(BusinessCounter.name, BusinessCounter.value))
+            counters = {name: value for name, value in result.all()}
+
+            result = await db.execute(
+                select(BusinessDailyCounter.name, func.sum(BusinessDailyCounter.value))
+                .where(BusinessDailyCounter.day > thirty_days_ago.date())
+                .group_by(BusinessDailyCounter.name)
+            )
+            new_30d = {name: int(value or 0) for name, value in result.all()}
+
+            # Активные пользователи за 30 дней (загружали документы)
+            result = await db.execute(
+                select(func.count()).select_from(UserActivity)
+                .where(UserActivity.last_document_at >= thirty_days_ago)
+            )
+            users_active_30d = result.scalar() or 0
+        except Exception as e:
+            logger.error("Error fetching business counters: %s", e)
+
+        documents_by_type = {
+            name[len(DOCUMENTS_BY_TYPE_PREFIX):]: value
+            for name, value in counters.items()
+            if name.startswith(DOCUMENTS_BY_TYPE_PREFIX) and value
+        }
+        interpretations_total = counters.get("interpretations_total", 0)
+        interpretations_success = counters.get("interpretations_completed", 0)
+
+        # Формируем ответ
+        return {
+            "timestamp": datetime.utcnow().isoformat(),
+            "users": {
+                "total": counters.get("users_total", 0),
+                "active_30d": users_active_30d,
+                "new_30d": new_30d.get("users_new", 0)
+            },
+            "documents": {
+                "total": counters.get("documents_total", 0),
+                "new_30d": new_30d.get("documents_new", 0),
+                "by_type": documents_by_type
+            },
+            "interpretations": {
+                "total": interpretations_total,
+                "success": interpretations_success,
+                "failed": interpretations_total - interpretations_success,
+                "new_30d": new_30d.get("interpretations_new", 0)
+            },
+            "reports": {
+                "total": counters.get("reports_total", 0),
+                "new_30d": new_30d.get("reports_new", 0)
+            },
+            "storage": {
+                "bytes": counters.get("storage_bytes", 0),
+                "objects": counters.get("storage_objects", 0)
+            }
+        }
+
+    @staticmethod
+    def update_gauges(data: Dict[str, Any]) -> None:
+        users = data["users"]
+        metrics.users_total.set(users["total"])
+        metrics.users_active_30d.set(users["active_30d"])
+        metrics.users_new_30d.set(users["new_30d"])
+
+        documents = data["documents"]
+        metrics.documents_total.set(documents["total"])
+        metrics.documents_new_30d.set(documents["new_30d"])
+        # Типы в БД пришли от LLM: в метки - только известные, остальные суммируются в "other"
+        by_type: Dict[str, int] = {}
+        for document_type, count in documents["by_type"].items():
+            label = metric_document_type(document_type)
+            by_type[label] = by_type.get(label, 0) + count
+        # Тип, документов которого больше нет, должен показывать 0, а не старое значение
+        for document_type in BusinessMetricsService._document_types - set(by_type):
+            metrics.documents_by_type.labels(document_type=document_type).set(0)
+        for document_type, count in by_type.items():
+            metrics.documents_by_type.labels(document_type=document_type).set(count)
+        BusinessMetricsService._document_types |= set(by_type)
+
+        interpretations = data["interpretations"]
+        metrics.interpretations_total.set(interpretations["total"])
+        metrics.interpretations_success.set(interpretations["success"])
+        metrics.interpretations_failed.set(interpretations["failed"])
+        metrics.interpretations_new_30d.set(interpretations["new_30d"])
+
+        metrics.reports_total.set(data["reports"]["total"])
+        metrics.reports_new_30d.set(data["reports"]["new_30d"])
+        metrics.storage_bytes.set(data["storage"]["bytes"])
+        metrics.storage_objects.set(data["storage"]["objects"])
+
+    @staticmethod
+    async def refresh_gauges() -> None:
+        async with AsyncSessionLocal() as db:
+            data = await BusinessMetricsService.get_business_metrics(db)
+        BusinessMetricsService.update_gauges(data)
+
+    @staticmethod
+    async def _refresh_until_idle() -> None:
+        while True:
+            BusinessMetricsService._refresh_pending = False
+            try:
+                await BusinessMetricsService.refresh_gauges()
+            except Exception as e:
+                logger.warning("Не удалось обновить бизнес-метрики: %s", e)
+            if not BusinessMetricsService._refresh_pending:
+                return
+
+    @staticmethod
+    def schedule_refresh() -> None:
+        """Refresh gauges in the background; coalesces with a refresh in flight"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        task = BusinessMetricsService._refresh_task
+        if task is not None and not task.done():
+            BusinessMetricsService._refresh_pending = True
+            return
+        BusinessMetricsService._refresh_task = loop.create_task(BusinessMetricsService._refresh_until_idle())
+
+    @staticmethod
+    async def run_periodic_refresh() -> None:
+        """Background loop started from the application lifespan"""
+        while True:
+            BusinessMetricsService.schedule_refresh()
+            await asyncio.sleep(settings.BUSINESS_METRICS_REFRESH_SECONDS)
+
+
+@event.listens_for(Session, "after_flush")
+def _mark_business_metrics_dirty(session: Session, flush_context) -> None:
+    for instance in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(instance, _TRACKED_MODELS):
+            session.info[_SESSION_FLAG] = True
+            return
+
+
+@event.listens_for(Session, "after_commit")
+def _refresh_after_commit(session: Session) -> None:
+    if session.info.pop(_SESSION_FLAG, False):
+        BusinessMetricsService.schedule_refresh()
+
+
+@event.listens_for(Session, "after_rollback")
+def _clear_after_rollback(session: Session) -> None:
+    session.info.pop(_SESSION_FLAG, None)
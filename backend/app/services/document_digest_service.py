@@ -0,0 +1,156 @@
+"""
+Компактные сводки документов для промптов интерпретаций и отчётов.
+
+Сводка (digest) - нормализованный список показателей документа
+(каноническое название, значение в стандартной единице, флаг) и краткое
+содержание. Она строится один раз по extracted_data и хранится в MongoDB
+в поле interpretation_digest документа. LabAnalysisService и
+DocumentService сбрасывают это поле при повторной экстракции, и сводка
+строится заново при следующем обращении.
+"""
+
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from pymongo import UpdateOne
+
+from app.db.mongodb import document_metadata_collection
+from app.services.analyte_normalization_service_db import analyte_normalization_service_db
+
+logger = logging.getLogger(__name__)
+
+# Меняется при изменении формата сводки - старые сводки пересобираются
+DIGEST_VERSION = 2
+SUMMARY_MAX_CHARS = 500
+
+FLAG_TEXT = {
+    "L": "↓",
+    "H": "↑",
+    "A": "‼",
+}
+
+
+class DocumentDigestService:
+    """Построение и кэширование сводок документов"""
+
+    @staticmethod
+    def build_digest(mongo_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Build a digest from a document_metadata record"""
+        extracted_data = mongo_data.get("extracted_data") or {}
+        classification = mongo_data.get("classification") or {}
+        normalized = analyte_normalization_service_db.is_loaded
+
+        analytes = []
+        for lab in extracted_data.get("lab_results") or []:
+            name = lab.get("test_name")
+            if not name:
+                continue
+            value, unit = lab.get("value"), lab.get("unit")
+            canonical_name = None
+            if normalized:
+                canonical_name, converted_value, standard_unit, _ = (
+                    analyte_normalization_service_db.normalize_and_convert(name, value, unit)
+                )
+                if canonical_name and converted_value is not None:
+                    value, unit = converted_value, standard_unit
+            analytes.append({
+                "name": canonical_name or name,
+                "value": value,
+                "unit": unit or None,
+                "flag": lab.get("flag") or None,
+                "ref": lab.get("reference_range") or None,
+            })
+
+        summary = extracted_data.get("summary")
+        if summary and len(summary) > SUMMARY_MAX_CHARS:
+            summary = summary[:SUMMARY_MAX_CHARS].rstrip() + "…"
+
+        return {
+            "version": DIGEST_VERSION,
+            "normalized": normalized,
+            "document_subtype": classification.get("document_subtype"),
+            "analytes": analytes,
+            "summary": summary,
+            "created_at": datetime.utcnow(),
+        }
+
+    @staticmethod
+    def _is_current(digest: Optional[Dict[str, Any]]) -> bool:
+        if not digest or digest.get("version") != DIGEST_VERSION:
+            return False
+        # Сводка без справочника пересобирается, когда справочник загружен
+        return digest.get("normalized") or not analyte_normalization_service_db.is_loaded
+
+    @staticmethod
+    async def get_digests(document_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Return digests by document_id, building and storing missing ones"""
+        if not document_ids:
+            return {}
+
+        digests: Dict[str, Dict[str, Any]] = {}
+        cursor = document_metadata_collection.find(
+            {"document_id": {"$in": document_ids}},
+            {"_id": 0, "document_id": 1, "interpretation_digest": 1},
+        )
+        async for mongo_data in cursor:
+            digest = mongo_data.get("interpretation_digest")
+            if DocumentDigestService._is_current(digest):
+                digests[mongo_data["document_id"]] = digest
+
+        missing = [document_id for document_id in document_ids if document_id not in digests]
+        if not missing:
+            return digests
+
+        updates = []
+        cursor = document_metadata_collection.find(
+            {"document_id": {"$in": missing}},
+            {
+                "_id": 0,
+                "document_id": 1,
+                "classification.document_subtype": 1,
+                "extracted_data.summary": 1,
+                "extracted_data.lab_results": 1,
+            },
+        )
+        async for mongo_data in cursor:
+            digest = DocumentDigestService.build_digest(mongo_data)
+            digests[mongo_data["document_id"]] = digest
+            updates.append(UpdateOne(
+                {"document_id": mongo_data["document_id"]},
+                {"$set": {"interpretation_digest": digest}},
+            ))
+
+        if updates:
+            try:
+                await document_metadata_collection.bulk_write(updates, ordered=False)
+            except Exception as e:
+                logger.warning("Не удалось сохранить сводки документов: %s", e)
+        logger.debug("Сводки документов: %d из кэша, %d построено", len(digests) - len(updates), len(updates))
+        return digests
+
+    @staticmethod
+    def format_analyte(analyte: Dict[str, Any]) -> str:
+        value = analyte.get("value")
+        if isinstance(value, float):
+            value = f"{value:g}"
+        line = f"{analyte['name']}: {value}"
+        if analyte.get("unit"):
+            line += f" {analyte['unit']}"
+        flag = FLAG_TEXT.get(analyte.get("flag") or "")
+        if flag:
+            line += f" {flag}"
+            if analyte.get("ref"):
+                line += f" (реф. {analyte['ref']})"
+        return line
+
+    @staticmethod
+    def format_digest(digest: Dict[str, Any]) -> str:
+        """Compact text form: one analyte per line, reference range only for deviations"""
+        lines = [DocumentDigestService.format_analyte(analyte) for analyte in digest.get("analytes", [])]
+        if digest.get("summary"):
+            lines.append(f"Кратко: {digest['summary']}")
+        return "\n".join(lines)
+
+
+document_digest_service = DocumentDigestService()
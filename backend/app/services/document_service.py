@@ -1,18 +1,41 @@
+import logging
 import uuid
+import asyncio
 import hashlib
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from io import BytesIO
-from typing import Optional
+from typing import Optional, Union
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_, or_
+from sqlalchemy import select, update, func, and_, or_
 from fastapi import UploadFile
 from dateutil import parser as date_parser
+from pymongo import ReturnDocument
 
 from app.models.document import Document
+from app.db.postgres import AsyncSessionLocal
 from app.db.minio_client import minio_client
 from app.db.mongodb import document_metadata_collection
 from app.services.ai_service import ai_service
+from app.services.pdf_text_service import pdf_text_service
 from app.core.config import settings
+from app.core.tracing import stage, trace_document, set_document_type
+
+logger = logging.getLogger(__name__)
+
+# Ограничение на количество одновременных AI-обработок фоновых загрузок
+_ai_processing_semaphore = asyncio.Semaphore(settings.BATCH_UPLOAD_AI_CONCURRENCY)
+# Ссылки на фоновые задачи, чтобы их не собрал GC до завершения
+_background_tasks: set[asyncio.Task] = set()
+
+# Очередь фоновой обработки живёт только в памяти процесса: после рестарта
+# документы остаются в этих статусах, пока не будут помечены failed
+ACTIVE_PROCESSING_STATUSES = ("pending", "processing")
+
+
+def _stale_processing_before() -> datetime:
+    """Pending/processing documents not updated since then are considered orphaned"""
+    return datetime.now(timezone.utc) - timedelta(seconds=settings.DOCUMENT_PROCESSING_STALE_SECONDS)
+
 
 class DocumentService:
     
@@ -37,6 +60,48 @@ class DocumentService:
         result = await db.execute(query)
         return result.scalar_one_or_none()
     
+    @staticmethod
+    async def _check_duplicates(
+        file_hashes: list[str],
+        user_id: uuid.UUID,
+        db: AsyncSession
+    ) -> dict[str, Document]:
+        """Find already uploaded files for a set of hashes in a single query"""
+        if not file_hashes:
+            return {}
+        
+        query = select(Document).where(
+            and_(
+                Document.user_id == user_id,
+                Document.file_hash.in_(set(file_hashes))
+            )
+        )
+        result = await db.execute(query)
+        return {doc.file_hash: doc for doc in result.scalars().all()}
+    
+    @staticmethod
+    def _validate_file(filename: str, file_size: int) -> str:
+        """Validate size and extension, return normalized extension"""
+        if file_size > settings.MAX_FILE_SIZE:
+            raise ValueError(f"File size exceeds maximum allowed size of {settings.MAX_FILE_SIZE} bytes")
+        
+        file_ext = filename.split('.')[-1].lower()
+        if f".{file_ext}" not in settings.ALLOWED_EXTENSIONS:
+            raise ValueError(f"File type .{file_ext} is not allowed")
+        
+        return file_ext
+    
+    @staticmethod
+    def _put_to_minio(object_name: str, file_content: bytes, content_type: Optional[str]) -> None:
+        """Store file content in MinIO"""
+        minio_client.put_object(
+            bucket_name=settings.MINIO_BUCKET,
+            object_name=object_name,
+            data=BytesIO(file_content),
+            length=len(file_content),
+            content_type=content_type
+        )
+    
     @staticmethod
     async def upload_document(
         file: UploadFile,
@@ -50,65 +115,283 @@ class DocumentService:
         file_size = len(file_content)
         
         # Validate file
-        if file_size > settings.MAX_FILE_SIZE:
-            raise ValueError(f"File size exceeds maximum allowed size of {settings.MAX_FILE_SIZE} bytes")
+        file_ext = DocumentService._validate_file(file.filename, file_size)
         
-        # Get file extension
-        file_ext = file.filename.split('.')[-1].lower()
-        if f".{file_ext}" not in settings.ALLOWED_EXTENSIONS:
-            raise ValueError(f"File type .{file_ext} is not allowed")
+        with trace_document(file_type=file_ext):
+            # Calculate file hash
+            with stage("hash"):
+                file_hash = DocumentService._calculate_file_hash(file_content)
+            
+            # Check for duplicates
+            with stage("dedupe"):
+                duplicate = await DocumentService._check_duplicate(file_hash, user_id, db)
+            if duplicate:
+                raise ValueError(
+                    f"Файл '{file.filename}' уже был загружен ранее "
+                    f"({duplicate.original_filename}, {duplicate.created_at.strftime('%d.%m.%Y %H:%M')})"
+                )
+            
+            # Generate unique file ID
+            file_id = str(uuid.uuid4())
+            object_name = f"{user_id}/{file_id}.{file_ext}"
+            
+            # Upload to MinIO
+            with stage("put_object"):
+                DocumentService._put_to_minio(object_name, file_content, file.content_type)
+            
+            file_url = f"s3://{settings.MINIO_BUCKET}/{object_name}"
+            
+            # Create database record
+            document = Document(
+                user_id=user_id,
+                original_filename=file.filename,
+                file_size=file_size,
+                file_type=file_ext,
+                file_url=file_url,
+                file_hash=file_hash,
+                processing_status="pending"
+            )
+            
+            db.add(document)
+            with stage("postgres_commit"):
+                await db.commit()
+                await db.refresh(document)
+            
+            # Trigger async AI processing (don't wait for it)
+            # In production, this would be done via a task queue (Celery, RQ)
+            # For MVP, we'll process it synchronously but mark as processing
+            try:
+                await DocumentService._process_document_ai(document, file_content, file_ext, db)
+            except Exception:
+                logger.exception("AI processing failed for document %s", document.id)
+                document.processing_status = "failed"
+                await db.commit()
         
-        # Calculate file hash
-        file_hash = DocumentService._calculate_file_hash(file_content)
+        return document
+    
+    @staticmethod
+    async def upload_documents_batch(
+        files: list[UploadFile],
+        user_id: uuid.UUID,
+        db: AsyncSession
+    ) -> list[dict]:
+        """Upload several documents at once
         
-        # Check for duplicates
-        duplicate = await DocumentService._check_duplicate(file_hash, user_id, db)
-        if duplicate:
-            raise ValueError(
-                f"Файл '{file.filename}' уже был загружен ранее "
-                f"({duplicate.original_filename}, {duplicate.created_at.strftime('%d.%m.%Y %H:%M')})"
+        Files are validated and hashed, duplicates are resolved with a single
+        query, new files are stored in MinIO concurrently and recorded in one
+        commit. AI processing is scheduled in the background with bounded
+        concurrency, so the call returns per-file statuses right away.
+        """
+        if len(files) > settings.MAX_BATCH_UPLOAD_FILES:
+            raise ValueError(f"Можно загрузить не более {settings.MAX_BATCH_UPLOAD_FILES} файлов за раз")
+        
+        items = []
+        for file in files:
+            item = {
+                "filename": file.filename,
+                "document_id": None,
+                "status": "pending",
+                "message": None,
+            }
+            try:
+                file_content = await file.read()
+                item["file_ext"] = DocumentService._validate_file(file.filename, len(file_content))
+                item["content"] = file_content
+                item["content_type"] = file.content_type
+                with trace_document(file_type=item["file_ext"]), stage("hash"):
+                    item["file_hash"] = DocumentService._calculate_file_hash(file_content)
+            except ValueError as e:
+                item["status"] = "error"
+                item["message"] = str(e)
+            items.append(item)
+        
+        # Dedupe against stored documents and within the batch itself
+        accepted = [item for item in items if item["status"] == "pending"]
+        with trace_document(file_type="batch"), stage("dedupe"):
+            existing = await DocumentService._check_duplicates(
+                [item["file_hash"] for item in accepted], user_id, db
+            )
+        seen_hashes: dict[str, str] = {}
+        for item in accepted:
+            duplicate = existing.get(item["file_hash"])
+            if duplicate:
+                item["status"] = "duplicate"
+                item["document_id"] = duplicate.id
+                item["message"] = (
+                    f"Файл уже был загружен ранее "
+                    f"({duplicate.original_filename}, {duplicate.created_at.strftime('%d.%m.%Y %H:%M')})"
+                )
+            elif item["file_hash"] in seen_hashes:
+                item["status"] = "duplicate"
+                item["message"] = f"Файл совпадает с '{seen_hashes[item['file_hash']]}' в этой загрузке"
+            else:
+                seen_hashes[item["file_hash"]] = item["filename"]
+        accepted = [item for item in accepted if item["status"] == "pending"]
+        
+        # Store new files in MinIO concurrently
+        for item in accepted:
+            item["object_name"] = f"{user_id}/{uuid.uuid4()}.{item['file_ext']}"
+        with trace_document(file_type="batch"), stage("put_object"):
+            results = await asyncio.gather(
+                *[
+                    asyncio.to_thread(
+                        DocumentService._put_to_minio,
+                        item["object_name"],
+                        item["content"],
+                        item["content_type"],
+                    )
+                    for item in accepted
+                ],
+                return_exceptions=True,
+            )
+        for item, result in zip(accepted, results):
+            if isinstance(result, Exception):
+                item["status"] = "error"
+                item["message"] = f"Ошибка сохранения файла: {result}"
+        accepted = [item for item in accepted if item["status"] == "pending"]
+        
+        # Create all database records in one commit
+        documents = []
+        for item in accepted:
+            document = Document(
+                user_id=user_id,
+                original_filename=item["filename"],
+                file_size=len(item["content"]),
+                file_type=item["file_ext"],
+                file_url=f"s3://{settings.MINIO_BUCKET}/{item['object_name']}",
+                file_hash=item["file_hash"],
+                processing_status="pending"
             )
+            db.add(document)
+            documents.append(document)
+        if documents:
+            with trace_document(file_type="batch"), stage("postgres_commit"):
+                await db.commit()
+        
+        for item, document in zip(accepted, documents):
+            item["document_id"] = document.id
+            item["message"] = "Документ загружен и поставлен в очередь на обработку"
+            DocumentService._schedule_ai_processing(document.id, item["content"], item["file_ext"])
+        
+        return [
+            {
+                "filename": item["filename"],
+                "document_id": item["document_id"],
+                "status": item["status"],
+                "message": item["message"],
+            }
+            for item in items
+        ]
+    
+    @staticmethod
+    def _schedule_ai_processing(document_id: uuid.UUID, file_content: bytes, file_ext: str) -> None:
+        """Run AI processing for a stored document in the background"""
+        task = asyncio.create_task(
+            DocumentService._process_document_ai_background(document_id, file_content, file_ext)
+        )
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+    
+    @staticmethod
+    async def _process_document_ai_background(
+        document_id: uuid.UUID,
+        file_content: bytes,
+        file_ext: str
+    ):
+        """Process document with AI using its own DB session"""
+        async with _ai_processing_semaphore:
+            async with AsyncSessionLocal() as db:
+                # Атомарно забрать документ из очереди
+                result = await db.execute(
+                    update(Document)
+                    .where(Document.id == document_id, Document.processing_status == "pending")
+                    .values(processing_status="processing")
+                    .execution_options(synchronize_session=False)
+                )
+                await db.commit()
+                if result.rowcount == 0:
+                    return
+                document = await db.get(Document, document_id)
+                if not document:
+                    return
+                try:
+                    with trace_document(file_type=file_ext):
+                        await DocumentService._process_document_ai(document, file_content, file_ext, db)
+                except asyncio.CancelledError:
+                    # Остановка воркера: документ не должен остаться в processing
+                    await asyncio.shield(DocumentService._mark_interrupted(document_id))
+                    raise
+                except Exception:
+                    logger.exception("AI processing failed for document %s", document_id)
+                    await db.rollback()
+                    document.processing_status = "failed"
+                    await db.commit()
+    
+    @staticmethod
+    async def _mark_interrupted(document_id: uuid.UUID) -> None:
+        """Mark a cancelled document as failed so that it can be retried"""
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(Document)
+                .where(Document.id == document_id, Document.processing_status == "processing")
+                .values(processing_status="failed")
+            )
+            await db.commit()
+    
+    @staticmethod
+    async def fail_stale_processing() -> int:
+        """Mark orphaned pending/processing documents as failed (called at startup)"""
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                update(Document)
+                .where(
+                    Document.processing_status.in_(ACTIVE_PROCESSING_STATUSES),
+                    Document.updated_at < _stale_processing_before()
+                )
+                .values(processing_status="failed")
+            )
+            await db.commit()
+        if result.rowcount:
+            logger.info("Зависшие документы помечены failed: %d", result.rowcount)
+        return result.rowcount
+    
+    @staticmethod
+    async def retry_processing(
+        document_id: uuid.UUID,
+        user_id: uuid.UUID,
+        db: AsyncSession
+    ) -> Optional[Document]:
+        """Queue AI processing again for a failed or orphaned document"""
         
-        # Generate unique file ID
-        file_id = str(uuid.uuid4())
-        object_name = f"{user_id}/{file_id}.{file_ext}"
+        document = await DocumentService.get_document_by_id(document_id, user_id, db)
+        if not document:
+            return None
         
-        # Upload to MinIO
-        minio_client.put_object(
-            bucket_name=settings.MINIO_BUCKET,
-            object_name=object_name,
-            data=BytesIO(file_content),
-            length=file_size,
-            content_type=file.content_type
-        )
+        file_content = await asyncio.to_thread(DocumentService.get_file_from_minio, document.file_url)
         
-        file_url = f"s3://{settings.MINIO_BUCKET}/{object_name}"
-        
-        # Create database record
-        document = Document(
-            user_id=user_id,
-            original_filename=file.filename,
-            file_size=file_size,
-            file_type=file_ext,
-            file_url=file_url,
-            file_hash=file_hash,
-            processing_status="pending"
+        # Условный UPDATE: из двух параллельных повторов пройдёт один
+        result = await db.execute(
+            update(Document)
+            .where(
+                Document.id == document_id,
+                or_(
+                    Document.processing_status == "failed",
+                    and_(
+                        Document.processing_status.in_(ACTIVE_PROCESSING_STATUSES),
+                        Document.updated_at < _stale_processing_before()
+                    )
+                )
+            )
+            .values(processing_status="pending")
+            .execution_options(synchronize_session=False)
         )
-        
-        db.add(document)
+        if result.rowcount == 0:
+            await db.rollback()
+            raise ValueError("Повторить можно только неудавшуюся или зависшую обработку документа")
         await db.commit()
         await db.refresh(document)
         
-        # Trigger async AI processing (don't wait for it)
-        # In production, this would be done via a task queue (Celery, RQ)
-        # For MVP, we'll process it synchronously but mark as processing
-        try:
-            await DocumentService._process_document_ai(document, file_content, file_ext, db)
-        except Exception as e:
-            print(f"❌ AI processing failed for document {document.id}: {str(e)}")
-            document.processing_status = "failed"
-            await db.commit()
-        
+        DocumentService._schedule_ai_processing(document.id, file_content, document.file_type)
         return document
     
     @staticmethod
@@ -122,14 +405,18 @@ class DocumentService:
         
         # Update status to processing
         document.processing_status = "processing"
-        await db.commit()
+        with stage("postgres_commit"):
+            await db.commit()
         
         # Analyze document with AI
-        metadata = await ai_service.analyze_document(
-            file_content,
-            file_ext,
-            document.original_filename
-        )
+        with stage("classification"):
+            metadata = await ai_service.analyze_document(
+                file_content,
+                file_ext,
+                document.original_filename,
+                file_hash=document.file_hash
+            )
+        set_document_type(metadata.document_type)
         
         # Update PostgreSQL record (minimal fields only)
         document.document_type = metadata.document_type
@@ -156,37 +443,66 @@ class DocumentService:
                 "model": settings.OPENROUTER_MODEL,
                 "confidence": metadata.confidence,
             },
-            "created_at": datetime.utcnow(),
             "updated_at": datetime.utcnow()
         }
         
-        result = await document_metadata_collection.insert_one(mongo_doc)
-        document.mongodb_metadata_id = str(result.inserted_id)
+        # document_id уникален (app.db.mongo_indexes) - повторная обработка обновляет запись
+        with stage("mongo_write"):
+            result = await document_metadata_collection.find_one_and_update(
+                {"document_id": mongo_doc["document_id"]},
+                {
+                    "$set": mongo_doc,
+                    "$setOnInsert": {"created_at": datetime.utcnow()},
+                    "$unset": {"interpretation_digest": ""},
+                },
+                projection={"_id": 1},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        document.mongodb_metadata_id = str(result["_id"])
         
-        await db.commit()
-        await db.refresh(document)
+        with stage("postgres_commit"):
+            await db.commit()
+            await db.refresh(document)
         
         # If document is classified as "Результаты анализа", automatically extract lab results
         if document.document_type == "Результаты анализа":
             try:
-                print(f"🧪 Document classified as lab results, starting automatic lab extraction for {document.id}")
+                logger.info("Document %s classified as lab results, starting lab extraction", document.id)
                 from app.services.lab_analysis_service import LabAnalysisService
                 
-                lab_result = await LabAnalysisService.analyze_labs_for_document(
-                    document=document,
-                    file_bytes=file_content,
-                    file_ext=file_ext,
-                    db=db,
+                with stage("lab_extraction"):
+                    lab_result = await LabAnalysisService.analyze_labs_for_document(
+                        document=document,
+                        file_bytes=file_content,
+                        file_ext=file_ext,
+                        db=db,
+                    )
+                logger.info(
+                    "Lab extraction completed for %s: %d results",
+                    document.id, lab_result.get("lab_results_count", 0)
                 )
-                print(f"✅ Automatic lab extraction completed for {document.id}: {lab_result.get('lab_results_count', 0)} results found")
             except Exception as e:
-                print(f"⚠️ Warning: Automatic lab extraction failed for {document.id}: {str(e)}")
+                logger.warning("Automatic lab extraction failed for %s: %s", document.id, e)
                 # Don't fail the entire document processing if lab extraction fails
                 # The document is still successfully classified
     
+    @staticmethod
+    def _user_clause(user_id: Union[uuid.UUID, list[uuid.UUID]]):
+        """Document owner condition for one profile or several profiles"""
+        if isinstance(user_id, list):
+            return Document.user_id.in_(user_id)
+        return Document.user_id == user_id
+    
+    @staticmethod
+    def _mongo_user_match(user_id: Union[uuid.UUID, list[uuid.UUID]]):
+        if isinstance(user_id, list):
+            return {"$in": [str(item) for item in user_id]}
+        return str(user_id)
+    
     @staticmethod
     async def get_documents(
-        user_id: uuid.UUID,
+        user_id: Union[uuid.UUID, list[uuid.UUID]],
         db: AsyncSession,
         skip: int = 0,
         limit: int = 100,
@@ -208,6 +524,7 @@ class DocumentService:
         Supports filtering by both PostgreSQL and MongoDB fields.
         MongoDB filters (specialties, document_subtype, research_area) are applied first
         to get matching document IDs, then PostgreSQL filters are applied.
+        A list of user IDs returns documents of all these profiles in one query.
         """
         
         # First, apply MongoDB filters if any
@@ -228,7 +545,7 @@ class DocumentService:
             mongodb_document_ids = [uuid.UUID(doc_id) for doc_id in mongodb_document_ids]
         
         # Build PostgreSQL query
-        query = select(Document).where(Document.user_id == user_id)
+        query = select(Document).where(DocumentService._user_clause(user_id))
         
         # If we have MongoDB filters, restrict to those document IDs
         if mongodb_document_ids is not None:
@@ -279,7 +596,7 @@ class DocumentService:
     
     @staticmethod
     async def get_documents_count(
-        user_id: uuid.UUID,
+        user_id: Union[uuid.UUID, list[uuid.UUID]],
         db: AsyncSession,
         document_type: Optional[list[str]] = None,
         patient_name: Optional[list[str]] = None,
@@ -317,7 +634,7 @@ class DocumentService:
             mongodb_document_ids = [uuid.UUID(doc_id) for doc_id in mongodb_document_ids]
         
         # Build PostgreSQL query for count
-        query = select(func.count(Document.id)).where(Document.user_id == user_id)
+        query = select(func.count(Document.id)).where(DocumentService._user_clause(user_id))
         
         # If we have MongoDB filters, restrict to those document IDs
         if mongodb_document_ids is not None:
@@ -480,7 +797,7 @@ class DocumentService:
     
     @staticmethod
     async def filter_documents_by_mongodb_fields(
-        user_id: uuid.UUID,
+        user_id: Union[uuid.UUID, list[uuid.UUID]],
         specialties: Optional[list[str]] = None,
         document_subtype: Optional[list[str]] = None,
         research_area: Optional[list[str]] = None,
@@ -489,7 +806,7 @@ class DocumentService:
         
         Returns list of document_ids that match the criteria.
         """
-        match_conditions = {"user_id": str(user_id)}
+        match_conditions = {"user_id": DocumentService._mongo_user_match(user_id)}
         
         if specialties:
             # Match any of the provided specialties
@@ -534,7 +851,7 @@ class DocumentService:
             object_name = document.file_url.replace(f"s3://{settings.MINIO_BUCKET}/", "")
             minio_client.remove_object(settings.MINIO_BUCKET, object_name)
         except Exception as e:
-            print(f"Warning: Failed to delete file from MinIO: {e}")
+            logger.warning("Failed to delete file from MinIO: %s", e)
         
         # Delete from MongoDB
         if document.mongodb_metadata_id:
@@ -543,12 +860,23 @@ class DocumentService:
                     "document_id": str(document_id)
                 })
             except Exception as e:
-                print(f"Warning: Failed to delete from MongoDB: {e}")
+                logger.warning("Failed to delete from MongoDB: %s", e)
         
         # Delete from PostgreSQL
         await db.delete(document)
         await db.commit()
         
+        # Текст страниц кэшируется по file_hash: удалить, если файл больше не используется
+        if document.file_hash:
+            try:
+                remaining = await db.scalar(
+                    select(func.count()).select_from(Document).where(Document.file_hash == document.file_hash)
+                )
+                if not remaining:
+                    await pdf_text_service.forget(document.file_hash)
+            except Exception as e:
+                logger.warning("Failed to delete cached document text: %s", e)
+        
         return True
     
     @staticmethod
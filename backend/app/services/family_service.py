@@ -1,9 +1,11 @@
+import time
 import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
 from datetime import date
 from typing import List, Optional, Tuple
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, and_, or_, delete
-from sqlalchemy.orm import selectinload
 
 from app.models.user import User
 from app.models.family import FamilyRelation, RelationType, INVERSE_RELATIONS
@@ -17,6 +19,67 @@ from app.schemas.family import (
     RelationType as SchemaRelationType,
 )
 from app.core.security import get_password_hash, verify_password
+from app.core.config import settings
+
+
+@dataclass(frozen=True)
+class FamilyAccessGraph:
+    """Семейные связи пользователя: кем он управляет и кто управляет им"""
+    user_id: uuid.UUID
+    members: List[FamilyMemberWithAccess] = field(default_factory=list)
+    owners: List[FamilyOwnerInfo] = field(default_factory=list)
+
+    @property
+    def related_ids(self) -> List[uuid.UUID]:
+        return [member.id for member in self.members] + [owner.id for owner in self.owners]
+
+
+class _AccessGraphCache:
+    """Bounded LRU cache user_id -> FamilyAccessGraph with a TTL.
+
+    Кэш свой у каждого процесса uvicorn: изменения связей сбрасывают его
+    только в текущем процессе, остальные видят их не позже чем через TTL.
+    Поэтому он используется только для списков семьи; проверка доступа
+    к профилю (check_profile_access) всегда идёт в БД.
+    Счётчик сбросов не даёт сохранить граф, загруженный до сброса.
+    """
+
+    def __init__(self, maxsize: int, ttl_seconds: float):
+        self._maxsize = maxsize
+        self._ttl = ttl_seconds
+        self._items: "OrderedDict[uuid.UUID, tuple[FamilyAccessGraph, float]]" = OrderedDict()
+        self._generation = 0
+
+    def get(self, user_id: uuid.UUID) -> Optional[FamilyAccessGraph]:
+        item = self._items.get(user_id)
+        if item is None:
+            return None
+        graph, expires_at = item
+        if expires_at <= time.monotonic():
+            del self._items[user_id]
+            return None
+        self._items.move_to_end(user_id)
+        return graph
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def put(self, graph: FamilyAccessGraph, generation: int) -> None:
+        if self._maxsize <= 0 or self._ttl <= 0 or generation != self._generation:
+            return
+        self._items[graph.user_id] = (graph, time.monotonic() + self._ttl)
+        self._items.move_to_end(graph.user_id)
+        while len(self._items) > self._maxsize:
+            self._items.popitem(last=False)
+
+    def invalidate(self, *user_ids: uuid.UUID) -> None:
+        self._generation += 1
+        for user_id in user_ids:
+            self._items.pop(user_id, None)
+
+
+_access_graphs = _AccessGraphCache(settings.FAMILY_ACCESS_CACHE_SIZE, settings.FAMILY_ACCESS_CACHE_SECONDS)
 
 
 class FamilyService:
@@ -29,6 +92,83 @@ class FamilyService:
             return custom_relation
         return RELATION_TYPE_NAMES.get(SchemaRelationType(relation_type.value), relation_type.value)
     
+    @staticmethod
+    async def _load_access_graph(user_id: uuid.UUID, db: AsyncSession) -> FamilyAccessGraph:
+        """Load all relations of the user with the related users in one query"""
+        query = (
+            select(FamilyRelation, User)
+            .join(User, or_(
+                and_(FamilyRelation.owner_id == user_id, User.id == FamilyRelation.member_id),
+                and_(FamilyRelation.member_id == user_id, User.id == FamilyRelation.owner_id)
+            ))
+            .where(or_(FamilyRelation.owner_id == user_id, FamilyRelation.member_id == user_id))
+            .order_by(FamilyRelation.created_at)
+        )
+        result = await db.execute(query)
+        
+        members = []
+        owners = []
+        for relation, related in result.all():
+            if relation.owner_id == user_id:
+                members.append(FamilyMemberWithAccess(
+                    id=related.id,
+                    full_name=related.full_name,
+                    birth_date=related.birth_date,
+                    email=related.email,
+                    has_credentials=related.has_credentials,
+                    relation_type=SchemaRelationType(relation.relation_type.value),
+                    relation_type_display=FamilyService._get_relation_display(
+                        relation.relation_type, 
+                        relation.custom_relation
+                    ),
+                    custom_relation=relation.custom_relation,
+                    is_active=related.is_active,
+                    created_at=related.created_at,
+                    is_owner=True
+                ))
+            else:
+                # Получаем обратный тип связи
+                inverse_type = INVERSE_RELATIONS.get(relation.relation_type, relation.relation_type)
+                owners.append(FamilyOwnerInfo(
+                    id=related.id,
+                    full_name=related.full_name,
+                    email=related.email,
+                    relation_type=SchemaRelationType(inverse_type.value),
+                    relation_type_display=FamilyService._get_relation_display(
+                        inverse_type, 
+                        relation.custom_relation
+                    ),
+                ))
+        
+        return FamilyAccessGraph(
+            user_id=user_id,
+            members=members,
+            owners=owners
+        )
+    
+    @staticmethod
+    async def get_access_graph(
+        user_id: uuid.UUID,
+        db: AsyncSession
+    ) -> FamilyAccessGraph:
+        """
+        Получить граф семейных связей пользователя (из кэша процесса или из БД).
+        Только для отображения: для проверки доступа он может быть устаревшим.
+        """
+        graph = _access_graphs.get(user_id)
+        if graph is not None:
+            return graph
+        
+        generation = _access_graphs.generation
+        graph = await FamilyService._load_access_graph(user_id, db)
+        _access_graphs.put(graph, generation)
+        return graph
+    
+    @staticmethod
+    def invalidate_access_graph(*user_ids: uuid.UUID) -> None:
+        """Drop cached graphs after relations or related profiles change"""
+        _access_graphs.invalidate(*user_ids)
+    
     @staticmethod
     async def get_family_members(
         user_id: uuid.UUID,
@@ -37,37 +177,8 @@ class FamilyService:
         """
         Получить всех членов семьи, которыми управляет пользователь.
         """
-        # Получаем связи где user является owner
-        query = (
-            select(FamilyRelation)
-            .options(selectinload(FamilyRelation.member))
-            .where(FamilyRelation.owner_id == user_id)
-            .order_by(FamilyRelation.created_at)
-        )
-        result = await db.execute(query)
-        relations = result.scalars().all()
-        
-        members = []
-        for relation in relations:
-            member = relation.member
-            members.append(FamilyMemberWithAccess(
-                id=member.id,
-                full_name=member.full_name,
-                birth_date=member.birth_date,
-                email=member.email,
-                has_credentials=member.has_credentials,
-                relation_type=SchemaRelationType(relation.relation_type.value),
-                relation_type_display=FamilyService._get_relation_display(
-                    relation.relation_type, 
-                    relation.custom_relation
-                ),
-                custom_relation=relation.custom_relation,
-                is_active=member.is_active,
-                created_at=member.created_at,
-                is_owner=True
-            ))
-        
-        return members
+        graph = await FamilyService.get_access_graph(user_id, db)
+        return list(graph.members)
     
     @staticmethod
     async def get_family_owners(
@@ -77,49 +188,18 @@ class FamilyService:
         """
         Получить всех пользователей, которые управляют данным пользователем.
         """
-        query = (
-            select(FamilyRelation)
-            .options(selectinload(FamilyRelation.owner))
-            .where(FamilyRelation.member_id == user_id)
-        )
-        result = await db.execute(query)
-        relations = result.scalars().all()
-        
-        owners = []
-        for relation in relations:
-            owner = relation.owner
-            # Получаем обратный тип связи
-            inverse_type = INVERSE_RELATIONS.get(relation.relation_type, relation.relation_type)
-            owners.append(FamilyOwnerInfo(
-                id=owner.id,
-                full_name=owner.full_name,
-                email=owner.email,
-                relation_type=SchemaRelationType(inverse_type.value),
-                relation_type_display=FamilyService._get_relation_display(
-                    inverse_type, 
-                    relation.custom_relation
-                ),
-            ))
-        
-        return owners
+        graph = await FamilyService.get_access_graph(user_id, db)
+        return list(graph.owners)
     
     @staticmethod
     async def get_accessible_profiles(
-        user_id: uuid.UUID,
+        current_user: User,
         db: AsyncSession
     ) -> List[FamilyMemberWithAccess]:
         """
         Получить все профили, доступные пользователю (включая свой).
         Используется для переключателя профилей.
         """
-        # Получаем данные текущего пользователя
-        user_query = select(User).where(User.id == user_id)
-        user_result = await db.execute(user_query)
-        current_user = user_result.scalar_one_or_none()
-        
-        if not current_user:
-            return []
-        
         profiles = []
         
         # Добавляем текущего пользователя
@@ -138,8 +218,8 @@ class FamilyService:
         ))
         
         # Добавляем членов семьи
-        family_members = await FamilyService.get_family_members(user_id, db)
-        profiles.extend(family_members)
+        graph = await FamilyService.get_access_graph(current_user.id, db)
+        profiles.extend(graph.members)
         
         return profiles
     
@@ -181,6 +261,7 @@ class FamilyService:
         )
         db.add(relation)
         await db.commit()
+        FamilyService.invalidate_access_graph(owner_id, new_user.id)
         await db.refresh(new_user)
         await db.refresh(relation)
         
@@ -231,6 +312,7 @@ class FamilyService:
             relation.custom_relation = data.custom_relation
         
         await db.commit()
+        FamilyService.invalidate_access_graph(owner_id, member_id)
         await db.refresh(user)
         
         return user
@@ -282,6 +364,7 @@ class FamilyService:
         user.password_hash = get_password_hash(credentials.password)
         
         await db.commit()
+        FamilyService.invalidate_access_graph(owner_id, member_id)
         await db.refresh(user)
         
         return user
@@ -336,6 +419,7 @@ class FamilyService:
             await db.delete(user)
         
         await db.commit()
+        FamilyService.invalidate_access_graph(owner_id, member_id)
         return True
     
     @staticmethod
@@ -374,6 +458,7 @@ class FamilyService:
         
         await db.delete(relation)
         await db.commit()
+        FamilyService.invalidate_access_graph(owner_id, user_id)
         
         return True
     
@@ -420,6 +505,7 @@ class FamilyService:
         )
         db.add(relation)
         await db.commit()
+        FamilyService.invalidate_access_graph(owner_id, user.id)
         await db.refresh(relation)
         
         return relation
@@ -435,18 +521,36 @@ class FamilyService:
         Доступ есть если:
         - profile_id == user_id (свой профиль)
         - user_id является owner для profile_id
+        
+        Проверяется по БД без кэша: отзыв доступа в другом процессе
+        должен действовать сразу.
         """
-        if user_id == profile_id:
+        if profile_id == user_id:
             return True
-        
-        relation_query = select(FamilyRelation).where(
-            and_(
+        return not await FamilyService.get_inaccessible_profiles(user_id, [profile_id], db)
+    
+    @staticmethod
+    async def get_inaccessible_profiles(
+        user_id: uuid.UUID,
+        profile_ids: List[uuid.UUID],
+        db: AsyncSession
+    ) -> List[uuid.UUID]:
+        """
+        Проверить доступ сразу к нескольким профилям.
+        Возвращает профили, к которым доступа нет (пустой список - доступ есть ко всем).
+        Один запрос к БД, без кэша.
+        """
+        requested = [profile_id for profile_id in profile_ids if profile_id != user_id]
+        if not requested:
+            return []
+        result = await db.execute(
+            select(FamilyRelation.member_id).where(
                 FamilyRelation.owner_id == user_id,
-                FamilyRelation.member_id == profile_id
+                FamilyRelation.member_id.in_(requested)
             )
         )
-        relation_result = await db.execute(relation_query)
-        return relation_result.scalar_one_or_none() is not None
+        allowed = set(result.scalars().all())
+        return [profile_id for profile_id in requested if profile_id not in allowed]
 
 
 family_service = FamilyService()
@@ -0,0 +1,145 @@
+"""
+Подготовка изображений для vision-запросов к LLM.
+
+Фото документа поворачивается по EXIF, обрезается по листу, уменьшается
+до VISION_MAX_LONG_EDGE, переводится в оттенки серого и пережимается в
+JPEG в пуле процессов. Результат кэшируется по file_hash в памяти
+процесса, поэтому классификация и экстракция анализов одной загрузки
+используют одно и то же подготовленное изображение.
+
+Сканированные PDF без текстового слоя растеризуются постранично тем же
+конвейером и отправляются в vision-модель пачками страниц. Страницы
+кэшируются до экстракции анализов (`forget_pages`), а общий объём кэша
+страниц ограничен VISION_PAGES_CACHE_MAX_BYTES.
+"""
+
+import logging
+import asyncio
+import base64
+import hashlib
+from collections import OrderedDict
+from typing import Optional
+
+from app.core.config import settings
+from app.core.process_pool import run_in_process
+from app.core.tracing import stage
+from app.workers import image as image_worker
+from app.workers import pdf as pdf_worker
+
+logger = logging.getLogger(__name__)
+
+
+class ImagePreprocessingService:
+
+    def __init__(self, memory_cache_size: int = 16):
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+        self._pages_cache: "OrderedDict[str, list[str]]" = OrderedDict()
+        self._pages_cache_bytes = 0
+        self._cache_size = memory_cache_size
+
+    @staticmethod
+    def _remember(cache: OrderedDict, key: str, value, size: int) -> None:
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > size:
+            cache.popitem(last=False)
+
+    def _remember_pages(self, file_hash: str, pages: list[str]) -> None:
+        size = sum(len(page) for page in pages)
+        if size > settings.VISION_PAGES_CACHE_MAX_BYTES:
+            return
+        self.forget_pages(file_hash)
+        self._pages_cache[file_hash] = pages
+        self._pages_cache_bytes += size
+        while self._pages_cache_bytes > settings.VISION_PAGES_CACHE_MAX_BYTES:
+            _, evicted = self._pages_cache.popitem(last=False)
+            self._pages_cache_bytes -= sum(len(page) for page in evicted)
+
+    def forget_pages(self, file_hash: str) -> None:
+        """Drop rendered pages of a file once its last vision call is done"""
+        pages = self._pages_cache.pop(file_hash, None)
+        if pages is not None:
+            self._pages_cache_bytes -= sum(len(page) for page in pages)
+
+    async def to_data_url(self, file_bytes: bytes, file_type: str, file_hash: Optional[str] = None) -> str:
+        """Return a base64 data URL of the (pre-processed) image for a vision prompt"""
+        file_hash = file_hash or hashlib.sha256(file_bytes).hexdigest()
+
+        data_url = self._cache.get(file_hash)
+        if data_url is not None:
+            self._cache.move_to_end(file_hash)
+            return data_url
+
+        with stage("image_preprocess"):
+            image_bytes = await self.prepare(file_bytes)
+        if image_bytes is not None:
+            mime_type = "image/jpeg"
+        else:
+            image_bytes = file_bytes
+            mime_type = "image/jpeg" if file_type in ["jpg", "jpeg"] else "image/png"
+
+        data_url = f"data:{mime_type};base64,{base64.b64encode(image_bytes).decode('utf-8')}"
+
+        self._remember(self._cache, file_hash, data_url, self._cache_size)
+        return data_url
+
+    async def pdf_pages_to_data_urls(self, file_bytes: bytes, file_hash: Optional[str] = None) -> list[str]:
+        """Rasterise a scanned PDF (up to SCANNED_PDF_MAX_PAGES) into JPEG data URLs"""
+        file_hash = file_hash or hashlib.sha256(file_bytes).hexdigest()
+
+        pages = self._pages_cache.get(file_hash)
+        if pages is not None:
+            self._pages_cache.move_to_end(file_hash)
+            return pages
+
+        with stage("pdf_rasterize") as span:
+            page_count = await run_in_process(pdf_worker.count_pages, file_bytes)
+            page_count = min(page_count, settings.SCANNED_PDF_MAX_PAGES)
+            span.set_attribute("pages", page_count)
+            chunk = settings.PDF_PAGES_PER_CHUNK
+            parts = await asyncio.gather(*[
+                run_in_process(
+                    pdf_worker.rasterize_pages,
+                    file_bytes,
+                    start,
+                    min(start + chunk, page_count),
+                    settings.SCANNED_PDF_DPI,
+                    settings.VISION_MAX_LONG_EDGE,
+                    settings.VISION_GRAYSCALE,
+                    settings.VISION_JPEG_QUALITY,
+                )
+                for start in range(0, page_count, chunk)
+            ])
+        pages = [
+            f"data:image/jpeg;base64,{base64.b64encode(image).decode('utf-8')}"
+            for part in parts
+            for image in part
+        ]
+
+        self._remember_pages(file_hash, pages)
+        return pages
+
+    async def prepare(self, file_bytes: bytes) -> Optional[bytes]:
+        """Run the pre-processing pipeline; None means "send the original"."""
+        if not settings.VISION_PREPROCESS_ENABLED:
+            return None
+        try:
+            prepared = await run_in_process(
+                image_worker.prepare_for_vision,
+                file_bytes,
+                settings.VISION_MAX_LONG_EDGE,
+                settings.VISION_GRAYSCALE,
+                settings.VISION_JPEG_QUALITY,
+            )
+        except Exception as e:
+            logger.warning("Не удалось подготовить изображение, отправляем оригинал: %s", e)
+            return None
+
+        # Оригинал уже компактнее - нет смысла его заменять
+        if len(prepared) >= len(file_bytes):
+            return None
+        logger.debug("Изображение сжато: %d → %d байт", len(file_bytes), len(prepared))
+        return prepared
+
+
+image_preprocessing_service = ImagePreprocessingService()
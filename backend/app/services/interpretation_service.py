@@ -1,15 +1,84 @@
+"""
+Сервис AI-интерпретаций результатов анализов.
+
+Интерпретация создаётся со статусом pending, а генерация выполняется
+фоновой задачей процесса (не более INTERPRETATION_CONCURRENCY одновременно)
+со своей сессией БД - POST не ждёт ответа LLM. Переходы статуса
+публикуются подписчикам `subscribe()`, на них построен поток
+GET /interpretations/{id}/events. Неудачную интерпретацию можно
+перезапустить (`retry_interpretation`) без создания новой записи.
+
+Фоновая задача живёт только в своём процессе: после рестарта запись
+остаётся в pending/processing. Такие записи старше
+INTERPRETATION_STALE_SECONDS считаются зависшими - при старте они
+помечаются failed, и их также можно перезапустить. Переход
+pending → processing выполняется атомарным UPDATE, поэтому одну
+интерпретацию не сгенерируют две задачи.
+
+Если у пользователя есть завершённая интерпретация подмножества выбранных
+документов (INTERPRETATION_INCREMENTAL), новая строится из её текста,
+сводок новых документов (DocumentDigestService) и прежних значений тех же
+показателей - размер промпта растёт с объёмом новых данных, а не всей истории.
+"""
+
+import asyncio
+import logging
 import json
-from typing import List, Dict, Any
+from contextlib import contextmanager
+from typing import List, Dict, Any, Iterator, Optional
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_
+from sqlalchemy import select, update, and_, or_, func
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import selectinload
-from datetime import datetime
+from pymongo.errors import PyMongoError
+from datetime import datetime, date, timedelta
 from uuid import UUID
 
-from app.models.interpretation import Interpretation, InterpretationStatus
+from app.models.interpretation import (
+    Interpretation,
+    InterpretationStatus,
+    compute_doc_set_hash,
+    interpretation_documents,
+)
 from app.models.document import Document
-from app.db.mongodb import get_metadata_collection
+from app.db.postgres import AsyncSessionLocal
 from app.services.ai_service import ai_service
+from app.services.document_digest_service import document_digest_service
+from app.services.prompt_builder import PromptDocument, build_compact_context, load_prompt_documents
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Ограничение на количество одновременных генераций в процессе
+_interpretation_semaphore = asyncio.Semaphore(settings.INTERPRETATION_CONCURRENCY)
+# Ссылки на фоновые задачи, чтобы их не собрал GC до завершения
+_background_tasks: set[asyncio.Task] = set()
+# Очереди подписчиков на события интерпретаций этого процесса
+_subscribers: dict[UUID, set[asyncio.Queue]] = {}
+
+INTERPRETATION_SYSTEM_PROMPT = """Ты медицинский AI-ассистент, специализирующийся на интерпретации результатов анализов.
+Твоя задача - предоставить понятное для пациента объяснение результатов анализов.
+
+ВАЖНЫЕ ПРАВИЛА:
+1. Используй осторожные, не категоричные формулировки
+2. НЕ ставь диагнозы
+3. Используй понятный для пациента язык
+4. Будь эмпатичным
+5. При критических отклонениях настоятельно рекомендуй обратиться к врачу
+6. Если показатели в норме - явно укажи на это для снижения тревожности"""
+
+TERMINAL_STATUSES = {InterpretationStatus.completed.value, InterpretationStatus.failed.value}
+ACTIVE_STATUSES = (InterpretationStatus.pending, InterpretationStatus.processing)
+
+
+def _publish(interpretation_id: UUID, event: Dict[str, Any]) -> None:
+    for queue in _subscribers.get(interpretation_id, ()):
+        queue.put_nowait(event)
+
+
+def _stale_before() -> datetime:
+    """Pending/processing records not updated since then are considered orphaned"""
+    return datetime.utcnow() - timedelta(seconds=settings.INTERPRETATION_STALE_SECONDS)
 
 
 class InterpretationService:
@@ -21,7 +90,7 @@ class InterpretationService:
         user_id: UUID, 
         document_ids: List[UUID]
     ) -> Interpretation:
-        """Создать новую интерпретацию для выбранных документов"""
+        """Создать интерпретацию (pending) и поставить её генерацию в очередь"""
         
         # Проверка наличия всех документов и что они принадлежат пользователю
         query = select(Document).where(
@@ -37,13 +106,15 @@ class InterpretationService:
             raise ValueError("Некоторые документы не найдены или не принадлежат пользователю")
         
         # Проверка на дубликат (те же самые документы)
-        existing = await self._find_existing_interpretation(db, user_id, document_ids)
+        doc_set_hash = compute_doc_set_hash(document_ids)
+        existing = await self._find_existing_interpretation(db, user_id, doc_set_hash)
         if existing:
             raise ValueError(f"Интерпретация для этого набора документов уже существует (ID: {existing.id})")
         
         # Создать новую интерпретацию
         interpretation = Interpretation(
             user_id=user_id,
+            doc_set_hash=doc_set_hash,
             status=InterpretationStatus.pending
         )
         
@@ -51,65 +122,233 @@ class InterpretationService:
         interpretation.documents = list(documents)
         
         db.add(interpretation)
+        try:
+            await db.commit()
+        except IntegrityError:
+            # Параллельный запрос с тем же набором успел раньше
+            await db.rollback()
+            existing = await self._find_existing_interpretation(db, user_id, doc_set_hash)
+            if existing:
+                raise ValueError(f"Интерпретация для этого набора документов уже существует (ID: {existing.id})")
+            raise
+        
+        self._schedule_processing(interpretation.id)
+        
+        return await self.get_interpretation_by_id(db, interpretation.id, user_id)
+    
+    async def retry_interpretation(
+        self,
+        db: AsyncSession,
+        interpretation_id: UUID,
+        user_id: UUID
+    ) -> Interpretation | None:
+        """Перезапустить неудавшуюся или зависшую интерпретацию"""
+        
+        interpretation = await self.get_interpretation_by_id(db, interpretation_id, user_id)
+        if not interpretation:
+            return None
+        
+        # Условный UPDATE: из двух параллельных повторов пройдёт один
+        result = await db.execute(
+            update(Interpretation)
+            .where(
+                Interpretation.id == interpretation_id,
+                or_(
+                    Interpretation.status == InterpretationStatus.failed,
+                    and_(
+                        Interpretation.status.in_(ACTIVE_STATUSES),
+                        Interpretation.updated_at < _stale_before()
+                    )
+                )
+            )
+            .values(status=InterpretationStatus.pending, error_message=None, updated_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount == 0:
+            await db.rollback()
+            raise ValueError("Повторить можно только неудавшуюся или зависшую интерпретацию")
         await db.commit()
         await db.refresh(interpretation)
+        _publish(interpretation_id, self._event(interpretation))
         
-        # Запустить асинхронную обработку
-        await self._process_interpretation(db, interpretation)
+        self._schedule_processing(interpretation_id)
         
-        # Перезагрузить интерпретацию с документами для возврата
-        query = select(Interpretation).where(
-            Interpretation.id == interpretation.id
-        ).options(selectinload(Interpretation.documents))
-        result = await db.execute(query)
-        interpretation = result.scalar_one()
-        
-        return interpretation
+        return await self.get_interpretation_by_id(db, interpretation_id, user_id)
+    
+    def _schedule_processing(self, interpretation_id: UUID) -> None:
+        """Run interpretation generation in the background"""
+        task = asyncio.create_task(self._process_interpretation_background(interpretation_id))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+    
+    async def _process_interpretation_background(self, interpretation_id: UUID) -> None:
+        """Generate the interpretation using its own DB session"""
+        async with _interpretation_semaphore:
+            async with AsyncSessionLocal() as db:
+                # Атомарный захват pending → processing
+                result = await db.execute(
+                    update(Interpretation)
+                    .where(
+                        Interpretation.id == interpretation_id,
+                        Interpretation.status == InterpretationStatus.pending
+                    )
+                    .values(status=InterpretationStatus.processing, updated_at=datetime.utcnow())
+                    .execution_options(synchronize_session=False)
+                )
+                await db.commit()
+                if result.rowcount == 0:
+                    return
+                await self._process_interpretation(db, interpretation_id)
+    
+    async def _mark_interrupted(self, interpretation_id: UUID) -> None:
+        """Mark a cancelled job as failed so that it can be retried"""
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(Interpretation)
+                .where(
+                    Interpretation.id == interpretation_id,
+                    Interpretation.status == InterpretationStatus.processing
+                )
+                .values(
+                    status=InterpretationStatus.failed,
+                    error_message="Генерация прервана остановкой сервера",
+                    updated_at=datetime.utcnow()
+                )
+            )
+            await db.commit()
+            interpretation = await db.get(Interpretation, interpretation_id)
+            if interpretation is not None:
+                _publish(interpretation_id, self._event(interpretation))
+    
+    async def fail_stale_interpretations(self) -> int:
+        """Mark orphaned pending/processing interpretations as failed (called at startup)"""
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                update(Interpretation)
+                .where(
+                    Interpretation.status.in_(ACTIVE_STATUSES),
+                    Interpretation.updated_at < _stale_before()
+                )
+                .values(
+                    status=InterpretationStatus.failed,
+                    error_message="Генерация прервана, повторите запрос",
+                    updated_at=datetime.utcnow()
+                )
+            )
+            await db.commit()
+        if result.rowcount:
+            logger.info("Зависшие интерпретации помечены failed: %d", result.rowcount)
+        return result.rowcount
+    
+    @staticmethod
+    def _event(interpretation: Interpretation, stage: Optional[str] = None) -> Dict[str, Any]:
+        return {
+            "id": str(interpretation.id),
+            "status": interpretation.status.value,
+            "stage": stage,
+            "error_message": interpretation.error_message,
+            "completed_at": interpretation.completed_at.isoformat() if interpretation.completed_at else None,
+        }
+    
+    @staticmethod
+    @contextmanager
+    def subscribe(interpretation_id: UUID) -> Iterator[asyncio.Queue]:
+        """Queue receiving status events published by this process"""
+        queue: asyncio.Queue = asyncio.Queue()
+        _subscribers.setdefault(interpretation_id, set()).add(queue)
+        try:
+            yield queue
+        finally:
+            queues = _subscribers.get(interpretation_id)
+            if queues is not None:
+                queues.discard(queue)
+                if not queues:
+                    del _subscribers[interpretation_id]
+    
+    async def get_status_event(self, interpretation_id: UUID) -> Dict[str, Any] | None:
+        """Current status read from the database (short-lived session)"""
+        async with AsyncSessionLocal() as db:
+            interpretation = await db.get(Interpretation, interpretation_id)
+            return self._event(interpretation) if interpretation else None
+    
+    async def stream_events(self, interpretation_id: UUID):
+        """Yield status events until the interpretation completes or fails
+
+        События из этого процесса приходят сразу; если генерация идёт в
+        другом воркере, статус перечитывается из БД раз в
+        INTERPRETATION_EVENTS_POLL_SECONDS.
+        """
+        with self.subscribe(interpretation_id) as queue:
+            last_event = await self.get_status_event(interpretation_id)
+            if last_event is None:
+                return
+            yield last_event
+            
+            while last_event["status"] not in TERMINAL_STATUSES:
+                try:
+                    event = await asyncio.wait_for(
+                        queue.get(), timeout=settings.INTERPRETATION_EVENTS_POLL_SECONDS
+                    )
+                except asyncio.TimeoutError:
+                    event = await self.get_status_event(interpretation_id)
+                    if event is None:
+                        return
+                    if event["status"] == last_event["status"]:
+                        # Keep-alive для прокси
+                        yield None
+                        continue
+                last_event = event
+                yield event
     
     async def _find_existing_interpretation(
         self, 
         db: AsyncSession, 
         user_id: UUID, 
-        document_ids: List[UUID]
+        doc_set_hash: str
     ) -> Interpretation | None:
         """Найти существующую интерпретацию для того же набора документов"""
         
-        # Получить все интерпретации пользователя с eager loading документов
         query = select(Interpretation).where(
-            Interpretation.user_id == user_id
-        ).options(selectinload(Interpretation.documents))
+            and_(
+                Interpretation.user_id == user_id,
+                Interpretation.doc_set_hash == doc_set_hash
+            )
+        )
         result = await db.execute(query)
-        interpretations = result.scalars().all()
-        
-        # Проверить каждую интерпретацию
-        doc_ids_set = set(document_ids)
-        for interp in interpretations:
-            interp_doc_ids = set(doc.id for doc in interp.documents)
-            if interp_doc_ids == doc_ids_set:
-                return interp
-        
-        return None
+        return result.scalar_one_or_none()
     
-    async def _process_interpretation(self, db: AsyncSession, interpretation: Interpretation):
-        """Обработать интерпретацию с помощью AI"""
+    async def _process_interpretation(self, db: AsyncSession, interpretation_id: UUID):
+        """Обработать интерпретацию (уже в статусе processing) с помощью AI"""
         
         try:
-            # Обновить статус на processing
-            interpretation.status = InterpretationStatus.processing
-            await db.commit()
-            
-            # Перезагрузить интерпретацию с документами
+            # Загрузить интерпретацию с документами
             query = select(Interpretation).where(
-                Interpretation.id == interpretation.id
+                Interpretation.id == interpretation_id
             ).options(selectinload(Interpretation.documents))
             result = await db.execute(query)
             interpretation = result.scalar_one()
             
-            # Собрать данные из документов и MongoDB
-            documents_data = await self._collect_documents_data(db, interpretation.documents)
+            base = None
+            if settings.INTERPRETATION_INCREMENTAL:
+                base = await self._find_base_interpretation(db, interpretation)
             
-            # Сгенерировать интерпретацию с помощью AI
-            interpretation_text = await self._generate_interpretation(documents_data)
+            _publish(interpretation_id, self._event(interpretation, "collecting"))
+            if base:
+                # Дополнить готовую интерпретацию подмножества документов
+                logger.info(
+                    "Инкрементальная интерпретация %s на основе %s", interpretation_id, base.id,
+                    extra={"base_interpretation_id": str(base.id)}
+                )
+                prompt = await self._build_incremental_prompt(interpretation.documents, base)
+                _publish(interpretation_id, self._event(interpretation, "generating"))
+                interpretation_text = await self._generate_incremental_interpretation(prompt)
+            else:
+                # Собрать данные из документов и сводок MongoDB
+                documents_data = await load_prompt_documents(interpretation.documents)
+                
+                # Сгенерировать интерпретацию с помощью AI
+                _publish(interpretation_id, self._event(interpretation, "generating"))
+                interpretation_text = await self._generate_interpretation(documents_data)
             
             # Обновить интерпретацию
             interpretation.status = InterpretationStatus.completed
@@ -118,58 +357,23 @@ class InterpretationService:
             
             await db.commit()
             
+        except asyncio.CancelledError:
+            # Остановка воркера: запись не должна остаться в processing
+            await asyncio.shield(self._mark_interrupted(interpretation_id))
+            raise
         except Exception as e:
-            print(f"❌ Ошибка при обработке интерпретации {interpretation.id}: {str(e)}")
+            logger.exception("Ошибка при обработке интерпретации %s", interpretation_id)
+            await db.rollback()
+            interpretation = await db.get(Interpretation, interpretation_id)
+            if interpretation is None:
+                return
             interpretation.status = InterpretationStatus.failed
             interpretation.error_message = str(e)
             await db.commit()
-    
-    async def _collect_documents_data(self, db: AsyncSession, documents: List[Document]) -> List[Dict[str, Any]]:
-        """Собрать все данные из документов для интерпретации"""
-        
-        documents_data = []
-        metadata_collection = get_metadata_collection()
-        
-        for doc in documents:
-            doc_data = {
-                "id": str(doc.id),
-                "original_filename": doc.original_filename,
-                "document_type": doc.document_type,
-                "document_date": doc.document_date.isoformat() if doc.document_date else None,
-                "patient_name": doc.patient_name,
-                "medical_facility": doc.medical_facility,
-                "lab_results": [],
-                "summary": None,
-                "document_subtype": None,
-                "specialties": None,
-            }
-            
-            # Получить дополнительные данные из MongoDB
-            if doc.mongodb_metadata_id:
-                try:
-                    from bson import ObjectId
-                    mongo_data = metadata_collection.find_one({"_id": ObjectId(doc.mongodb_metadata_id)})
-                    if mongo_data:
-                        # Классификация
-                        classification = mongo_data.get("classification", {})
-                        doc_data["document_subtype"] = classification.get("document_subtype")
-                        doc_data["specialties"] = classification.get("specialties")
-                        
-                        # Извлеченные данные
-                        extracted_data = mongo_data.get("extracted_data", {})
-                        doc_data["summary"] = extracted_data.get("summary")
-                        doc_data["lab_results"] = extracted_data.get("lab_results", [])
-                except Exception as e:
-                    print(f"⚠️ Не удалось получить данные из MongoDB для документа {doc.id}: {str(e)}")
-            
-            documents_data.append(doc_data)
         
-        # Сортировать по дате
-        documents_data.sort(key=lambda x: x["document_date"] or "")
-        
-        return documents_data
+        _publish(interpretation_id, self._event(interpretation))
     
-    async def _generate_interpretation(self, documents_data: List[Dict[str, Any]]) -> str:
+    async def _generate_interpretation(self, documents_data: List[PromptDocument]) -> str:
         """Сгенерировать AI-интерпретацию на основе данных документов"""
         
         # Подготовить промпт для AI
@@ -179,16 +383,7 @@ class InterpretationService:
         messages = [
             {
                 "role": "system",
-                "content": """Ты медицинский AI-ассистент, специализирующийся на интерпретации результатов анализов.
-Твоя задача - предоставить понятное для пациента объяснение результатов анализов.
-
-ВАЖНЫЕ ПРАВИЛА:
-1. Используй осторожные, не категоричные формулировки
-2. НЕ ставь диагнозы
-3. Используй понятный для пациента язык
-4. Будь эмпатичным
-5. При критических отклонениях настоятельно рекомендуй обратиться к врачу
-6. Если показатели в норме - явно укажи на это для снижения тревожности"""
+                "content": INTERPRETATION_SYSTEM_PROMPT
             },
             {
                 "role": "user",
@@ -196,57 +391,134 @@ class InterpretationService:
             }
         ]
         
-        response_data = await ai_service._call_openrouter(messages)
+        response_data = await ai_service._call_openrouter(messages, stage_name="llm_interpretation")
         interpretation_text = response_data["choices"][0]["message"]["content"]
         
         return interpretation_text
     
-    def _build_interpretation_prompt(self, documents_data: List[Dict[str, Any]]) -> str:
+    async def _find_base_interpretation(
+        self,
+        db: AsyncSession,
+        interpretation: Interpretation
+    ) -> Interpretation | None:
+        """Завершённая интерпретация пользователя по наибольшему подмножеству документов
+
+        Интерпретация, документы которой изменились после её завершения
+        (повторная экстракция, переанализ), не годится как основа: её выводы
+        о них устарели, и тогда интерпретация строится полностью.
+        """
+        
+        document_ids = [doc.id for doc in interpretation.documents]
+        links = interpretation_documents.c
+        # completed_at хранится в UTC без часового пояса, documents.updated_at - timestamptz
+        completed_at = func.timezone("UTC", Interpretation.completed_at)
+        query = (
+            select(links.interpretation_id)
+            .join(Interpretation, Interpretation.id == links.interpretation_id)
+            .join(Document, Document.id == links.document_id)
+            .where(
+                and_(
+                    Interpretation.user_id == interpretation.user_id,
+                    Interpretation.status == InterpretationStatus.completed,
+                    Interpretation.id != interpretation.id
+                )
+            )
+            .group_by(links.interpretation_id)
+            .having(func.count().filter(links.document_id.not_in(document_ids)) == 0)
+            .having(func.count() < len(document_ids))
+            .having(func.count().filter(Document.updated_at > completed_at) == 0)
+            .order_by(func.count().desc(), func.max(Interpretation.completed_at).desc())
+            .limit(1)
+        )
+        base_id = (await db.execute(query)).scalar_one_or_none()
+        if base_id is None:
+            return None
+        
+        query = select(Interpretation).where(
+            Interpretation.id == base_id
+        ).options(selectinload(Interpretation.documents))
+        result = await db.execute(query)
+        return result.scalar_one_or_none()
+    
+    async def _build_incremental_prompt(
+        self,
+        documents: List[Document],
+        base: Interpretation
+    ) -> str:
+        """Промпт из прежней интерпретации, сводок новых документов и прежних значений их показателей"""
+        
+        base_ids = {doc.id for doc in base.documents}
+        documents = sorted(documents, key=lambda doc: doc.document_date or date.min)
+        new_docs = [doc for doc in documents if doc.id not in base_ids]
+        old_docs = [doc for doc in documents if doc.id in base_ids]
+        
+        try:
+            digests = await document_digest_service.get_digests([str(doc.id) for doc in documents])
+        except PyMongoError as e:
+            logger.warning("Сводки документов недоступны, промпт без показателей: %s", e)
+            digests = {}
+        
+        new_info = []
+        new_names = set()
+        for i, doc in enumerate(new_docs, 1):
+            digest = digests.get(str(doc.id)) or {}
+            new_names.update(analyte["name"] for analyte in digest.get("analytes", []))
+            header = f"\n### Новый документ {i}: {doc.document_type or 'тип не указан'}"
+            if doc.document_date:
+                header += f", {doc.document_date.isoformat()}"
+            if doc.medical_facility:
+                header += f", {doc.medical_facility}"
+            new_info.append(f"{header}\n{document_digest_service.format_digest(digest) or 'Данных нет'}")
+        
+        # Последнее прежнее значение каждого показателя, встречающегося в новых документах
+        previous = {}
+        for doc in old_docs:
+            doc_date = doc.document_date.isoformat() if doc.document_date else "дата не указана"
+            for analyte in (digests.get(str(doc.id)) or {}).get("analytes", []):
+                if analyte["name"] in new_names:
+                    previous[analyte["name"]] = f"{document_digest_service.format_analyte(analyte)} ({doc_date})"
+        previous_info = "\n".join(f"- {line}" for line in previous.values()) or "Нет совпадающих показателей"
+        
+        return f"""Ранее была подготовлена интерпретация {len(old_docs)} документов пациента. Появились новые документы ({len(new_docs)}).
+Обнови интерпретацию с учётом новых данных.
+
+## Предыдущая интерпретация
+{base.interpretation_text}
+
+## Новые документы
+Формат: показатель: значение единица; ↓ ниже нормы, ↑ выше нормы, ‼ критично (с референсом).
+{"".join(new_info)}
+
+## Прежние значения тех же показателей
+{previous_info}
+
+---
+
+Предоставь полную обновлённую интерпретацию в той же структуре, что и предыдущая
+(общая оценка, анализ показателей, динамика, рекомендации, важное напоминание).
+В разделе "Динамика" сравни новые значения с прежними. Выводы предыдущей интерпретации,
+не затронутые новыми данными, сохрани.
+
+Пиши на русском языке, простым и понятным для пациента языком."""
+    
+    async def _generate_incremental_interpretation(self, prompt: str) -> str:
+        messages = [
+            {"role": "system", "content": INTERPRETATION_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ]
+        response_data = await ai_service._call_openrouter(messages, stage_name="llm_interpretation_incremental")
+        return response_data["choices"][0]["message"]["content"]
+    
+    def _build_interpretation_prompt(self, documents_data: List[PromptDocument]) -> str:
         """Построить промпт для генерации интерпретации"""
         
         # Подсчитать статистику
         total_docs = len(documents_data)
-        docs_with_labs = sum(1 for doc in documents_data if doc.get("lab_results"))
-        total_lab_results = sum(len(doc.get("lab_results", [])) for doc in documents_data)
-        
-        # Собрать информацию о документах
-        docs_info = []
-        for i, doc in enumerate(documents_data, 1):
-            doc_info = f"\n### Документ {i}"
-            doc_info += f"\n- Файл: {doc['original_filename']}"
-            doc_info += f"\n- Тип: {doc.get('document_type', 'не указан')}"
-            if doc.get('document_subtype'):
-                doc_info += f"\n- Подтип: {doc['document_subtype']}"
-            if doc.get('document_date'):
-                doc_info += f"\n- Дата: {doc['document_date']}"
-            if doc.get('medical_facility'):
-                doc_info += f"\n- Учреждение: {doc['medical_facility']}"
-            
-            # Результаты анализов
-            lab_results = doc.get("lab_results", [])
-            if lab_results:
-                doc_info += f"\n\n**Результаты анализов ({len(lab_results)} показателей):**"
-                for lab in lab_results:
-                    test_name = lab.get("test_name", "Неизвестный показатель")
-                    value = lab.get("value", "?")
-                    unit = lab.get("unit") or ""
-                    ref_range = lab.get("reference_range") or "не указан"
-                    flag = lab.get("flag") or "N"
-                    
-                    flag_text = {
-                        "L": "⬇️ Ниже нормы",
-                        "H": "⬆️ Выше нормы",
-                        "A": "⚠️ Критично",
-                        "N": "✅ Норма"
-                    }.get(flag, "")
-                    
-                    doc_info += f"\n- {test_name}: {value} {unit} (референс: {ref_range}) {flag_text}"
-            
-            # Краткое содержание
-            if doc.get("summary"):
-                doc_info += f"\n\n**Краткое содержание:**\n{doc['summary']}"
-            
-            docs_info.append(doc_info)
+        docs_with_labs = sum(1 for doc in documents_data if doc.analytes)
+        total_lab_results = sum(len(doc.analytes) for doc in documents_data)
+        
+        # Показатели сворачиваются в тренды и укладываются в бюджет токенов
+        context = build_compact_context(documents_data, settings.INTERPRETATION_PROMPT_TOKEN_BUDGET)
         
         # Собрать полный промпт
         prompt = f"""Проанализируй следующие медицинские документы пациента и предоставь интерпретацию:
@@ -256,8 +528,7 @@ class InterpretationService:
 - Документов с результатами анализов: {docs_with_labs}
 - Общее количество показателей: {total_lab_results}
 
-## Документы
-{"".join(docs_info)}
+{context.text}
 
 ---
 
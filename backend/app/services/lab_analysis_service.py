@@ -2,12 +2,14 @@ import uuid
 from datetime import datetime
 from typing import Optional, Tuple
 
+from sqlalchemy import update, func
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.models.document import Document
 from app.db.mongodb import document_metadata_collection
 from app.services.ai_service import ai_service
 from app.core.config import settings
+from app.core.tracing import stage
 from app.db.minio_client import minio_client
 
 
@@ -18,18 +20,32 @@ class LabAnalysisService:
         file_bytes: bytes,
         file_ext: str,
         db: AsyncSession,
+        source: str = "upload",
     ) -> dict:
         """Run LLM extraction of lab results and store them in MongoDB.
 
+        `source` is recorded in extraction_history ("upload" or "reprocess").
         Returns a summary dict with counts.
+
+        Пустой результат не затирает уже сохранённые анализы (неразобранный
+        ответ LLM тоже даёт пустой список) - вместо записи поднимается ValueError.
         """
 
         results = await ai_service.extract_lab_results(
             file_bytes,
             file_ext,
             document.original_filename,
+            file_hash=document.file_hash,
         )
 
+        if not results.get("lab_results"):
+            stored = await document_metadata_collection.find_one(
+                {"document_id": str(document.id), "extracted_data.lab_results.0": {"$exists": True}},
+                {"_id": 1}
+            )
+            if stored is not None:
+                raise ValueError("Экстракция не вернула результатов, сохранённые анализы оставлены без изменений")
+
         # Upsert into MongoDB under extracted_data.lab_results
         now = datetime.utcnow()
 
@@ -39,17 +55,25 @@ class LabAnalysisService:
                 "user_id": str(document.user_id),
                 "updated_at": now,
                 "ai_response_labs.model": settings.OPENROUTER_MODEL,
+                "ai_response_labs.prompt_version": ai_service.labs_prompt_version,
                 "ai_response_labs.count": len(results.get("lab_results", []) or []),
                 "ai_response_labs.updated_at": now,
             },
             "$setOnInsert": {
                 "created_at": now,
             },
+            # Сводка для интерпретаций строится заново (DocumentDigestService)
+            "$unset": {
+                "interpretation_digest": "",
+            },
             "$push": {
                 # Keep history of lab extraction runs
                 "extraction_history": {
                     "type": "labs",
                     "count": len(results.get("lab_results", []) or []),
+                    "model": settings.OPENROUTER_MODEL,
+                    "prompt_version": ai_service.labs_prompt_version,
+                    "source": source,
                     "timestamp": now,
                 }
             },
@@ -58,9 +82,16 @@ class LabAnalysisService:
         # Store standardized lab results under extracted_data.lab_results
         update_doc["$set"]["extracted_data.lab_results"] = results.get("lab_results", [])
 
-        await document_metadata_collection.update_one(
-            {"document_id": str(document.id)}, update_doc, upsert=True
+        with stage("mongo_write"):
+            await document_metadata_collection.update_one(
+                {"document_id": str(document.id)}, update_doc, upsert=True
+            )
+        
+        # Данные документа изменились - готовые отчёты по нему устарели (ReportService.request_report)
+        await db.execute(
+            update(Document).where(Document.id == document.id).values(updated_at=func.now())
         )
+        await db.commit()
 
         return {
             "lab_results_count": len(results.get("lab_results", []) or []),
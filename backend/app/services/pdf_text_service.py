@@ -0,0 +1,108 @@
+"""
+Извлечение текста из PDF с кэшированием по file_hash.
+
+Разбор выполняется в пуле процессов (app.core.process_pool), большие
+файлы разбиваются на диапазоны страниц и обрабатываются параллельно.
+Постраничный текст сохраняется в MongoDB (коллекция document_text) и в
+небольшом LRU в памяти процесса, поэтому повторные вызовы для того же
+файла - классификация, экстракция анализов, переобработка - не разбирают
+PDF заново. Текст удаляется вместе с последним документом с этим file_hash
+(`forget`).
+"""
+
+import logging
+import asyncio
+import hashlib
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional
+
+from app.core.config import settings
+from app.core.process_pool import run_in_process
+from app.db.mongodb import document_text_collection
+from app.workers import pdf as pdf_worker
+
+logger = logging.getLogger(__name__)
+
+
+class PdfTextService:
+
+    def __init__(self, memory_cache_size: int = 32):
+        self._memory_cache: "OrderedDict[str, list[str]]" = OrderedDict()
+        self._memory_cache_size = memory_cache_size
+
+    def _remember(self, file_hash: str, pages: list[str]) -> None:
+        self._memory_cache[file_hash] = pages
+        self._memory_cache.move_to_end(file_hash)
+        while len(self._memory_cache) > self._memory_cache_size:
+            self._memory_cache.popitem(last=False)
+
+    async def get_cached_pages(self, file_hash: str) -> Optional[list[str]]:
+        """Return stored page texts for a file hash, if the PDF was parsed before"""
+        pages = self._memory_cache.get(file_hash)
+        if pages is not None:
+            self._memory_cache.move_to_end(file_hash)
+            return pages
+
+        try:
+            cached = await document_text_collection.find_one(
+                {"file_hash": file_hash}, {"pages": 1}
+            )
+        except Exception as e:
+            logger.warning("Не удалось прочитать кэш текста PDF: %s", e)
+            return None
+
+        if cached is None:
+            return None
+        self._remember(file_hash, cached["pages"])
+        return cached["pages"]
+
+    async def _parse_pages(self, file_bytes: bytes) -> list[str]:
+        page_count = await run_in_process(pdf_worker.count_pages, file_bytes)
+        if page_count < settings.PDF_PARALLEL_MIN_PAGES:
+            return await run_in_process(pdf_worker.extract_pages, file_bytes)
+
+        chunk = settings.PDF_PAGES_PER_CHUNK
+        parts = await asyncio.gather(*[
+            run_in_process(pdf_worker.extract_pages, file_bytes, start, start + chunk)
+            for start in range(0, page_count, chunk)
+        ])
+        return [page for part in parts for page in part]
+
+    async def extract_pages(self, file_bytes: bytes, file_hash: Optional[str] = None) -> list[str]:
+        """Return text of every page, using the cache when possible"""
+        file_hash = file_hash or hashlib.sha256(file_bytes).hexdigest()
+
+        pages = await self.get_cached_pages(file_hash)
+        if pages is not None:
+            return pages
+
+        pages = await self._parse_pages(file_bytes)
+        self._remember(file_hash, pages)
+
+        try:
+            await document_text_collection.update_one(
+                {"file_hash": file_hash},
+                {
+                    "$set": {"pages": pages, "page_count": len(pages)},
+                    "$setOnInsert": {"file_hash": file_hash, "created_at": datetime.utcnow()},
+                },
+                upsert=True,
+            )
+        except Exception as e:
+            logger.warning("Не удалось сохранить кэш текста PDF: %s", e)
+
+        return pages
+
+    async def forget(self, file_hash: str) -> None:
+        """Drop the stored text of a file once no document references it"""
+        self._memory_cache.pop(file_hash, None)
+        await document_text_collection.delete_one({"file_hash": file_hash})
+
+    async def extract_text(self, file_bytes: bytes, file_hash: Optional[str] = None) -> str:
+        """Return full document text, pages separated by blank lines"""
+        pages = await self.extract_pages(file_bytes, file_hash)
+        return "\n\n".join(page for page in pages if page).strip()
+
+
+pdf_text_service = PdfTextService()
@@ -0,0 +1,249 @@
+"""
+Сборка компактного контекста документов для промптов интерпретаций и отчётов.
+
+Показатели берутся из сводок документов (DocumentDigestService), то есть уже
+нормализованы по справочнику анализов. Повторы одного показателя в разных
+документах сворачиваются в строку тренда: первое и последнее значение,
+минимум, максимум и наклон в месяц. Контекст укладывается в бюджет токенов
+по приоритету: сначала показатели с отклонениями, затем список документов,
+показатели в норме и краткие содержания. Всё, что не поместилось,
+отмечается в промпте числом опущенных строк.
+"""
+
+import logging
+import math
+import re
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Any, Dict, List, Optional
+
+from pymongo.errors import PyMongoError
+
+from app.core.config import settings
+from app.services.document_digest_service import document_digest_service, FLAG_TEXT
+
+logger = logging.getLogger(__name__)
+
+ABNORMAL_FLAGS = {"L", "H", "A"}
+LEGEND = "Показатель, ед.: первое → последнее значение (мин, макс, n, изменение в месяц); ↓ ниже нормы, ↑ выше нормы, ‼ критично."
+
+# Приоритеты строк контекста: меньше - важнее
+PRIORITY_ABNORMAL_LATEST = 0
+PRIORITY_ABNORMAL_PAST = 1
+PRIORITY_DOCUMENT = 2
+PRIORITY_NORMAL = 3
+PRIORITY_SUMMARY = 4
+
+_NUMBER_RE = re.compile(r"^[-+]?\d+(?:[.,]\d+)?$")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate; Cyrillic text takes about 3 characters per token"""
+    return math.ceil(len(text) / settings.PROMPT_CHARS_PER_TOKEN)
+
+
+def to_number(value: Any) -> Optional[float]:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if isinstance(value, str) and _NUMBER_RE.match(value.strip()):
+        return float(value.strip().replace(",", "."))
+    return None
+
+
+def _format_number(value: float) -> str:
+    return f"{value:.4g}"
+
+
+@dataclass
+class PromptDocument:
+    """Документ для промпта: поля из PostgreSQL и сводка из MongoDB"""
+    document_date: Optional[date]
+    document_type: Optional[str]
+    original_filename: str
+    medical_facility: Optional[str] = None
+    document_subtype: Optional[str] = None
+    summary: Optional[str] = None
+    analytes: List[Dict[str, Any]] = field(default_factory=list)
+
+
+async def load_prompt_documents(documents: list) -> List[PromptDocument]:
+    """PromptDocument for each Document, with its cached digest
+
+    Если MongoDB недоступна, документы описываются только полями из PostgreSQL.
+    """
+    try:
+        digests = await document_digest_service.get_digests([str(doc.id) for doc in documents])
+    except PyMongoError as e:
+        logger.warning("Сводки документов недоступны, промпт без показателей: %s", e)
+        digests = {}
+    prompt_documents = []
+    for doc in documents:
+        digest = digests.get(str(doc.id)) or {}
+        prompt_documents.append(PromptDocument(
+            document_date=doc.document_date,
+            document_type=doc.document_type,
+            original_filename=doc.original_filename,
+            medical_facility=doc.medical_facility,
+            document_subtype=digest.get("document_subtype"),
+            summary=digest.get("summary"),
+            analytes=digest.get("analytes", []),
+        ))
+    return prompt_documents
+
+
+@dataclass
+class AnalyteTrend:
+    name: str
+    unit: Optional[str]
+    # (дата, значение, флаг, референс) в хронологическом порядке
+    points: List[tuple] = field(default_factory=list)
+
+    @property
+    def latest_abnormal(self) -> bool:
+        return self.points[-1][2] in ABNORMAL_FLAGS
+
+    @property
+    def any_abnormal(self) -> bool:
+        return any(point[2] in ABNORMAL_FLAGS for point in self.points)
+
+    def slope_per_month(self) -> Optional[float]:
+        """Least-squares slope over dated numeric points"""
+        numeric = [
+            (point[0].toordinal(), number)
+            for point in self.points
+            if point[0] is not None and (number := to_number(point[1])) is not None
+        ]
+        if len({day for day, _ in numeric}) < 2:
+            return None
+        mean_x = sum(day for day, _ in numeric) / len(numeric)
+        mean_y = sum(value for _, value in numeric) / len(numeric)
+        var_x = sum((day - mean_x) ** 2 for day, _ in numeric)
+        cov = sum((day - mean_x) * (value - mean_y) for day, value in numeric)
+        return cov / var_x * 30.4
+
+    def render(self) -> str:
+        name = f"{self.name}, {self.unit}" if self.unit else self.name
+        last_date, last_value, last_flag, last_ref = self.points[-1]
+        flag = FLAG_TEXT.get(last_flag or "", "")
+        ref = f" (реф. {last_ref})" if flag and last_ref else ""
+
+        if len(self.points) == 1:
+            when = f" [{last_date.isoformat()}]" if last_date else ""
+            return f"{name}: {last_value}{' ' + flag if flag else ''}{ref}{when}"
+
+        numbers = [n for n in (to_number(point[1]) for point in self.points) if n is not None]
+        first_value = self.points[0][1]
+        line = f"{name}: {first_value} → {last_value}{' ' + flag if flag else ''}{ref}"
+        details = []
+        if len(numbers) >= 2:
+            details.append(f"мин {_format_number(min(numbers))}, макс {_format_number(max(numbers))}")
+        details.append(f"n={len(self.points)}")
+        slope = self.slope_per_month()
+        if slope is not None:
+            details.append(f"{slope:+.3g}/мес")
+        past_flags = sorted({FLAG_TEXT[p[2]] for p in self.points[:-1] if p[2] in ABNORMAL_FLAGS})
+        if past_flags:
+            details.append(f"ранее {''.join(past_flags)}")
+        first_date = self.points[0][0]
+        if first_date and last_date:
+            details.append(f"{first_date.isoformat()} … {last_date.isoformat()}")
+        return f"{line} ({'; '.join(details)})"
+
+
+def build_trends(documents: List[PromptDocument]) -> List[AnalyteTrend]:
+    """Group analytes of all documents by (name, unit) in chronological order"""
+    trends: Dict[tuple, AnalyteTrend] = {}
+    for doc in sorted(documents, key=lambda d: d.document_date or date.min):
+        for analyte in doc.analytes:
+            key = (analyte["name"], analyte.get("unit"))
+            trend = trends.setdefault(key, AnalyteTrend(name=analyte["name"], unit=analyte.get("unit")))
+            value = analyte.get("value")
+            if isinstance(value, float):
+                value = _format_number(value)
+            trend.points.append((doc.document_date, value, analyte.get("flag"), analyte.get("ref")))
+    return list(trends.values())
+
+
+@dataclass
+class _Line:
+    section: str
+    text: str
+    priority: int
+    order: int
+    tokens: int = 0
+
+
+@dataclass
+class CompactContext:
+    text: str
+    estimated_tokens: int
+    omitted: Dict[str, int]
+
+
+_SECTIONS = [
+    ("abnormal", "## Показатели с отклонениями"),
+    ("documents", "## Документы"),
+    ("normal", "## Показатели в норме"),
+    ("summaries", "## Краткое содержание документов"),
+]
+
+
+def _document_line(doc: PromptDocument) -> str:
+    parts = [doc.document_date.isoformat() if doc.document_date else "дата не указана"]
+    kind = doc.document_type or "тип не указан"
+    if doc.document_subtype:
+        kind += f" / {doc.document_subtype}"
+    parts.append(kind)
+    if doc.medical_facility:
+        parts.append(doc.medical_facility)
+    return "- " + ", ".join(parts)
+
+
+def build_compact_context(documents: List[PromptDocument], budget_tokens: int) -> CompactContext:
+    """Render documents and analyte trends within the token budget"""
+    documents = sorted(documents, key=lambda d: d.document_date or date.min)
+    lines: List[_Line] = []
+
+    for trend in build_trends(documents):
+        if trend.latest_abnormal:
+            lines.append(_Line("abnormal", trend.render(), PRIORITY_ABNORMAL_LATEST, len(lines)))
+        elif trend.any_abnormal:
+            lines.append(_Line("abnormal", trend.render(), PRIORITY_ABNORMAL_PAST, len(lines)))
+        else:
+            lines.append(_Line("normal", trend.render(), PRIORITY_NORMAL, len(lines)))
+
+    for doc in documents:
+        lines.append(_Line("documents", _document_line(doc), PRIORITY_DOCUMENT, len(lines)))
+        if doc.summary:
+            date_text = doc.document_date.isoformat() if doc.document_date else "без даты"
+            lines.append(_Line("summaries", f"- {date_text}: {doc.summary}", PRIORITY_SUMMARY, len(lines)))
+
+    # Заголовки и легенда всегда входят в промпт
+    used = estimate_tokens(LEGEND) + sum(estimate_tokens(title) for _, title in _SECTIONS)
+    included: List[_Line] = []
+    omitted: Dict[str, int] = {}
+    for line in sorted(lines, key=lambda line: (line.priority, line.order)):
+        line.tokens = estimate_tokens(line.text) + 1
+        if used + line.tokens <= budget_tokens:
+            included.append(line)
+            used += line.tokens
+        else:
+            omitted[line.section] = omitted.get(line.section, 0) + 1
+
+    parts = [LEGEND]
+    for section, title in _SECTIONS:
+        section_lines = sorted((line for line in included if line.section == section), key=lambda line: line.order)
+        if not section_lines and not omitted.get(section):
+            continue
+        parts.append(f"\n{title}")
+        parts.extend(line.text for line in section_lines)
+        if omitted.get(section):
+            parts.append(f"… ещё {omitted[section]} строк опущено из-за ограничения объёма")
+
+    text = "\n".join(parts)
+    if omitted:
+        logger.info(
+            "Контекст промпта сокращён до бюджета %d токенов", budget_tokens,
+            extra={"omitted": omitted, "estimated_tokens": used}
+        )
+    return CompactContext(text=text, estimated_tokens=used, omitted=omitted)
@@ -1,36 +1,67 @@
+import asyncio
+import hashlib
+import json
+import logging
+import re
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from io import BytesIO
+from typing import Optional
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, update, func, or_, and_
 
 from app.models.document import Document
-from app.models.report import Report
+from app.models.report import Report, ReportStatus
+from app.db.postgres import AsyncSessionLocal
 from app.db.minio_client import minio_client
 from app.services.ai_service import ai_service
+from app.services.prompt_builder import ABNORMAL_FLAGS, PromptDocument, build_trends, load_prompt_documents, to_number
 from app.core.config import settings
 from app.schemas.document import ReportFilters
+from app.core.process_pool import run_in_process
+from app.core.tracing import stage, trace_document
+from app.workers import report_pdf as report_pdf_worker
+from app.workers.report_pdf import ReportPdfModel, ReportDocumentEntry, ReportAnalytePoint, ReportAnalyteSeries
+
+logger = logging.getLogger(__name__)
+
+# Ограничение на количество одновременных генераций отчётов в процессе
+_report_semaphore = asyncio.Semaphore(settings.REPORT_GENERATION_CONCURRENCY)
+# Ссылки на фоновые задачи, чтобы их не собрал GC до завершения
+_background_tasks: set[asyncio.Task] = set()
+
+# С текстом LLM и без него (только таблицы и графики)
+REPORT_TYPE = "medical_history"
+REPORT_TYPE_STRUCTURED = "structured"
+
+_NUMBER = r"[-+]?\d+(?:[.,]\d+)?"
+_RANGE_RE = re.compile(rf"^\s*({_NUMBER})\s*[-–—]\s*({_NUMBER})\s*$")
+_UPPER_RE = re.compile(rf"^\s*(?:<|<=|≤|до)\s*({_NUMBER})\s*$")
+_LOWER_RE = re.compile(rf"^\s*(?:>|>=|≥|от)\s*({_NUMBER})\s*$")
+
+ACTIVE_STATUSES = (ReportStatus.pending.value, ReportStatus.processing.value)
+
+
+def _stale_before() -> datetime:
+    """Pending/processing reports not updated since then are considered orphaned"""
+    return datetime.now(timezone.utc) - timedelta(seconds=settings.REPORT_STALE_SECONDS)
 
-# Import PDF generation libraries
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.lib.enums import TA_CENTER, TA_LEFT
 
 class ReportService:
     
     @staticmethod
-    async def generate_report(
-        user_id: uuid.UUID,
-        filters: ReportFilters,
-        db: AsyncSession
-    ) -> Report:
-        """Generate PDF report based on filters"""
-        
-        # Fetch filtered documents
+    def canonical_filters(filters: ReportFilters) -> str:
+        """Filters as JSON with sorted keys, so equal filters give equal strings"""
+        return json.dumps(
+            filters.model_dump(mode="json"), sort_keys=True, ensure_ascii=False, separators=(",", ":")
+        )
+    
+    @staticmethod
+    def filters_hash(report_type: str, canonical_filters: str) -> str:
+        return hashlib.sha256(f"{report_type}:{canonical_filters}".encode("utf-8")).hexdigest()
+    
+    @staticmethod
+    def _documents_query(user_id: uuid.UUID, filters: ReportFilters):
         query = select(Document).where(Document.user_id == user_id)
         
         if filters.document_type:
@@ -48,141 +79,249 @@ class ReportService:
         if filters.medical_facility:
             query = query.where(Document.medical_facility == filters.medical_facility)
         
-        query = query.order_by(Document.document_date.asc())
-        result = await db.execute(query)
-        documents = list(result.scalars().all())
-        
-        if not documents:
-            raise ValueError("Нет документов, соответствующих выбранным фильтрам")
-        
-        # Generate report text using AI
-        report_text = await ai_service.generate_report_content(
-            documents,
-            filters.dict()
+        return query
+    
+    @staticmethod
+    async def request_report(
+        user_id: uuid.UUID,
+        filters: ReportFilters,
+        db: AsyncSession,
+        report_type: str = REPORT_TYPE
+    ) -> tuple[Report, bool]:
+        """Return an up-to-date report for these filters or queue a new one
+
+        Второе значение - True, если отчёт взят из уже существующих
+        (готовый или ещё генерируемый с теми же фильтрами и документами).
+        Генерация, не обновлявшаяся дольше REPORT_STALE_SECONDS, брошена
+        остановленным воркером и не переиспользуется.
+        """
+        
+        documents_query = ReportService._documents_query(user_id, filters).subquery()
+        result = await db.execute(
+            select(func.count(), func.max(documents_query.c.updated_at))
         )
+        documents_count, documents_updated_at = result.one()
         
-        # Create PDF
-        pdf_bytes = ReportService._create_pdf(report_text, documents)
-        
-        # Upload to MinIO
-        report_id = uuid.uuid4()
-        object_name = f"{user_id}/reports/{report_id}.pdf"
+        if not documents_count:
+            raise ValueError("Нет документов, соответствующих выбранным фильтрам")
         
-        minio_client.put_object(
-            bucket_name=settings.MINIO_BUCKET,
-            object_name=object_name,
-            data=BytesIO(pdf_bytes),
-            length=len(pdf_bytes),
-            content_type="application/pdf"
-        )
+        canonical = ReportService.canonical_filters(filters)
+        filters_hash = ReportService.filters_hash(report_type, canonical)
         
-        file_url = f"s3://{settings.MINIO_BUCKET}/{object_name}"
+        query = select(Report).where(
+            Report.user_id == user_id,
+            Report.filters_hash == filters_hash,
+            Report.documents_count == documents_count,
+            Report.documents_updated_at == documents_updated_at,
+            or_(
+                Report.status == ReportStatus.completed.value,
+                and_(Report.status.in_(ACTIVE_STATUSES), Report.updated_at >= _stale_before())
+            )
+        ).order_by(Report.created_at.desc()).limit(1)
+        existing = (await db.execute(query)).scalar_one_or_none()
+        if existing:
+            return existing, True
         
-        # Save report record
         report = Report(
-            id=report_id,
             user_id=user_id,
-            report_type="medical_history",
-            filters_applied=str(filters.dict()),
-            file_url=file_url,
-            file_size=len(pdf_bytes)
+            report_type=report_type,
+            status=ReportStatus.pending.value,
+            filters_applied=canonical,
+            filters_hash=filters_hash,
+            documents_count=documents_count,
+            documents_updated_at=documents_updated_at
         )
-        
         db.add(report)
         await db.commit()
         await db.refresh(report)
         
-        return report
+        ReportService._schedule_generation(report.id)
+        return report, False
     
     @staticmethod
-    def _create_pdf(text: str, documents: list) -> bytes:
-        """Generate PDF from report text"""
-        
-        buffer = BytesIO()
-        
-        # Create PDF document
-        doc = SimpleDocTemplate(
-            buffer,
-            pagesize=A4,
-            rightMargin=72,
-            leftMargin=72,
-            topMargin=72,
-            bottomMargin=18
-        )
-        
-        # Container for PDF elements
-        story = []
+    def _schedule_generation(report_id: uuid.UUID) -> None:
+        """Run report generation in the background"""
+        task = asyncio.create_task(ReportService._generate_report_background(report_id))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+    
+    @staticmethod
+    async def _generate_report_background(report_id: uuid.UUID) -> None:
+        """Generate the report using its own DB session"""
+        async with _report_semaphore:
+            async with AsyncSessionLocal() as db:
+                # Атомарно забрать отчёт из очереди
+                result = await db.execute(
+                    update(Report)
+                    .where(Report.id == report_id, Report.status == ReportStatus.pending.value)
+                    .values(status=ReportStatus.processing.value)
+                    .execution_options(synchronize_session=False)
+                )
+                await db.commit()
+                if result.rowcount == 0:
+                    return
+                report = await db.get(Report, report_id)
+                if report is None:
+                    return
+                try:
+                    await ReportService.generate_report(report, db)
+                except asyncio.CancelledError:
+                    # Остановка воркера: отчёт не должен остаться в processing
+                    await asyncio.shield(ReportService._mark_interrupted(report_id))
+                    raise
+                except Exception as e:
+                    logger.exception("Report generation failed for %s", report_id)
+                    await db.rollback()
+                    report = await db.get(Report, report_id)
+                    if report is None:
+                        return
+                    report.status = ReportStatus.failed.value
+                    report.error_message = str(e)
+                    await db.commit()
+    
+    @staticmethod
+    async def _mark_interrupted(report_id: uuid.UUID) -> None:
+        """Mark a cancelled report as failed so that a new request regenerates it"""
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(Report)
+                .where(Report.id == report_id, Report.status == ReportStatus.processing.value)
+                .values(status=ReportStatus.failed.value, error_message="Генерация прервана остановкой сервера")
+            )
+            await db.commit()
+    
+    @staticmethod
+    async def fail_stale_reports() -> int:
+        """Mark orphaned pending/processing reports as failed (called at startup)"""
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                update(Report)
+                .where(Report.status.in_(ACTIVE_STATUSES), Report.updated_at < _stale_before())
+                .values(status=ReportStatus.failed.value, error_message="Генерация прервана, повторите запрос")
+            )
+            await db.commit()
+        if result.rowcount:
+            logger.info("Зависшие отчёты помечены failed: %d", result.rowcount)
+        return result.rowcount
+    
+    @staticmethod
+    async def generate_report(report: Report, db: AsyncSession) -> Report:
+        """Generate the PDF for a claimed (processing) report and store it"""
         
-        # Get default styles
-        styles = getSampleStyleSheet()
+        # Fetch filtered documents
+        filters = ReportFilters(**json.loads(report.filters_applied))
+        query = ReportService._documents_query(report.user_id, filters).order_by(Document.document_date.asc())
+        result = await db.execute(query)
+        documents = list(result.scalars().all())
         
-        # Title
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=24,
-            textColor='#1F2937',
-            spaceAfter=30,
-            alignment=TA_CENTER
-        )
+        if not documents:
+            raise ValueError("Нет документов, соответствующих выбранным фильтрам")
         
-        story.append(Paragraph("Медицинская История", title_style))
-        story.append(Spacer(1, 0.2 * inch))
+        with trace_document(file_type="report"):
+            prompt_documents = await load_prompt_documents(documents)
+            
+            # Текст LLM - только для отчёта с описанием
+            report_text = None
+            if report.report_type != REPORT_TYPE_STRUCTURED:
+                with stage("report_content"):
+                    report_text = await ai_service.generate_report_content(
+                        documents,
+                        filters.dict()
+                    )
+            
+            # Create PDF
+            with stage("report_render"):
+                pdf_bytes = await ReportService._create_pdf(report_text, prompt_documents)
+            
+            # Upload to MinIO
+            object_name = f"{report.user_id}/reports/{report.id}.pdf"
+            
+            with stage("put_object"):
+                await asyncio.to_thread(
+                    minio_client.put_object,
+                    bucket_name=settings.MINIO_BUCKET,
+                    object_name=object_name,
+                    data=BytesIO(pdf_bytes),
+                    length=len(pdf_bytes),
+                    content_type="application/pdf"
+                )
+            
+            # Update report record
+            report.file_url = f"s3://{settings.MINIO_BUCKET}/{object_name}"
+            report.file_size = len(pdf_bytes)
+            report.status = ReportStatus.completed.value
+            report.completed_at = datetime.now(timezone.utc)
+            
+            with stage("postgres_commit"):
+                await db.commit()
         
-        # Add generation date
-        date_style = ParagraphStyle(
-            'DateStyle',
-            parent=styles['Normal'],
-            fontSize=10,
-            textColor='#6B7280',
-            alignment=TA_CENTER
+        return report
+    
+    @staticmethod
+    def _parse_reference_range(ref: Optional[str]) -> tuple[Optional[float], Optional[float]]:
+        """Bounds of ranges like 3.5-5.0, < 5 or > 1"""
+        if not ref:
+            return None, None
+        if match := _RANGE_RE.match(ref):
+            return to_number(match.group(1)), to_number(match.group(2))
+        if match := _UPPER_RE.match(ref):
+            return None, to_number(match.group(1))
+        if match := _LOWER_RE.match(ref):
+            return to_number(match.group(1)), None
+        return None, None
+    
+    @staticmethod
+    def _analyte_series(documents: list[PromptDocument]) -> list[ReportAnalyteSeries]:
+        """Per-analyte series; analytes with deviations come first"""
+        trends = sorted(
+            build_trends(documents),
+            key=lambda trend: (not trend.latest_abnormal, not trend.any_abnormal)
         )
-        story.append(Paragraph(
-            f"Отчёт сгенерирован: {datetime.now().strftime('%d.%m.%Y %H:%M')}",
-            date_style
-        ))
-        story.append(Spacer(1, 0.3 * inch))
-        
-        # Add report text
-        body_style = ParagraphStyle(
-            'BodyStyle',
-            parent=styles['BodyText'],
-            fontSize=11,
-            leading=14,
-            textColor='#1F2937'
+        series = []
+        for trend in trends:
+            # Референс последнего измерения, в котором он указан
+            reference = next((point[3] for point in reversed(trend.points) if point[3]), None)
+            low, high = ReportService._parse_reference_range(reference)
+            series.append(ReportAnalyteSeries(
+                name=trend.name,
+                unit=trend.unit,
+                reference_range=reference,
+                reference_low=low,
+                reference_high=high,
+                points=[
+                    ReportAnalytePoint(
+                        document_date=point_date.isoformat() if point_date else None,
+                        value="—" if value is None else str(value),
+                        numeric_value=to_number(value),
+                        flag=flag
+                    )
+                    for point_date, value, flag, _ in trend.points
+                ]
+            ))
+        return series
+    
+    @staticmethod
+    async def _create_pdf(text: Optional[str], documents: list[PromptDocument]) -> bytes:
+        """Generate PDF from report text and stored lab data in the process pool"""
+        
+        model = ReportPdfModel(
+            text=text,
+            generated_at=datetime.now().strftime('%d.%m.%Y %H:%M'),
+            documents=[
+                ReportDocumentEntry(
+                    document_date=doc.document_date.strftime('%d.%m.%Y') if doc.document_date else None,
+                    document_type=doc.document_type,
+                    medical_facility=doc.medical_facility,
+                    document_subtype=doc.document_subtype,
+                    analytes_count=len(doc.analytes),
+                    abnormal_count=sum(1 for analyte in doc.analytes if analyte.get("flag") in ABNORMAL_FLAGS)
+                )
+                for doc in documents
+            ],
+            analytes=ReportService._analyte_series(documents),
+            max_charts=settings.REPORT_MAX_CHARTS
         )
-        
-        # Split text into paragraphs and add to PDF
-        paragraphs = text.split('\n\n')
-        for para in paragraphs:
-            if para.strip():
-                # Check if it's a heading (starts with #)
-                if para.strip().startswith('#'):
-                    para_text = para.replace('#', '').strip()
-                    story.append(Paragraph(para_text, styles['Heading2']))
-                else:
-                    story.append(Paragraph(para.strip(), body_style))
-                story.append(Spacer(1, 0.1 * inch))
-        
-        # Add document list
-        story.append(PageBreak())
-        story.append(Paragraph("Использованные документы", styles['Heading2']))
-        story.append(Spacer(1, 0.2 * inch))
-        
-        for doc in documents:
-            doc_date = doc.document_date.strftime('%d.%m.%Y') if doc.document_date else 'Дата не указана'
-            doc_text = f"• {doc_date} - {doc.document_type or 'Тип не указан'} - {doc.medical_facility or 'Учреждение не указано'}"
-            story.append(Paragraph(doc_text, body_style))
-            story.append(Spacer(1, 0.05 * inch))
-        
-        # Build PDF
-        doc.build(story)
-        
-        # Get PDF bytes
-        pdf_bytes = buffer.getvalue()
-        buffer.close()
-        
-        return pdf_bytes
+        return await run_in_process(report_pdf_worker.render_report_pdf, model)
     
     @staticmethod
     async def get_reports(
@@ -0,0 +1,219 @@
+"""
+Массовая повторная экстракция результатов анализов.
+
+Нужна, когда меняется промпт `_build_labs_extraction_prompt` или модель
+OPENROUTER_MODEL: документы выбираются по типу, дате и версии модели/промпта,
+файлы по одному читаются из MinIO и заново проходят через
+LabAnalysisService.analyze_labs_for_document.
+
+Состояние задания хранится в MongoDB (коллекция reprocessing_jobs):
+фильтры, счётчики и последний обработанный document_id. Документы обходятся
+в порядке id, поэтому прерванное задание продолжается с того же места.
+"""
+
+import asyncio
+import time
+import uuid
+from datetime import datetime, date
+from typing import Optional, Callable
+
+from sqlalchemy import select, func
+
+from app.models.document import Document
+from app.db.postgres import AsyncSessionLocal
+from app.db.mongodb import document_metadata_collection, reprocessing_jobs_collection
+from app.services.ai_service import ai_service
+from app.services.document_service import DocumentService
+from app.services.lab_analysis_service import LabAnalysisService
+from app.core.config import settings
+
+LAB_DOCUMENT_TYPE = "Результаты анализа"
+
+
+class ReprocessingService:
+    """Задания повторной экстракции анализов с контрольными точками"""
+
+    @staticmethod
+    async def create_job(
+        document_type: Optional[str] = LAB_DOCUMENT_TYPE,
+        date_from: Optional[date] = None,
+        date_to: Optional[date] = None,
+        model: Optional[str] = None,
+        outdated_only: bool = False,
+        user_id: Optional[uuid.UUID] = None,
+    ) -> str:
+        """Create a job record and return its id
+
+        - model: only documents whose last lab extraction used this model
+        - outdated_only: only documents extracted with a model or prompt
+          version different from the current ones (or never extracted)
+        """
+        job_id = str(uuid.uuid4())
+        now = datetime.utcnow()
+        await reprocessing_jobs_collection.insert_one({
+            "job_id": job_id,
+            "status": "created",
+            "filters": {
+                "document_type": document_type,
+                "date_from": date_from.isoformat() if date_from else None,
+                "date_to": date_to.isoformat() if date_to else None,
+                "model": model,
+                "outdated_only": outdated_only,
+                "user_id": str(user_id) if user_id else None,
+            },
+            "target": {
+                "model": settings.OPENROUTER_MODEL,
+                "prompt_version": ai_service.labs_prompt_version,
+            },
+            "total": None,
+            "processed": 0,
+            "succeeded": 0,
+            "failed": 0,
+            "skipped": 0,
+            "last_document_id": None,
+            "errors": [],
+            "created_at": now,
+            "updated_at": now,
+        })
+        return job_id
+
+    @staticmethod
+    async def get_job(job_id: str) -> Optional[dict]:
+        return await reprocessing_jobs_collection.find_one({"job_id": job_id}, {"_id": 0})
+
+    @staticmethod
+    def _apply_filters(query, filters: dict):
+        if filters.get("document_type"):
+            query = query.where(Document.document_type == filters["document_type"])
+        if filters.get("date_from"):
+            query = query.where(Document.document_date >= date.fromisoformat(filters["date_from"]))
+        if filters.get("date_to"):
+            query = query.where(Document.document_date <= date.fromisoformat(filters["date_to"]))
+        if filters.get("user_id"):
+            query = query.where(Document.user_id == uuid.UUID(filters["user_id"]))
+        return query
+
+    @staticmethod
+    def _needs_reprocessing(mongo_doc: Optional[dict], filters: dict, target: dict) -> bool:
+        """Check model/prompt version of the last extraction against the job filters"""
+        labs_info = (mongo_doc or {}).get("ai_response_labs") or {}
+        if filters.get("model") and labs_info.get("model") != filters["model"]:
+            return False
+        if filters.get("outdated_only"):
+            return (
+                labs_info.get("model") != target["model"]
+                or labs_info.get("prompt_version") != target["prompt_version"]
+            )
+        return True
+
+    @staticmethod
+    async def run_job(
+        job_id: str,
+        batch_size: int = 50,
+        requests_per_minute: Optional[int] = None,
+        on_progress: Optional[Callable[[dict], None]] = None,
+    ) -> dict:
+        """Run (or resume) a job until all matching documents are processed"""
+        job = await ReprocessingService.get_job(job_id)
+        if not job:
+            raise ValueError(f"Задание {job_id} не найдено")
+        if job["status"] == "completed":
+            return job
+
+        filters = job["filters"]
+        target = job["target"]
+        rpm = requests_per_minute or settings.REPROCESS_REQUESTS_PER_MINUTE
+        min_interval = 60.0 / rpm if rpm > 0 else 0.0
+        last_call = 0.0
+
+        async with AsyncSessionLocal() as db:
+            if job["total"] is None:
+                count_query = ReprocessingService._apply_filters(
+                    select(func.count(Document.id)), filters
+                )
+                job["total"] = (await db.execute(count_query)).scalar_one()
+
+            await reprocessing_jobs_collection.update_one(
+                {"job_id": job_id},
+                {"$set": {"status": "running", "total": job["total"], "updated_at": datetime.utcnow()}}
+            )
+
+            last_id = uuid.UUID(job["last_document_id"]) if job["last_document_id"] else None
+
+            while True:
+                query = ReprocessingService._apply_filters(select(Document), filters)
+                if last_id is not None:
+                    query = query.where(Document.id > last_id)
+                query = query.order_by(Document.id).limit(batch_size)
+                documents = list((await db.execute(query)).scalars().all())
+                if not documents:
+                    break
+
+                cursor = document_metadata_collection.find(
+                    {"document_id": {"$in": [str(doc.id) for doc in documents]}},
+                    {"document_id": 1, "ai_response_labs": 1}
+                )
+                mongo_by_id = {m["document_id"]: m async for m in cursor}
+
+                errors = []
+                for document in documents:
+                    job["processed"] += 1
+                    if not ReprocessingService._needs_reprocessing(
+                        mongo_by_id.get(str(document.id)), filters, target
+                    ):
+                        job["skipped"] += 1
+                        continue
+
+                    # Равномерно распределяем запросы к LLM
+                    wait = last_call + min_interval - time.monotonic()
+                    if wait > 0:
+                        await asyncio.sleep(wait)
+                    last_call = time.monotonic()
+
+                    try:
+                        file_bytes = await asyncio.to_thread(
+                            DocumentService.get_file_from_minio, document.file_url
+                        )
+                        await LabAnalysisService.analyze_labs_for_document(
+                            document=document,
+                            file_bytes=file_bytes,
+                            file_ext=document.file_type,
+                            db=db,
+                            source="reprocess",
+                        )
+                        job["succeeded"] += 1
+                    except Exception as e:
+                        job["failed"] += 1
+                        errors.append({"document_id": str(document.id), "error": str(e)})
+
+                last_id = documents[-1].id
+                # Контрольная точка после каждой пачки
+                update = {
+                    "$set": {
+                        "processed": job["processed"],
+                        "succeeded": job["succeeded"],
+                        "failed": job["failed"],
+                        "skipped": job["skipped"],
+                        "last_document_id": str(last_id),
+                        "updated_at": datetime.utcnow(),
+                    }
+                }
+                if errors:
+                    update["$push"] = {"errors": {"$each": errors, "$slice": -100}}
+                await reprocessing_jobs_collection.update_one({"job_id": job_id}, update)
+
+                if on_progress:
+                    on_progress(job)
+
+        await reprocessing_jobs_collection.update_one(
+            {"job_id": job_id},
+            {"$set": {"status": "completed", "completed_at": datetime.utcnow(), "updated_at": datetime.utcnow()}}
+        )
+        return await ReprocessingService.get_job(job_id)
+
+    @staticmethod
+    async def mark_interrupted(job_id: str) -> None:
+        await reprocessing_jobs_collection.update_one(
+            {"job_id": job_id},
+            {"$set": {"status": "interrupted", "updated_at": datetime.utcnow()}}
+        )
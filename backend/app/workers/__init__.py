@@ -0,0 +1 @@
+# CPU-bound functions executed in the shared process pool (app.core.process_pool)
@@ -0,0 +1,63 @@
+"""Image pre-processing for vision prompts, executed in worker processes"""
+
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+# Порог яркости, выше которого пиксель считается бумагой
+_PAPER_THRESHOLD = 150
+_CROP_PROBE_SIZE = 512
+_CROP_MARGIN = 0.02
+
+
+def _document_bbox(image: Image.Image):
+    """Find the bright paper area on a darker background; None if nothing to crop"""
+    probe = image.convert("L")
+    probe.thumbnail((_CROP_PROBE_SIZE, _CROP_PROBE_SIZE))
+    probe = ImageOps.autocontrast(probe)
+    mask = probe.point(lambda p: 255 if p > _PAPER_THRESHOLD else 0)
+    bbox = mask.getbbox()
+    if not bbox:
+        return None
+
+    scale_x = image.width / probe.width
+    scale_y = image.height / probe.height
+    left, top, right, bottom = bbox
+    box_area = (right - left) * (bottom - top)
+    probe_area = probe.width * probe.height
+    # Обрезаем только если фон заметный, а найденная область похожа на лист
+    if box_area < 0.3 * probe_area or box_area > 0.95 * probe_area:
+        return None
+
+    margin_x = image.width * _CROP_MARGIN
+    margin_y = image.height * _CROP_MARGIN
+    return (
+        max(0, int(left * scale_x - margin_x)),
+        max(0, int(top * scale_y - margin_y)),
+        min(image.width, int(right * scale_x + margin_x)),
+        min(image.height, int(bottom * scale_y + margin_y)),
+    )
+
+
+def prepare_for_vision(
+    file_bytes: bytes,
+    max_long_edge: int = 2000,
+    grayscale: bool = True,
+    jpeg_quality: int = 80,
+) -> bytes:
+    """EXIF-rotate, crop to the document, downscale, optionally grayscale; return JPEG bytes"""
+    image = Image.open(BytesIO(file_bytes))
+    image = ImageOps.exif_transpose(image)
+
+    bbox = _document_bbox(image)
+    if bbox:
+        image = image.crop(bbox)
+
+    if max(image.size) > max_long_edge:
+        image.thumbnail((max_long_edge, max_long_edge), Image.LANCZOS)
+
+    image = image.convert("L") if grayscale else image.convert("RGB")
+
+    output = BytesIO()
+    image.save(output, format="JPEG", quality=jpeg_quality, optimize=True)
+    return output.getvalue()
@@ -0,0 +1,47 @@
+"""PDF text extraction executed in worker processes"""
+
+from io import BytesIO
+from typing import Optional
+
+import PyPDF2
+
+
+def count_pages(file_bytes: bytes) -> int:
+    """Return number of pages in the PDF"""
+    return len(PyPDF2.PdfReader(BytesIO(file_bytes)).pages)
+
+
+def extract_pages(file_bytes: bytes, start: int = 0, end: Optional[int] = None) -> list[str]:
+    """Extract text of pages [start, end), one string per page"""
+    reader = PyPDF2.PdfReader(BytesIO(file_bytes))
+    pages = reader.pages
+    end = len(pages) if end is None else min(end, len(pages))
+    return [(pages[i].extract_text() or "") for i in range(start, end)]
+
+
+def rasterize_pages(
+    file_bytes: bytes,
+    start: int,
+    end: int,
+    dpi: int = 150,
+    max_long_edge: int = 2000,
+    grayscale: bool = True,
+    jpeg_quality: int = 80,
+) -> list[bytes]:
+    """Render pages [start, end) of a scanned PDF to compact JPEGs for the vision model"""
+    import fitz  # PyMuPDF
+
+    from app.workers.image import prepare_for_vision
+
+    images = []
+    with fitz.open(stream=file_bytes, filetype="pdf") as pdf:
+        end = min(end, pdf.page_count)
+        for page_num in range(start, end):
+            pixmap = pdf[page_num].get_pixmap(dpi=dpi)
+            images.append(prepare_for_vision(
+                pixmap.tobytes("png"),
+                max_long_edge=max_long_edge,
+                grayscale=grayscale,
+                jpeg_quality=jpeg_quality,
+            ))
+    return images
@@ -0,0 +1,311 @@
+"""PDF rendering of medical history reports, executed in worker processes"""
+
+import os
+from dataclasses import dataclass, field
+from datetime import date
+from io import BytesIO
+from typing import Optional
+from xml.sax.saxutils import escape
+
+from reportlab.graphics.charts.lineplots import LinePlot
+from reportlab.graphics.shapes import Drawing
+from reportlab.graphics.widgets.markers import makeMarker
+from reportlab.lib import colors
+from reportlab.lib.enums import TA_CENTER
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.units import inch
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak, Table, TableStyle, KeepTogether
+
+# Шрифты с кириллицей; встроенная Helvetica её не содержит
+_FONT_CANDIDATES = [
+    ("DejaVuSans", "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"),
+    ("DejaVuSans-Bold", "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"),
+]
+
+_CONTENT_WIDTH = A4[0] - 2 * 72
+_FLAG_TEXT = {"L": "↓ ниже нормы", "H": "↑ выше нормы", "A": "‼ критично"}
+_ABNORMAL_COLOR = colors.HexColor('#B91C1C')
+_GRID_COLOR = colors.HexColor('#D1D5DB')
+_HEADER_BACKGROUND = colors.HexColor('#F3F4F6')
+_LINE_COLOR = colors.HexColor('#2563EB')
+_REFERENCE_COLOR = colors.HexColor('#9CA3AF')
+
+# Стили создаются один раз на процесс пула
+_styles: Optional[dict] = None
+
+
+@dataclass
+class ReportDocumentEntry:
+    document_date: Optional[str]  # dd.mm.yyyy
+    document_type: Optional[str]
+    medical_facility: Optional[str]
+    document_subtype: Optional[str] = None
+    analytes_count: int = 0
+    abnormal_count: int = 0
+
+
+@dataclass
+class ReportAnalytePoint:
+    document_date: Optional[str]  # ISO date
+    value: str
+    numeric_value: Optional[float]
+    flag: Optional[str]
+
+
+@dataclass
+class ReportAnalyteSeries:
+    name: str
+    unit: Optional[str]
+    reference_range: Optional[str]
+    reference_low: Optional[float]
+    reference_high: Optional[float]
+    points: list[ReportAnalytePoint] = field(default_factory=list)
+
+
+@dataclass
+class ReportPdfModel:
+    """Everything the renderer needs; plain data so it can be sent to a worker process"""
+    generated_at: str  # dd.mm.yyyy HH:MM
+    text: Optional[str] = None  # LLM narrative; None - раздел не выводится
+    documents: list[ReportDocumentEntry] = field(default_factory=list)
+    analytes: list[ReportAnalyteSeries] = field(default_factory=list)
+    max_charts: int = 30
+
+
+def _register_fonts() -> tuple[str, str]:
+    registered = {}
+    for name, path in _FONT_CANDIDATES:
+        if os.path.exists(path):
+            pdfmetrics.registerFont(TTFont(name, path))
+            registered[name] = True
+    if "DejaVuSans" not in registered:
+        return "Helvetica", "Helvetica-Bold"
+    return "DejaVuSans", "DejaVuSans-Bold" if "DejaVuSans-Bold" in registered else "DejaVuSans"
+
+
+def _get_styles() -> dict:
+    global _styles
+    if _styles is not None:
+        return _styles
+
+    regular, bold = _register_fonts()
+    sample = getSampleStyleSheet()
+    _styles = {
+        "font": regular,
+        "font_bold": bold,
+        "title": ParagraphStyle(
+            'CustomTitle',
+            parent=sample['Heading1'],
+            fontName=bold,
+            fontSize=24,
+            textColor='#1F2937',
+            spaceAfter=30,
+            alignment=TA_CENTER
+        ),
+        "date": ParagraphStyle(
+            'DateStyle',
+            parent=sample['Normal'],
+            fontName=regular,
+            fontSize=10,
+            textColor='#6B7280',
+            alignment=TA_CENTER
+        ),
+        "heading": ParagraphStyle(
+            'HeadingStyle',
+            parent=sample['Heading2'],
+            fontName=bold,
+        ),
+        "subheading": ParagraphStyle(
+            'SubheadingStyle',
+            parent=sample['Heading3'],
+            fontName=bold,
+        ),
+        "body": ParagraphStyle(
+            'BodyStyle',
+            parent=sample['BodyText'],
+            fontName=regular,
+            fontSize=11,
+            leading=14,
+            textColor='#1F2937'
+        ),
+        "cell": ParagraphStyle(
+            'CellStyle',
+            parent=sample['BodyText'],
+            fontName=regular,
+            fontSize=9,
+            leading=11,
+        ),
+        "cell_abnormal": ParagraphStyle(
+            'CellAbnormalStyle',
+            parent=sample['BodyText'],
+            fontName=bold,
+            fontSize=9,
+            leading=11,
+            textColor=_ABNORMAL_COLOR,
+        ),
+    }
+    return _styles
+
+
+def _table(rows: list[list], col_widths: list[float], styles: dict) -> Table:
+    table = Table(rows, colWidths=col_widths, repeatRows=1)
+    table.setStyle(TableStyle([
+        ('FONTNAME', (0, 0), (-1, 0), styles["font_bold"]),
+        ('FONTSIZE', (0, 0), (-1, 0), 9),
+        ('BACKGROUND', (0, 0), (-1, 0), _HEADER_BACKGROUND),
+        ('GRID', (0, 0), (-1, -1), 0.5, _GRID_COLOR),
+        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+    ]))
+    return table
+
+
+def _cell(text, styles: dict, abnormal: bool = False) -> Paragraph:
+    return Paragraph(escape(str(text)), styles["cell_abnormal" if abnormal else "cell"])
+
+
+def _timeline(documents: list[ReportDocumentEntry], styles: dict) -> Table:
+    rows = [["Дата", "Документ", "Учреждение", "Показатели"]]
+    for entry in documents:
+        kind = entry.document_type or "Тип не указан"
+        if entry.document_subtype:
+            kind += f" / {entry.document_subtype}"
+        analytes = str(entry.analytes_count) if entry.analytes_count else "—"
+        if entry.abnormal_count:
+            analytes += f" (отклонений: {entry.abnormal_count})"
+        rows.append([
+            _cell(entry.document_date or "—", styles),
+            _cell(kind, styles),
+            _cell(entry.medical_facility or "—", styles),
+            _cell(analytes, styles, abnormal=bool(entry.abnormal_count)),
+        ])
+    width = _CONTENT_WIDTH
+    return _table(rows, [width * 0.16, width * 0.40, width * 0.28, width * 0.16], styles)
+
+
+def _chart(series: ReportAnalyteSeries, styles: dict) -> Optional[Drawing]:
+    """Line chart of numeric dated values with the reference range as dashed lines"""
+    points = [
+        (date.fromisoformat(point.document_date).toordinal(), point.numeric_value)
+        for point in series.points
+        if point.document_date and point.numeric_value is not None
+    ]
+    if len({x for x, _ in points}) < 2:
+        return None
+
+    xs = [x for x, _ in points]
+    ys = [y for _, y in points]
+    for bound in (series.reference_low, series.reference_high):
+        if bound is not None:
+            ys.append(bound)
+    y_min, y_max = min(ys), max(ys)
+    padding = (y_max - y_min) * 0.1 or abs(y_max) * 0.1 or 1
+
+    drawing = Drawing(_CONTENT_WIDTH, 150)
+    plot = LinePlot()
+    plot.x, plot.y = 45, 25
+    plot.width, plot.height = _CONTENT_WIDTH - 60, 110
+
+    data = [points]
+    for bound in (series.reference_low, series.reference_high):
+        if bound is not None:
+            data.append([(min(xs), bound), (max(xs), bound)])
+    plot.data = data
+
+    plot.lines[0].strokeColor = _LINE_COLOR
+    plot.lines[0].strokeWidth = 1.5
+    plot.lines[0].symbol = makeMarker('FilledCircle', size=4)
+    for index in range(1, len(data)):
+        plot.lines[index].strokeColor = _REFERENCE_COLOR
+        plot.lines[index].strokeDashArray = (3, 3)
+
+    plot.xValueAxis.valueMin = min(xs)
+    plot.xValueAxis.valueMax = max(xs)
+    plot.xValueAxis.labelTextFormat = lambda value: date.fromordinal(int(value)).strftime('%m.%y')
+    plot.xValueAxis.labels.fontName = styles["font"]
+    plot.xValueAxis.labels.fontSize = 7
+    plot.yValueAxis.valueMin = y_min - padding
+    plot.yValueAxis.valueMax = y_max + padding
+    plot.yValueAxis.labels.fontName = styles["font"]
+    plot.yValueAxis.labels.fontSize = 7
+
+    drawing.add(plot)
+    return drawing
+
+
+def _analyte_section(series: ReportAnalyteSeries, styles: dict, with_chart: bool) -> KeepTogether:
+    title = f"{series.name}, {series.unit}" if series.unit else series.name
+    if series.reference_range:
+        title += f" (референс: {series.reference_range})"
+    flowables = [Paragraph(escape(title), styles["subheading"])]
+
+    if with_chart:
+        chart = _chart(series, styles)
+        if chart is not None:
+            flowables.append(chart)
+
+    rows = [["Дата", "Значение", "Оценка"]]
+    for point in series.points:
+        abnormal = point.flag in _FLAG_TEXT
+        rows.append([
+            _cell(date.fromisoformat(point.document_date).strftime('%d.%m.%Y') if point.document_date else "—", styles),
+            _cell(point.value, styles, abnormal=abnormal),
+            _cell(_FLAG_TEXT.get(point.flag, "норма" if point.flag == "N" else "—"), styles, abnormal=abnormal),
+        ])
+    width = _CONTENT_WIDTH
+    flowables.append(_table(rows, [width * 0.25, width * 0.35, width * 0.40], styles))
+    flowables.append(Spacer(1, 0.2 * inch))
+    return KeepTogether(flowables)
+
+
+def render_report_pdf(model: ReportPdfModel) -> bytes:
+    """Build the report PDF"""
+    styles = _get_styles()
+    buffer = BytesIO()
+
+    doc = SimpleDocTemplate(
+        buffer,
+        pagesize=A4,
+        rightMargin=72,
+        leftMargin=72,
+        topMargin=72,
+        bottomMargin=18
+    )
+
+    story = [
+        Paragraph("Медицинская История", styles["title"]),
+        Spacer(1, 0.2 * inch),
+        Paragraph(f"Отчёт сгенерирован: {model.generated_at}", styles["date"]),
+        Spacer(1, 0.3 * inch),
+    ]
+
+    # Абзацы отчёта LLM; строки, начинающиеся с #, - заголовки
+    if model.text:
+        for para in model.text.split('\n\n'):
+            if para.strip():
+                if para.strip().startswith('#'):
+                    story.append(Paragraph(escape(para.replace('#', '').strip()), styles["heading"]))
+                else:
+                    story.append(Paragraph(escape(para.strip()), styles["body"]))
+                story.append(Spacer(1, 0.1 * inch))
+        story.append(PageBreak())
+
+    # Хронология документов
+    story.append(Paragraph("Хронология документов", styles["heading"]))
+    story.append(Spacer(1, 0.2 * inch))
+    story.append(_timeline(model.documents, styles))
+
+    # Динамика показателей: сначала с отклонениями (порядок задаёт вызывающий код)
+    if model.analytes:
+        story.append(PageBreak())
+        story.append(Paragraph("Результаты анализов", styles["heading"]))
+        story.append(Spacer(1, 0.2 * inch))
+        for index, series in enumerate(model.analytes):
+            story.append(_analyte_section(series, styles, with_chart=index < model.max_charts))
+
+    doc.build(story)
+    pdf_bytes = buffer.getvalue()
+    buffer.close()
+    return pdf_bytes
@@ -1,3 +1,7 @@
+import asyncio
+import logging
+import os
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
@@ -8,6 +12,15 @@ from app.core.config import settings
 from app.db.postgres import engine, Base, AsyncSessionLocal
 from app.db.mongodb import mongodb_client
 from app.db.minio_client import minio_client, ensure_bucket_exists
+from app.db.business_counters import install_business_counters
+from app.db.schema_updates import apply_schema_updates
+from app.db.mongo_indexes import ensure_indexes
+from app.core.process_pool import shutdown_process_pool
+from app.core.logging_config import configure_logging, shutdown_logging, RequestIdMiddleware
+from app.services.business_metrics_service import BusinessMetricsService
+from app.services.interpretation_service import interpretation_service
+from app.services.document_service import DocumentService
+from app.services.report_service import ReportService
 
 # Import models to register them with SQLAlchemy
 from app.models.user import User
@@ -21,15 +34,25 @@ from app.models.analyte import (
 # Import analyte normalization service
 from app.services.analyte_normalization_service_db import analyte_normalization_service_db
 
+configure_logging()
+logger = logging.getLogger("app.main")
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Startup and shutdown events"""
     # Startup
-    print("🚀 Starting MedHistory API...")
+    logger.info("Starting MedHistory API")
     
     # Create database tables
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+    async with engine.begin() as conn:
+        await apply_schema_updates(conn)
+    async with engine.begin() as conn:
+        await install_business_counters(conn)
+    
+    # MongoDB indexes are built in the background; startup does not wait for them
+    mongo_indexes_task = asyncio.create_task(ensure_indexes())
     
     # Initialize MinIO bucket
     ensure_bucket_exists()
@@ -40,21 +63,49 @@ async def lifespan(app: FastAPI):
             await analyte_normalization_service_db.load_from_db(db)
             stats = analyte_normalization_service_db.get_stats()
             if stats["categories_count"] > 0:
-                print(f"✅ Справочник анализов загружен: {stats['categories_count']} категорий, "
-                      f"{stats['analytes_count']} анализов, {stats['synonyms_count']} синонимов")
+                logger.info(
+                    "Справочник анализов загружен: %d категорий, %d анализов, %d синонимов",
+                    stats["categories_count"], stats["analytes_count"], stats["synonyms_count"]
+                )
             else:
-                print("⚠️ Справочник анализов пуст! Выполните: python scripts/seed_analyte_mappings.py")
+                logger.warning("Справочник анализов пуст! Выполните: python scripts/seed_analyte_mappings.py")
+    except Exception as e:
+        logger.warning(
+            "Не удалось загрузить справочник анализов: %s. "
+            "Выполните миграцию и seed: python scripts/seed_analyte_mappings.py", e
+        )
+    
+    # Фоновые генерации не переживают рестарт: зависшие записи помечаются failed
+    try:
+        await interpretation_service.fail_stale_interpretations()
+    except Exception as e:
+        logger.warning("Не удалось обработать зависшие интерпретации: %s", e)
+    try:
+        await ReportService.fail_stale_reports()
     except Exception as e:
-        print(f"⚠️ Не удалось загрузить справочник анализов: {e}")
-        print("   Выполните миграцию и seed: python scripts/seed_analyte_mappings.py")
+        logger.warning("Не удалось обработать зависшие отчёты: %s", e)
+    try:
+        await DocumentService.fail_stale_processing()
+    except Exception as e:
+        logger.warning("Не удалось обработать зависшие документы: %s", e)
+    
+    logger.info("Database and storage initialized")
     
-    print("✅ Database and storage initialized")
+    # Business gauges: initial values and periodic refresh (see business_metrics_service)
+    business_metrics_task = asyncio.create_task(BusinessMetricsService.run_periodic_refresh())
     
     yield
     
     # Shutdown
-    print("🛑 Shutting down MedHistory API...")
+    logger.info("Shutting down MedHistory API")
+    business_metrics_task.cancel()
+    mongo_indexes_task.cancel()
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(os.getpid())
+    shutdown_process_pool()
     mongodb_client.close()
+    shutdown_logging()
 
 app = FastAPI(
     title="MedHistory API",
@@ -75,6 +126,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request ID correlation for logs (X-Request-ID)
+app.add_middleware(RequestIdMiddleware)
+
 # Include API router
 app.include_router(api_router, prefix="/api/v1")
 
@@ -0,0 +1,535 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный бенчмарк основных эндпоинтов API.
+
+Сценарии (синтетический пользователь на каждый масштаб):
+- docs10     - 10 документов
+- docs1k     - 1 000 документов
+- docs10k    - 10 000 документов
+- labs100k   - 100 000 результатов анализов (2 000 документов по 50 показателей)
+
+Каждый пользователь получает двух членов семьи, документы в PostgreSQL,
+метаданные и анализы в MongoDB и файлы в MinIO.
+
+Измеряются p50/p90/p99 задержки и пропускная способность для:
+/documents/, /documents/labs/timeseries, /documents/labs/analytes,
+/timeline/, /timeline/stats, /family/profiles и загрузки документа.
+Загрузка выполняется с заглушкой LLM (AI_BACKEND=mock), поэтому в
+нагрузку входят MinIO, разбор PDF, валидация ответа и запись в БД.
+
+Запуск внутри контейнера backend:
+    python scripts/benchmark_api.py seed --scale docs1k
+    python scripts/benchmark_api.py run --scale docs10 docs1k --output bench.json
+    python scripts/benchmark_api.py run --scale docs1k --compare bench-main.json
+    python scripts/benchmark_api.py cleanup
+
+По умолчанию приложение поднимается в этом же процессе (ASGI, без сети)
+с AI_BACKEND=mock. Для замера запущенного сервера: --base-url http://localhost:8000
+(тогда сервер должен быть запущен с AI_BACKEND=mock или с отдельной
+заглушкой, см. scripts/mock_openrouter.py).
+"""
+
+import os
+import sys
+import io
+import json
+import time
+import random
+import asyncio
+import argparse
+import subprocess
+import statistics
+import uuid
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+# LLM в бенчмарке всегда заглушка, если явно не указано иное
+os.environ.setdefault("AI_BACKEND", "mock")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from sqlalchemy import insert, select, delete
+
+from app.core.config import settings
+from app.core.security import create_access_token
+from app.db.postgres import AsyncSessionLocal
+from app.db.mongodb import document_metadata_collection
+from app.db.minio_client import minio_client, ensure_bucket_exists
+from app.models.user import User, GenderEnum
+from app.models.document import Document
+from app.models.family import FamilyRelation, RelationType
+
+BENCH_EMAIL_DOMAIN = "bench.medhistory.local"
+
+SCALES = {
+    "docs10": {"documents": 10, "labs_per_document": 10},
+    "docs1k": {"documents": 1_000, "labs_per_document": 10},
+    "docs10k": {"documents": 10_000, "labs_per_document": 10},
+    "labs100k": {"documents": 2_000, "labs_per_document": 50},
+}
+
+DOCUMENT_TYPES = [
+    ("Результаты анализа", 0.5),
+    ("Прием врача", 0.25),
+    ("Инструментальное исследование", 0.15),
+    ("Выписка", 0.05),
+    ("Другое", 0.05),
+]
+FACILITIES = ["Инвитро", "Гемотест", "Поликлиника №1", "Городская больница", "Медси"]
+SPECIALTIES = ["Терапия", "Кардиология", "Эндокринология", "Гастроэнтерология", "Неврология"]
+
+# (название, единица, нижняя граница, верхняя граница)
+ANALYTES = [
+    ("Гемоглобин", "г/л", 120, 160), ("Эритроциты", "10^12/л", 3.9, 5.5),
+    ("Лейкоциты", "10^9/л", 4.0, 9.0), ("Тромбоциты", "10^9/л", 150, 400),
+    ("Гематокрит", "%", 36, 48), ("СОЭ", "мм/ч", 2, 15),
+    ("Нейтрофилы", "%", 47, 72), ("Лимфоциты", "%", 19, 37),
+    ("Моноциты", "%", 3, 11), ("Эозинофилы", "%", 0.5, 5),
+    ("Глюкоза", "ммоль/л", 3.9, 6.1), ("Холестерин общий", "ммоль/л", 3.0, 5.2),
+    ("ЛПНП", "ммоль/л", 1.0, 3.0), ("ЛПВП", "ммоль/л", 1.0, 2.2),
+    ("Триглицериды", "ммоль/л", 0.5, 1.7), ("АЛТ", "Ед/л", 5, 41),
+    ("АСТ", "Ед/л", 5, 40), ("Билирубин общий", "мкмоль/л", 3.4, 20.5),
+    ("Креатинин", "мкмоль/л", 62, 106), ("Мочевина", "ммоль/л", 2.5, 8.3),
+    ("Мочевая кислота", "мкмоль/л", 200, 420), ("Общий белок", "г/л", 64, 83),
+    ("Альбумин", "г/л", 35, 52), ("Ферритин", "мкг/л", 20, 250),
+    ("Железо", "мкмоль/л", 11, 30), ("ТТГ", "мЕд/л", 0.4, 4.0),
+    ("Т4 свободный", "пмоль/л", 9, 19), ("Витамин D", "нг/мл", 30, 100),
+    ("Витамин B12", "пг/мл", 190, 900), ("С-реактивный белок", "мг/л", 0, 5),
+    ("Гликированный гемоглобин", "%", 4.0, 6.0), ("Калий", "ммоль/л", 3.5, 5.1),
+    ("Натрий", "ммоль/л", 136, 145), ("Кальций", "ммоль/л", 2.15, 2.55),
+    ("Магний", "ммоль/л", 0.66, 1.07), ("Фосфор", "ммоль/л", 0.81, 1.45),
+    ("Щелочная фосфатаза", "Ед/л", 40, 130), ("ГГТ", "Ед/л", 8, 61),
+    ("Амилаза", "Ед/л", 28, 100), ("Липаза", "Ед/л", 13, 60),
+    ("Фибриноген", "г/л", 2, 4), ("МНО", "", 0.85, 1.15),
+    ("АЧТВ", "сек", 25, 37), ("Протромбин", "%", 70, 120),
+    ("Инсулин", "мкЕд/мл", 2.6, 24.9), ("Кортизол", "нмоль/л", 171, 536),
+    ("Пролактин", "мЕд/л", 64, 395), ("Тестостерон", "нмоль/л", 8.6, 29),
+    ("Эстрадиол", "пмоль/л", 40, 160), ("ПСА общий", "нг/мл", 0, 4),
+]
+
+# Минимальный PDF, хранимый в MinIO для засеянных документов
+SEED_PDF = (
+    b"%PDF-1.4\n1 0 obj<</Type/Catalog/Pages 2 0 R>>endobj\n"
+    b"2 0 obj<</Type/Pages/Kids[3 0 R]/Count 1>>endobj\n"
+    b"3 0 obj<</Type/Page/Parent 2 0 R/MediaBox[0 0 200 200]>>endobj\n"
+    b"trailer<</Root 1 0 R>>\n%%EOF\n"
+)
+
+
+def bench_email(scale: str) -> str:
+    return f"{scale}@{BENCH_EMAIL_DOMAIN}"
+
+
+def pick_document_type(rnd: random.Random, lab_heavy: bool) -> str:
+    if lab_heavy:
+        return "Результаты анализа"
+    roll = rnd.random()
+    for name, share in DOCUMENT_TYPES:
+        if roll < share:
+            return name
+        roll -= share
+    return DOCUMENT_TYPES[-1][0]
+
+
+def make_lab_results(rnd: random.Random, count: int) -> list[dict]:
+    results = []
+    for name, unit, low, high in rnd.sample(ANALYTES, min(count, len(ANALYTES))):
+        value = rnd.uniform(low * 0.8, high * 1.2)
+        flag = "L" if value < low else "H" if value > high else "N"
+        results.append({
+            "test_name": name,
+            "value": f"{value:.2f}",
+            "unit": unit,
+            "reference_range": f"{low}-{high}",
+            "flag": flag,
+        })
+    return results
+
+
+# ---------------------------------------------------------------------------
+# Seed / cleanup
+# ---------------------------------------------------------------------------
+
+async def get_bench_user(scale: str) -> Optional[User]:
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(User).where(User.email == bench_email(scale)))
+        return result.scalar_one_or_none()
+
+
+def _put_seed_objects(object_names: list[str]) -> None:
+    for object_name in object_names:
+        minio_client.put_object(
+            bucket_name=settings.MINIO_BUCKET,
+            object_name=object_name,
+            data=io.BytesIO(SEED_PDF),
+            length=len(SEED_PDF),
+            content_type="application/pdf",
+        )
+
+
+async def seed_scale(scale: str, batch_size: int, with_minio: bool, seed: int) -> None:
+    if await get_bench_user(scale):
+        print(f"  ⏭️  {scale}: пользователь уже засеян")
+        return
+
+    spec = SCALES[scale]
+    lab_heavy = scale.startswith("labs")
+    rnd = random.Random(f"{seed}:{scale}")
+    started = time.perf_counter()
+
+    owner_id = uuid.uuid4()
+    member_ids = [uuid.uuid4(), uuid.uuid4()]
+
+    async with AsyncSessionLocal() as db:
+        await db.execute(insert(User).values([
+            {"id": owner_id, "email": bench_email(scale), "full_name": f"Бенчмарк {scale}",
+             "birth_date": date(1985, 5, 20), "gender": GenderEnum.male, "is_active": True},
+            {"id": member_ids[0], "full_name": f"Бенчмарк {scale} (ребёнок)",
+             "birth_date": date(2015, 3, 1), "gender": GenderEnum.female, "is_active": True},
+            {"id": member_ids[1], "full_name": f"Бенчмарк {scale} (супруг)",
+             "birth_date": date(1987, 9, 9), "gender": GenderEnum.female, "is_active": True},
+        ]))
+        await db.execute(insert(FamilyRelation).values([
+            {"owner_id": owner_id, "member_id": member_ids[0], "relation_type": RelationType.CHILD},
+            {"owner_id": owner_id, "member_id": member_ids[1], "relation_type": RelationType.SPOUSE},
+        ]))
+        await db.commit()
+
+        if with_minio:
+            await asyncio.to_thread(ensure_bucket_exists)
+
+        start_date = date.today() - timedelta(days=365 * 10)
+        total = spec["documents"]
+        lab_count = 0
+        for offset in range(0, total, batch_size):
+            rows, mongo_docs, object_names = [], [], []
+            for _ in range(min(batch_size, total - offset)):
+                document_id = uuid.uuid4()
+                document_type = pick_document_type(rnd, lab_heavy)
+                object_name = f"{owner_id}/{document_id}.pdf"
+                rows.append({
+                    "id": document_id,
+                    "user_id": owner_id,
+                    "original_filename": f"bench_{document_id.hex[:8]}.pdf",
+                    "file_size": len(SEED_PDF),
+                    "file_type": "pdf",
+                    "file_url": f"s3://{settings.MINIO_BUCKET}/{object_name}",
+                    "file_hash": uuid.uuid4().hex + uuid.uuid4().hex,
+                    "document_type": document_type,
+                    "document_date": start_date + timedelta(days=rnd.randrange(365 * 10)),
+                    "patient_name": f"Бенчмарк {scale}",
+                    "medical_facility": rnd.choice(FACILITIES),
+                    "processing_status": "completed",
+                })
+                object_names.append(object_name)
+
+                mongo_doc = {
+                    "document_id": str(document_id),
+                    "user_id": str(owner_id),
+                    "classification": {
+                        "document_subtype": document_type,
+                        "research_area": None,
+                        "specialties": rnd.sample(SPECIALTIES, 2),
+                        "document_language": "ru",
+                        "confidence": 0.9,
+                    },
+                    "extracted_data": {"summary": "Синтетический документ для бенчмарка"},
+                    "ai_response": {"model": "benchmark", "confidence": 0.9},
+                    "created_at": datetime.utcnow(),
+                    "updated_at": datetime.utcnow(),
+                }
+                if document_type == "Результаты анализа":
+                    labs = make_lab_results(rnd, spec["labs_per_document"])
+                    mongo_doc["extracted_data"]["lab_results"] = labs
+                    mongo_doc["ai_response_labs"] = {"model": "benchmark", "count": len(labs)}
+                    lab_count += len(labs)
+                mongo_docs.append(mongo_doc)
+
+            await db.execute(insert(Document).values(rows))
+            await db.commit()
+            await document_metadata_collection.insert_many(mongo_docs, ordered=False)
+            if with_minio:
+                await asyncio.to_thread(_put_seed_objects, object_names)
+            print(f"  ⏳ {scale}: {offset + len(rows)}/{total} документов, {lab_count} анализов")
+
+    print(f"  ✅ {scale}: засеян за {time.perf_counter() - started:.1f} с")
+
+
+def _remove_objects(prefix: str) -> None:
+    for obj in minio_client.list_objects(settings.MINIO_BUCKET, prefix=prefix, recursive=True):
+        minio_client.remove_object(settings.MINIO_BUCKET, obj.object_name)
+
+
+async def cleanup(scales: list[str], with_minio: bool) -> None:
+    for scale in scales:
+        user = await get_bench_user(scale)
+        if not user:
+            continue
+        async with AsyncSessionLocal() as db:
+            relations = await db.execute(
+                select(FamilyRelation.member_id).where(FamilyRelation.owner_id == user.id)
+            )
+            user_ids = [user.id, *relations.scalars().all()]
+            await document_metadata_collection.delete_many(
+                {"user_id": {"$in": [str(uid) for uid in user_ids]}}
+            )
+            # Документы, связи и данные членов семьи удаляются каскадно
+            await db.execute(delete(User).where(User.id.in_(user_ids)))
+            await db.commit()
+        if with_minio:
+            for uid in user_ids:
+                await asyncio.to_thread(_remove_objects, f"{uid}/")
+        print(f"  🗑️  {scale}: удалён")
+
+
+# ---------------------------------------------------------------------------
+# Measurement
+# ---------------------------------------------------------------------------
+
+def make_upload_pdf(marker: str) -> bytes:
+    """Single-page PDF with a text layer; the marker keeps file hashes unique"""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4)
+    y = 800
+    for line in [
+        "Laboratory report / benchmark",
+        f"Sample: {marker}",
+        "Hemoglobin 135 g/L (120-160)",
+        "Leukocytes 6.1 10^9/L (4.0-9.0)",
+        "Glucose 5.2 mmol/L (3.9-6.1)",
+    ]:
+        pdf.drawString(50, y, line)
+        y -= 20
+    pdf.showPage()
+    pdf.save()
+    return buffer.getvalue()
+
+
+def summarize(latencies: list[float], errors: int, elapsed: float) -> dict:
+    if not latencies:
+        return {"requests": 0, "errors": errors}
+    ordered = sorted(latencies)
+
+    def percentile(p: float) -> float:
+        index = min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))
+        return round(ordered[index] * 1000, 2)
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "p50_ms": percentile(50),
+        "p90_ms": percentile(90),
+        "p99_ms": percentile(99),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed > 0 else None,
+    }
+
+
+async def measure(client: httpx.AsyncClient, make_request, requests: int, concurrency: int, warmup: int) -> dict:
+    """Run `requests` calls of make_request(i) with `concurrency` workers"""
+    for i in range(warmup):
+        await make_request(-1 - i)
+
+    latencies: list[float] = []
+    errors = 0
+    counter = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            started = time.perf_counter()
+            try:
+                response = await make_request(i)
+                ok = response.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            latencies.append(time.perf_counter() - started)
+            if not ok:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+
+@asynccontextmanager
+async def open_client(base_url: Optional[str]):
+    if base_url:
+        async with httpx.AsyncClient(base_url=base_url, timeout=120.0) as client:
+            yield client
+        return
+
+    from main import app
+    # ASGITransport не вызывает lifespan - запускаем его вручную
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120.0) as client:
+            yield client
+
+
+async def run_scale(client: httpx.AsyncClient, scale: str, args) -> dict:
+    user = await get_bench_user(scale)
+    if not user:
+        raise RuntimeError(f"{scale} не засеян: python scripts/benchmark_api.py seed --scale {scale}")
+
+    headers = {"Authorization": f"Bearer {create_access_token(data={'sub': str(user.id)})}"}
+    api = "/api/v1"
+
+    def get(path: str, params: Optional[dict] = None):
+        return lambda i: client.get(f"{api}{path}", params=params, headers=headers)
+
+    async def upload(i: int):
+        content = make_upload_pdf(f"{scale}-{uuid.uuid4()}")
+        return await client.post(
+            f"{api}/documents/upload",
+            files={"file": (f"bench_upload_{i}.pdf", content, "application/pdf")},
+            headers=headers,
+        )
+
+    scenarios = {
+        "GET /documents/": get("/documents/", {"limit": 50}),
+        "GET /documents/labs/timeseries": get("/documents/labs/timeseries", {"analyte": "Гемоглобин"}),
+        "GET /documents/labs/analytes": get("/documents/labs/analytes"),
+        "GET /timeline/": get("/timeline/"),
+        "GET /timeline/stats": get("/timeline/stats"),
+        "GET /family/profiles": get("/family/profiles"),
+        "POST /documents/upload": upload,
+    }
+
+    results = {}
+    for name, make_request in scenarios.items():
+        if args.endpoint and not any(part in name for part in args.endpoint):
+            continue
+        is_upload = name.startswith("POST")
+        stats = await measure(
+            client,
+            make_request,
+            requests=args.upload_requests if is_upload else args.requests,
+            concurrency=args.concurrency,
+            warmup=0 if is_upload else args.warmup,
+        )
+        results[name] = stats
+        print(
+            f"  {name:<36} p50 {stats.get('p50_ms', '-'):>9} мс  p99 {stats.get('p99_ms', '-'):>9} мс  "
+            f"{stats.get('throughput_rps', '-'):>8} rps  ошибок: {stats['errors']}"
+        )
+    return results
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_comparison(report: dict, baseline: dict) -> None:
+    print()
+    print(f"Сравнение с {baseline.get('commit') or 'baseline'} (p50 / p99, + = медленнее):")
+    for scale, endpoints in report["scales"].items():
+        for name, stats in endpoints.items():
+            base = baseline.get("scales", {}).get(scale, {}).get(name)
+            if not base or "p50_ms" not in base or "p50_ms" not in stats:
+                continue
+            deltas = [
+                (stats[key] - base[key]) / base[key] * 100 if base[key] else 0.0
+                for key in ("p50_ms", "p99_ms")
+            ]
+            marker = "⚠️ " if max(deltas) > 10 else "  "
+            print(f"{marker}{scale:<9} {name:<36} {deltas[0]:+7.1f}%  {deltas[1]:+7.1f}%")
+
+
+async def run(args) -> bool:
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.utcnow().isoformat() + "Z",
+        "target": args.base_url or "in-process",
+        "ai_backend": settings.AI_BACKEND,
+        "config": {
+            "requests": args.requests,
+            "upload_requests": args.upload_requests,
+            "concurrency": args.concurrency,
+            "warmup": args.warmup,
+        },
+        "scales": {},
+    }
+
+    async with open_client(args.base_url) as client:
+        for scale in args.scale:
+            print(f"📊 {scale}")
+            report["scales"][scale] = await run_scale(client, scale, args)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"💾 Результаты сохранены в {args.output}")
+    else:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print_comparison(report, json.load(f))
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк основных эндпоинтов API')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    seed_parser = subparsers.add_parser('seed', help='Засеять синтетических пользователей')
+    seed_parser.add_argument('--scale', nargs='+', choices=SCALES, default=list(SCALES))
+    seed_parser.add_argument('--batch-size', type=int, default=1000)
+    seed_parser.add_argument('--skip-minio', action='store_true', help='Не загружать файлы в MinIO')
+    seed_parser.add_argument('--seed', type=int, default=42)
+
+    run_parser = subparsers.add_parser('run', help='Замерить задержки')
+    run_parser.add_argument('--scale', nargs='+', choices=SCALES, default=list(SCALES))
+    run_parser.add_argument('--base-url', help='URL запущенного сервера (по умолчанию - в процессе)')
+    run_parser.add_argument('--requests', type=int, default=200, help='Запросов на эндпоинт')
+    run_parser.add_argument('--upload-requests', type=int, default=20)
+    run_parser.add_argument('--concurrency', type=int, default=10)
+    run_parser.add_argument('--warmup', type=int, default=5)
+    run_parser.add_argument('--endpoint', nargs='+', help='Только эндпоинты, содержащие подстроку')
+    run_parser.add_argument('--output', help='Файл для JSON с результатами')
+    run_parser.add_argument('--compare', help='JSON предыдущего прогона для сравнения')
+
+    cleanup_parser = subparsers.add_parser('cleanup', help='Удалить данные бенчмарка')
+    cleanup_parser.add_argument('--scale', nargs='+', choices=SCALES, default=list(SCALES))
+    cleanup_parser.add_argument('--skip-minio', action='store_true')
+
+    args = parser.parse_args()
+
+    print("=" * 80)
+    print("⏱️  БЕНЧМАРК API")
+    print("=" * 80)
+
+    async def dispatch() -> bool:
+        if args.command == 'seed':
+            for scale in args.scale:
+                await seed_scale(scale, args.batch_size, not args.skip_minio, args.seed)
+            return True
+        if args.command == 'cleanup':
+            await cleanup(args.scale, not args.skip_minio)
+            return True
+        return await run(args)
+
+    try:
+        success = asyncio.run(dispatch())
+    except RuntimeError as e:
+        print(f"❌ {e}")
+        success = False
+
+    if not success:
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
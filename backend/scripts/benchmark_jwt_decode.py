@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Микро-бенчмарк накладных расходов на аутентификацию одного запроса.
+
+Сравнивает:
+- python-jose без кэша (старая реализация, если пакет установлен)
+- PyJWT без кэша
+- decode_access_token (PyJWT + LRU-кэш проверенных токенов)
+"""
+
+import os
+import sys
+import time
+import argparse
+
+# Настройки приложения требуют эти переменные, для бенчмарка подойдут заглушки
+for _name in ("DATABASE_URL", "MONGODB_URL", "MINIO_ENDPOINT", "MINIO_ACCESS_KEY",
+              "MINIO_SECRET_KEY", "OPENROUTER_API_KEY"):
+    os.environ.setdefault(_name, "benchmark")
+os.environ.setdefault("JWT_SECRET", "benchmark-secret")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.config import settings
+from app.core.security import (
+    create_access_token,
+    decode_access_token,
+    _decode_access_token_uncached,
+    _token_cache,
+)
+
+
+def measure(name: str, func, token: str, iterations: int) -> float:
+    """Вызывает func(token) iterations раз и печатает среднее время на вызов"""
+    func(token)  # прогрев
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func(token)
+    elapsed = time.perf_counter() - start
+    per_call_us = elapsed / iterations * 1_000_000
+    print(f"  {name:<40} {per_call_us:10.2f} мкс/запрос")
+    return per_call_us
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Бенчмарк декодирования JWT (до/после кэширования)'
+    )
+    parser.add_argument('--iterations', type=int, default=20000)
+    args = parser.parse_args()
+
+    token = create_access_token(data={"sub": "00000000-0000-0000-0000-000000000000"})
+
+    print("=" * 80)
+    print("🔐 БЕНЧМАРК ДЕКОДИРОВАНИЯ JWT")
+    print("=" * 80)
+    print(f"Итераций: {args.iterations}, алгоритм: {settings.JWT_ALGORITHM}")
+    print()
+
+    try:
+        from jose import jwt as jose_jwt
+
+        def jose_decode(t: str):
+            return jose_jwt.decode(t, settings.JWT_SECRET, algorithms=[settings.JWT_ALGORITHM])
+
+        baseline = measure("python-jose (до)", jose_decode, token, args.iterations)
+    except ImportError:
+        print("  python-jose не установлен, базовая линия - PyJWT без кэша")
+        baseline = None
+
+    uncached = measure("PyJWT без кэша", _decode_access_token_uncached, token, args.iterations)
+
+    _token_cache.clear()
+    cached = measure("PyJWT + LRU-кэш (после)", decode_access_token, token, args.iterations)
+
+    print()
+    reference = baseline if baseline is not None else uncached
+    print(f"✅ Ускорение: x{reference / cached:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Запуск локальной заглушки OpenRouter для нагрузочных тестов.
+
+    python scripts/mock_openrouter.py --port 8099 --latency-ms 1500 --jitter-ms 500 --rate-limit-rate 0.05
+
+Backend направляется на заглушку через окружение:
+    OPENROUTER_BASE_URL=http://localhost:8099/api/v1/chat/completions
+
+Записи ответов делаются на реальном API с AI_RECORD_RESPONSES=true и
+читаются из --recordings-dir. Параметры можно менять на лету:
+    curl -X PUT localhost:8099/mock/config -d '{"error_rate": 0.2}' -H 'Content-Type: application/json'
+"""
+
+import os
+import sys
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import uvicorn
+
+from app.mocks.openrouter import MockConfig, create_mock_app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Заглушка OpenRouter chat completions')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--recordings-dir', default='ai_recordings')
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Доля ответов 500')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='Доля ответов 429')
+    parser.add_argument('--retry-after', type=float, default=1.0, help='Retry-After для 429, секунды')
+    parser.add_argument('--no-fallback', action='store_true',
+                        help='404 для промптов без записи вместо синтетического ответа')
+    parser.add_argument('--seed', type=int, help='Seed для воспроизводимых сбоев')
+
+    args = parser.parse_args()
+
+    app = create_mock_app(MockConfig(
+        recordings_dir=args.recordings_dir,
+        latency_ms=args.latency_ms,
+        latency_jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after,
+        fallback=not args.no_fallback,
+        seed=args.seed,
+    ))
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Проверка планов запросов MongoDB.
+
+Для каждой формы запроса из app.db.mongo_indexes.QUERY_SHAPES выполняется
+explain() с реальными user_id/document_id из базы; выводятся стадии
+выигравшего плана и использованные индексы. Запросы, выполняемые полным
+сканированием коллекции (COLLSCAN), отмечаются, и скрипт завершается с
+кодом 1 - его можно запускать в CI или после изменения запросов.
+
+Запуск внутри контейнера backend:
+    python scripts/mongo_query_diagnostics.py [--ensure-indexes]
+"""
+
+import os
+import sys
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.db.mongodb import mongodb_client
+from app.db.mongo_indexes import ensure_indexes, explain_query_shapes
+
+
+async def run(create_indexes: bool) -> int:
+    if create_indexes:
+        await ensure_indexes()
+
+    report = await explain_query_shapes()
+    collscans = 0
+    for entry in report:
+        if "error" in entry:
+            status = "⚠️ "
+        elif entry["collscan"]:
+            status = "❌"
+            collscans += 1
+        else:
+            status = "✅"
+        print(f"{status} {entry['collection']}: {entry['name']}")
+        if "error" in entry:
+            print(f"     ошибка: {entry['error']}")
+        else:
+            print(f"     план: {' → '.join(entry['stages']) or '-'}")
+            if entry["indexes"]:
+                print(f"     индексы: {', '.join(entry['indexes'])}")
+
+    mongodb_client.close()
+    print()
+    if collscans:
+        print(f"❌ Полное сканирование коллекции: {collscans} из {len(report)} запросов")
+        return 1
+    print(f"✅ Все {len(report)} запросов используют индексы")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="explain() для основных запросов MongoDB")
+    parser.add_argument("--ensure-indexes", action="store_true", help="Сначала создать недостающие индексы")
+    args = parser.parse_args()
+
+    print("=" * 80)
+    print("🔍 ПЛАНЫ ЗАПРОСОВ MONGODB")
+    print("=" * 80)
+    sys.exit(asyncio.run(run(args.ensure_indexes)))
+
+
+if __name__ == "__main__":
+    main()
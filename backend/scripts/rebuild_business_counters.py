@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Пересчёт счётчиков бизнес-метрик по текущим данным.
+
+Счётчики поддерживаются триггерами и обычно не требуют пересчёта; скрипт
+нужен после ручных правок данных в обход триггеров (например, при
+восстановлении из дампа с отключёнными триггерами). Во время пересчёта
+запись в users/documents/interpretations/reports блокируется.
+
+Запуск внутри контейнера backend:
+    python scripts/rebuild_business_counters.py
+"""
+
+import os
+import sys
+import asyncio
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.db.postgres import engine
+from app.db.business_counters import install_business_counters, rebuild_business_counters
+
+
+async def run():
+    async with engine.begin() as conn:
+        await install_business_counters(conn)
+        await rebuild_business_counters(conn)
+        result = await conn.exec_driver_sql(
+            "SELECT name, value FROM business_counters WHERE left(name, 1) <> '_' ORDER BY name"
+        )
+        for name, value in result.all():
+            print(f"  {name:<50} {value}")
+    await engine.dispose()
+
+
+def main():
+    print("=" * 80)
+    print("📊 ПЕРЕСЧЁТ СЧЁТЧИКОВ БИЗНЕС-МЕТРИК")
+    print("=" * 80)
+    asyncio.run(run())
+    print("✅ Готово")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Массовая повторная экстракция результатов анализов (административный скрипт).
+
+Запуск внутри контейнера backend:
+    python scripts/reprocess_documents.py --outdated-only
+    python scripts/reprocess_documents.py --model anthropic/claude-3.5-sonnet --date-from 2024-01-01
+    python scripts/reprocess_documents.py --resume <job_id>
+    python scripts/reprocess_documents.py --status <job_id>
+"""
+
+import os
+import sys
+import asyncio
+import argparse
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.reprocessing_service import ReprocessingService, LAB_DOCUMENT_TYPE
+
+
+def print_progress(job: dict):
+    total = job.get("total") or 0
+    percent = job["processed"] / total * 100 if total else 100.0
+    print(
+        f"  ⏳ {job['processed']}/{total} ({percent:.1f}%) - "
+        f"успешно: {job['succeeded']}, ошибок: {job['failed']}, пропущено: {job['skipped']}"
+    )
+
+
+def print_job(job: dict):
+    print(f"Задание: {job['job_id']}")
+    print(f"  Статус: {job['status']}")
+    print(f"  Фильтры: {job['filters']}")
+    print(f"  Цель: модель {job['target']['model']}, промпт {job['target']['prompt_version']}")
+    print_progress(job)
+    for error in job.get("errors", [])[-10:]:
+        print(f"  ❌ {error['document_id']}: {error['error']}")
+
+
+async def run(args):
+    if args.status:
+        job = await ReprocessingService.get_job(args.status)
+        if not job:
+            print(f"❌ Задание {args.status} не найдено")
+            return False
+        print_job(job)
+        return True
+
+    if args.resume:
+        job_id = args.resume
+    else:
+        job_id = await ReprocessingService.create_job(
+            document_type=args.document_type or None,
+            date_from=date.fromisoformat(args.date_from) if args.date_from else None,
+            date_to=date.fromisoformat(args.date_to) if args.date_to else None,
+            model=args.model,
+            outdated_only=args.outdated_only,
+            user_id=args.user_id,
+        )
+        print(f"🆕 Создано задание {job_id}")
+        print(f"   Для продолжения после прерывания: --resume {job_id}")
+
+    print("🔄 Запуск повторной экстракции...")
+    try:
+        job = await ReprocessingService.run_job(
+            job_id,
+            batch_size=args.batch_size,
+            requests_per_minute=args.rpm,
+            on_progress=print_progress,
+        )
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        await ReprocessingService.mark_interrupted(job_id)
+        print(f"\n🛑 Прервано. Продолжить: --resume {job_id}")
+        return False
+
+    print()
+    print_job(job)
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Повторная экстракция результатов анализов для существующих документов'
+    )
+    parser.add_argument('--document-type', default=LAB_DOCUMENT_TYPE,
+                        help='Тип документа (пустая строка - все типы)')
+    parser.add_argument('--date-from', help='document_date от (YYYY-MM-DD)')
+    parser.add_argument('--date-to', help='document_date до (YYYY-MM-DD)')
+    parser.add_argument('--model', help='Только документы, извлечённые этой моделью')
+    parser.add_argument('--outdated-only', action='store_true',
+                        help='Только документы с устаревшей моделью или версией промпта')
+    parser.add_argument('--user-id', help='Ограничить одним пользователем')
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--rpm', type=int, help='Запросов к LLM в минуту')
+    parser.add_argument('--resume', metavar='JOB_ID', help='Продолжить прерванное задание')
+    parser.add_argument('--status', metavar='JOB_ID', help='Показать прогресс задания')
+
+    args = parser.parse_args()
+
+    print("=" * 80)
+    print("🧪 ПОВТОРНАЯ ЭКСТРАКЦИЯ АНАЛИЗОВ")
+    print("=" * 80)
+
+    try:
+        success = asyncio.run(run(args))
+    except KeyboardInterrupt:
+        success = False
+
+    if not success:
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
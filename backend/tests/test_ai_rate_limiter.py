@@ -0,0 +1,89 @@
+"""Regression tests for the OpenRouter circuit breaker half-open probe"""
+
+import asyncio
+import unittest
+
+from app.services.ai_rate_limiter import CircuitBreaker, OpenRouterLimiter
+
+
+class NonRetryableError(Exception):
+    pass
+
+
+def _half_open_limiter() -> OpenRouterLimiter:
+    limiter = OpenRouterLimiter()
+    limiter.breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+    limiter.breaker.record_failure()
+    return limiter
+
+
+class HalfOpenProbeTest(unittest.IsolatedAsyncioTestCase):
+
+    async def _wait_for_half_open(self, limiter: OpenRouterLimiter) -> None:
+        await asyncio.sleep(0.02)
+        self.assertEqual(limiter.breaker.state, "half_open")
+
+    async def _assert_next_call_admitted(self, limiter: OpenRouterLimiter) -> None:
+        async def admit_once():
+            async with limiter.admit(1):
+                limiter.breaker.record_success()
+
+        # Застрявшая проба заставила бы ждать OPENROUTER_CIRCUIT_MAX_WAIT_SECONDS
+        await asyncio.wait_for(admit_once(), timeout=1)
+        self.assertEqual(limiter.breaker.state, "closed")
+
+    async def test_probe_released_on_error_without_result(self):
+        limiter = _half_open_limiter()
+        await self._wait_for_half_open(limiter)
+
+        with self.assertRaises(NonRetryableError):
+            async with limiter.admit(1):
+                raise NonRetryableError()
+
+        await self._assert_next_call_admitted(limiter)
+
+    async def test_probe_released_on_cancellation_during_call(self):
+        limiter = _half_open_limiter()
+        await self._wait_for_half_open(limiter)
+        started = asyncio.Event()
+
+        async def hanging_call():
+            async with limiter.admit(1):
+                started.set()
+                await asyncio.sleep(3600)
+
+        task = asyncio.create_task(hanging_call())
+        await started.wait()
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+
+        await self._assert_next_call_admitted(limiter)
+
+    async def test_probe_released_on_cancellation_while_waiting_for_tokens(self):
+        limiter = _half_open_limiter()
+        await self._wait_for_half_open(limiter)
+        limiter.tokens._tokens = 0
+
+        task = asyncio.create_task(limiter.admit(limiter.tokens.capacity).__aenter__())
+        await asyncio.sleep(0.01)
+        self.assertFalse(task.done())
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+
+        limiter.tokens._tokens = limiter.tokens.capacity
+        await self._assert_next_call_admitted(limiter)
+
+    async def test_failed_probe_reopens_circuit(self):
+        limiter = _half_open_limiter()
+        await self._wait_for_half_open(limiter)
+
+        async with limiter.admit(1):
+            limiter.breaker.record_failure()
+
+        self.assertEqual(limiter.breaker.state, "open")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,10 +1,15 @@
-import { useState } from 'react'
+import { useEffect, useState } from 'react'
 import { useQuery, useMutation, useQueryClient } from '@tanstack/react-query'
 import { FileText, Download, Plus, Filter } from 'lucide-react'
 import { toast } from 'sonner'
 import { reportsService } from '../services/reports'
 import { format } from 'date-fns'
-import type { ReportFilters } from '../types'
+import type { Report, ReportFilters } from '../types'
+
+const REPORT_POLL_INTERVAL_MS = 3000
+
+const isReportActive = (report: Report) =>
+  report.status === 'pending' || report.status === 'processing'
 
 export default function Reports() {
   const queryClient = useQueryClient()
@@ -16,11 +21,31 @@ export default function Reports() {
     queryFn: () => reportsService.getReports(),
   })
 
+  // Генерация идёт в фоне: опрашиваем отчёт, пока он в очереди или генерируется
+  const activeReportId = reports?.find(isReportActive)?.id
+  const { data: activeReport } = useQuery({
+    queryKey: ['report', activeReportId],
+    queryFn: () => reportsService.getReport(activeReportId!),
+    enabled: !!activeReportId,
+    refetchInterval: (query) =>
+      query.state.data && !isReportActive(query.state.data) ? false : REPORT_POLL_INTERVAL_MS,
+  })
+
+  useEffect(() => {
+    if (!activeReport || isReportActive(activeReport)) return
+    if (activeReport.status === 'completed') {
+      toast.success('Отчёт готов')
+    } else {
+      toast.error(activeReport.error_message || 'Ошибка генерации отчёта')
+    }
+    queryClient.invalidateQueries({ queryKey: ['reports'] })
+  }, [activeReport, queryClient])
+
   const generateMutation = useMutation({
     mutationFn: reportsService.generateReport,
-    onSuccess: () => {
+    onSuccess: (data) => {
       queryClient.invalidateQueries({ queryKey: ['reports'] })
-      toast.success('Отчёт успешно сгенерирован')
+      toast.success(data.message)
       setShowGenerateForm(false)
       setFilters({})
     },
@@ -153,7 +178,7 @@ export default function Reports() {
               className="px-3 sm:px-5 py-2 sm:py-2.5 bg-[#4A90E2] text-white rounded-lg text-xs sm:text-sm font-medium hover:bg-[#3A7BC8] disabled:opacity-50 disabled:cursor-not-allowed transition-colors shadow-lg shadow-blue-200/50"
             >
               {generateMutation.isPending
-                ? '⏳ Генерация...'
+                ? '⏳ Отправка...'
                 : '✨ Сгенерировать отчёт'}
             </button>
           </div>
@@ -190,6 +215,29 @@ export default function Reports() {
                           <span className="font-medium text-gray-500">Создан:</span>
                           <span>{format(new Date(report.created_at), 'dd.MM.yyyy, HH:mm')}</span>
                         </div>
+                        <div className="flex items-center gap-1">
+                          <span className="font-medium text-gray-500">Статус:</span>
+                          <span
+                            className={`inline-flex items-center px-2 py-0.5 rounded-full text-xs font-semibold ${
+                              report.status === 'completed'
+                                ? 'bg-green-100 text-green-700'
+                                : report.status === 'processing'
+                                ? 'bg-yellow-100 text-yellow-700'
+                                : report.status === 'failed'
+                                ? 'bg-red-100 text-red-700'
+                                : 'bg-gray-100 text-gray-700'
+                            }`}
+                            title={report.status === 'failed' ? report.error_message : undefined}
+                          >
+                            {report.status === 'completed'
+                              ? '✓ Готов'
+                              : report.status === 'processing'
+                              ? '⏳ Генерация'
+                              : report.status === 'failed'
+                              ? '✗ Ошибка'
+                              : '⋯ В очереди'}
+                          </span>
+                        </div>
                         {report.report_type && (
                           <div className="flex items-center gap-1">
                             <span className="font-medium text-gray-500">Тип:</span>
@@ -209,15 +257,17 @@ export default function Reports() {
                       </div>
                     </div>
                   </div>
-                  <div className="flex-shrink-0">
-                    <button
-                      onClick={() => handleDownload(report.id)}
-                      className="inline-flex items-center justify-center gap-1.5 sm:gap-2 px-3 sm:px-4 py-1.5 sm:py-2 bg-green-600 text-white rounded-lg hover:bg-green-700 font-medium text-xs sm:text-sm transition-colors shadow-lg shadow-green-200/50 w-full sm:w-auto"
-                    >
-                      <Download className="h-3.5 w-3.5 sm:h-4 sm:w-4" />
-                      Скачать
-                    </button>
-                  </div>
+                  {report.status === 'completed' && (
+                    <div className="flex-shrink-0">
+                      <button
+                        onClick={() => handleDownload(report.id)}
+                        className="inline-flex items-center justify-center gap-1.5 sm:gap-2 px-3 sm:px-4 py-1.5 sm:py-2 bg-green-600 text-white rounded-lg hover:bg-green-700 font-medium text-xs sm:text-sm transition-colors shadow-lg shadow-green-200/50 w-full sm:w-auto"
+                      >
+                        <Download className="h-3.5 w-3.5 sm:h-4 sm:w-4" />
+                        Скачать
+                      </button>
+                    </div>
+                  )}
                 </div>
               </div>
             ))
@@ -1,9 +1,9 @@
 import api from '../lib/api'
-import type { Report, ReportFilters } from '../types'
+import type { Report, ReportFilters, ReportStatus } from '../types'
 
 interface GenerateReportResponse {
   report_id: string
-  status: string
+  status: ReportStatus
   message: string
 }
 
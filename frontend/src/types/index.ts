@@ -129,14 +129,19 @@ export interface TimelineResponse {
   events: TimelineEvent[]
 }
 
+export type ReportStatus = 'pending' | 'processing' | 'completed' | 'failed'
+
 export interface Report {
   id: string
   user_id: string
   report_type?: string
+  status: ReportStatus
+  error_message?: string
   filters_applied: string
-  file_url: string
+  file_url?: string
   file_size?: number
   created_at: string
+  completed_at?: string
 }
 
 export interface ReportFilters {